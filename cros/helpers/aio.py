@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" asyncio interface to the EC commands and the sysfs helpers, to monitor
+    or load many MCUs and sensors from a single event loop, e.g.::
+
+        async def hello_all(devices):
+            param, resp = ec_params_hello(), ec_response_hello()
+            ...
+            return await asyncio.gather(*(
+                aio.send_ec_command(dev, EC_CMD_HELLO, param, resp,
+                                    timeout=1.0)
+                for dev in devices))
+
+    The MCU character devices only offer a blocking ioctl, and sysfs reads
+    may wait for the EC, so the blocking calls run in an executor: the
+    default executor of the loop unless another one is given. Commands to
+    the same MCU are serialized by a per-device lock, commands to
+    different MCUs run concurrently.
+"""
+
+import asyncio
+import weakref
+
+from cros.helpers import ec_cmd
+from cros.helpers.sysfs import sysfs_read_attributes, sysfs_wait_for
+
+# event loop -> {device path: AsyncECDevice}
+AIO_DEVICES = weakref.WeakKeyDictionary()
+
+
+class AsyncECDevice:
+    """ Awaitable commands to the 'dev' MCU (e.g. /dev/cros_ec) through its
+        pooled CrosECDevice, run in 'executor'.
+    """
+
+    def __init__(self, dev, executor=None):
+        self.dev = dev
+        self.executor = executor
+        self.lock = asyncio.Lock()
+
+    def _send(self, command, param, resp, version):
+        cmd = ec_cmd.get_ec_device(self.dev).send_command(command, param,
+                                                           resp, version)
+        return cmd.result
+
+    async def send_command(self, command, param=None, resp=None,
+                           version=ec_cmd.EC_VER_DEFAULT, timeout=None):
+        """ Sends 'command', copying 'param' in and the answer back to
+            'resp', and returns the EC result code. 'version' is sent
+            as by CrosECDevice.send_command().
+
+            Raises TimeoutError if no answer came within 'timeout' seconds.
+            The ioctl cannot be interrupted: the device stays locked until
+            it returns, and 'resp' may still be written meanwhile.
+        """
+        loop = asyncio.get_running_loop()
+        await self.lock.acquire()
+        try:
+            future = loop.run_in_executor(self.executor, self._send, command,
+                                          param, resp, version)
+        except BaseException:
+            self.lock.release()
+            raise
+        future.add_done_callback(self._done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{self.dev}: no answer to command "
+                               f"{command:#x} after {timeout}s") from None
+
+    def _done(self, future):
+        self.lock.release()
+        if not future.cancelled():
+            # retrieved here when the caller gave up on a timeout
+            future.exception()
+
+
+def get_async_ec_device(dev, executor=None):
+    """ Returns the AsyncECDevice of 'dev' for the running event loop, so
+        that all the coroutines of the loop share its lock. 'executor' is
+        only used when the device is first requested.
+    """
+    devices = AIO_DEVICES.setdefault(asyncio.get_running_loop(), {})
+    device = devices.get(dev)
+    if device is None:
+        device = devices[dev] = AsyncECDevice(dev, executor)
+    return device
+
+
+async def send_ec_command(dev, command, param=None, resp=None,
+                          version=ec_cmd.EC_VER_DEFAULT, timeout=None):
+    """ Awaitable send_ec_command(), returning the EC result code. See
+        AsyncECDevice.send_command().
+    """
+    return await get_async_ec_device(dev).send_command(command, param, resp,
+                                                       version, timeout)
+
+
+async def _run(executor, timeout, func, *args):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, func, *args)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"{func.__name__} did not complete after "
+                           f"{timeout}s") from None
+
+
+async def read_attributes(dev, attrs, cache=False, timeout=None,
+                          executor=None):
+    """ Awaitable sysfs_read_attributes(). """
+    return await _run(executor, timeout, sysfs_read_attributes, dev, attrs,
+                      cache)
+
+
+async def wait_for(path, predicate, timeout=1.0, executor=None):
+    """ Awaitable sysfs_wait_for(), raising TimeoutError after 'timeout'
+        seconds.
+    """
+    return await _run(executor, None, sysfs_wait_for, path, predicate,
+                      timeout)
+
+
+async def watch_attributes(dev, attrs, interval, executor=None):
+    """ Reads the attributes 'attrs' of 'dev' every 'interval' seconds,
+        keeping them open, and yields each SysfsAttributes. The reads are
+        scheduled at fixed times, a slow read does not shift the next ones.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    n = 0
+    while True:
+        yield await read_attributes(dev, attrs, True, executor=executor)
+        n += 1
+        delay = start + n * interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
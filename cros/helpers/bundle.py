@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import io
+import os
+import tarfile
+import time
+
+from cros.helpers import ec_cmd
+from cros.helpers.pwm import DEBUGFS_PWM
+from cros.helpers.rootfs import rootfs_path
+from cros.helpers.sysfs import SYSFS_INDEXED_PATHS
+
+# Single files captured as they are.
+CAPTURE_FILES = [
+    "/proc/version",
+    "/proc/config.gz",
+    ec_cmd.BOOT_ID_PATH,
+    DEBUGFS_PWM,
+]
+
+# Device nodes are captured as empty placeholder files, so that tests
+# checking for their presence behave as on the captured board.
+CAPTURE_DEVICES = [
+    "/dev/cros_*",
+    "/dev/iio:device*",
+    "/dev/rtc*",
+]
+
+# Sub directories of a device that are followed, everything deeper and
+# every symlink (device, subsystem, driver...) is left out.
+CAPTURE_DEPTH = 2
+
+# sysfs attributes are at most one page long.
+ATTRIBUTE_MAX_SIZE = 4096
+
+
+def _read_attribute(path):
+    """ Returns the content of an attribute, or b'' when it cannot be read
+        (e.g. write-only attributes).
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return b""
+    try:
+        return os.read(fd, ATTRIBUTE_MAX_SIZE)
+    except OSError:
+        return b""
+    finally:
+        os.close(fd)
+
+
+def _read_file(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+class BundleWriter:
+    """ Writes system files into a compressed tar bundle, at their system
+        path relative to the bundle root. Files are read from the
+        configured root filesystem.
+    """
+
+    def __init__(self, output):
+        self.mtime = time.time()
+        self._tar = tarfile.open(output, "w:xz")
+        self._dirs = set()
+
+    def close(self):
+        self._tar.close()
+
+    def _add_dirs(self, arcname):
+        parent = os.path.dirname(arcname)
+        if not parent or parent in self._dirs:
+            return
+        self._add_dirs(parent)
+        self.add_dir(parent)
+
+    def add_dir(self, arcname, mode=0o755):
+        if arcname in self._dirs:
+            return
+        self._add_dirs(arcname)
+        info = tarfile.TarInfo(arcname)
+        info.type = tarfile.DIRTYPE
+        info.mode = mode
+        info.mtime = self.mtime
+        self._tar.addfile(info)
+        self._dirs.add(arcname)
+
+    def add_file(self, arcname, data, mode=0o644):
+        self._add_dirs(arcname)
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mode = mode
+        info.mtime = self.mtime
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _arcname(self, path):
+        return path.lstrip("/")
+
+    def capture_file(self, path):
+        src = rootfs_path(path)
+        if not os.path.isfile(src):
+            return
+        try:
+            data = _read_file(src)
+        except OSError:
+            return
+        self.add_file(self._arcname(path), data)
+
+    def capture_device_node(self, path):
+        self.add_file(self._arcname(path), b"", mode=0o600)
+
+    def capture_device(self, path, depth=CAPTURE_DEPTH):
+        """ Captures a sysfs device directory, following symlinks only for
+            the directory itself.
+        """
+        src = rootfs_path(path)
+        self.add_dir(self._arcname(path))
+        try:
+            entries = list(os.scandir(src))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            p = os.path.join(path, entry.name)
+            mode = entry.stat(follow_symlinks=False).st_mode & 0o777
+            if entry.is_dir(follow_symlinks=False):
+                if depth > 1:
+                    self.capture_device(p, depth - 1)
+            elif entry.is_file(follow_symlinks=False):
+                self.add_file(self._arcname(p),
+                              _read_attribute(entry.path), mode=mode)
+
+    def capture_class(self, path):
+        src = rootfs_path(path)
+        self.add_dir(self._arcname(path))
+        try:
+            devices = sorted(os.listdir(src))
+        except OSError:
+            return
+        for devname in devices:
+            self.capture_device(os.path.join(path, devname))
+
+
+def _prime_ec_features():
+    """ Queries the feature map of every MCU, so that the feature store of
+        the current boot is part of the capture.
+    """
+    for dev in sorted(glob.glob(rootfs_path("/dev/cros_*"))):
+        try:
+            ec_cmd.get_ec_features(os.path.join("/dev", os.path.basename(dev)))
+        except OSError:
+            pass
+
+
+def capture_bundle(output):
+    """ Snapshots the nodes used by the test suite into the 'output'
+        bundle (a .tar.xz file).
+    """
+    _prime_ec_features()
+
+    writer = BundleWriter(output)
+    try:
+        for path in SYSFS_INDEXED_PATHS:
+            writer.capture_class(path)
+        for path in CAPTURE_FILES:
+            writer.capture_file(path)
+        for pattern in CAPTURE_DEVICES:
+            for dev in sorted(glob.glob(rootfs_path(pattern))):
+                writer.capture_device_node(
+                    os.path.join("/dev", os.path.basename(dev)))
+        store = rootfs_path(ec_cmd.ECFEATURES_STORE)
+        if os.path.isdir(store):
+            for name in sorted(os.listdir(store)):
+                writer.capture_file(os.path.join(ec_cmd.ECFEATURES_STORE, name))
+    finally:
+        writer.close()
+
+
+def extract_bundle(bundle, dest):
+    """ Extracts 'bundle' into 'dest', which can then be used as root
+        filesystem for the test suite.
+    """
+    with tarfile.open(bundle) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(dest, filter="data")
+        else:
+            tar.extractall(dest)
+    return dest
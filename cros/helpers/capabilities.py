@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Declarations of what a test needs from the system under test.
+
+    Test classes and methods declare their requirements with the requires_*
+    decorators. Each requirement is checked once per run and the result
+    cached, and the test loader of :mod:`cros.tests` reports the tests with
+    unmet requirements as skipped without running them. Tests run directly
+    by name check their requirements before running.
+"""
+
+import abc
+import ast
+import fnmatch
+import functools
+import unittest
+
+from cros.helpers import ec_cmd
+from cros.helpers.kernel import get_kernel_info
+from cros.helpers.sysfs import sysfs_find_devices, sysfs_index
+
+# requirement key -> True if met
+CAPABILITIES = {}
+
+
+class Requirement(abc.ABC):
+    """ A condition on the system under test. Subclasses define 'key', which
+        identifies the condition, check() and describe().
+    """
+
+    key = None
+
+    @abc.abstractmethod
+    def check(self):
+        """ Returns true if the requirement is met. """
+
+    @abc.abstractmethod
+    def describe(self):
+        """ Returns why the requirement is not met. """
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.key[1:]!r}"
+
+
+class DevicePresent(Requirement):
+    """ A device node, e.g. /dev/cros_fp, possibly the placeholder of a
+        replayed bundle. MCUs answered by an emulator are present too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = ("device", path)
+
+    def check(self):
+        return ec_cmd.ec_device_node_exists(self.path)
+
+    def describe(self):
+        return f"{self.path} not found"
+
+
+class SysfsDevices(Requirement):
+    """ At least one device under the sysfs 'path', e.g. /sys/class/rtc.
+        If 'name' is given, a device must match it as sysfs_find_devices()
+        does.
+    """
+
+    def __init__(self, path, name=None, check_devtype=False):
+        self.path = path
+        self.name = name
+        self.check_devtype = check_devtype
+        self.key = ("sysfs", path, name, check_devtype)
+
+    def check(self):
+        if self.name is None:
+            return bool(sysfs_index().devices(self.path))
+        return bool(sysfs_find_devices(self.path, self.name,
+                                       self.check_devtype))
+
+    def describe(self):
+        if self.name is None:
+            return f"No device in {self.path}"
+        return f"No {self.name} found in {self.path}"
+
+
+def _feature_name(feature):
+    for name, value in vars(ec_cmd).items():
+        if name.startswith("EC_FEATURE_") and value == feature:
+            return name
+    return f"EC feature {feature}"
+
+
+class ECFeature(Requirement):
+    """ A feature bit (EC_FEATURE_*) reported by the 'dev' MCU. """
+
+    def __init__(self, feature, dev="/dev/cros_ec"):
+        self.feature = feature
+        self.dev = dev
+        self.key = ("feature", feature, dev)
+
+    def check(self):
+        if not ec_cmd.ec_device_present(self.dev):
+            return False
+        try:
+            return ec_cmd.is_feature_supported(self.feature, self.dev)
+        except OSError:
+            return False
+
+    def describe(self):
+        return f"{_feature_name(self.feature)} not supported by {self.dev}"
+
+
+class KernelRange(Requirement):
+    """ A running kernel version in [low, high), bounds being (version,
+        major, minor) tuples or None.
+    """
+
+    def __init__(self, low=None, high=None):
+        self.low = None if low is None else tuple(low)
+        self.high = None if high is None else tuple(high)
+        self.key = ("kernel", self.low, self.high)
+
+    def check(self):
+        return get_kernel_info().in_range(self.low, self.high)
+
+    def describe(self):
+        low = ".".join(map(str, self.low)) if self.low else ""
+        high = ".".join(map(str, self.high)) if self.high else ""
+        return f"Kernel {get_kernel_info().release} not in [{low}, {high})"
+
+
+def requirement_met(requirement):
+    """ Returns true if 'requirement' is met, checking it only once. """
+    met = CAPABILITIES.get(requirement.key)
+    if met is None:
+        met = CAPABILITIES[requirement.key] = bool(requirement.check())
+    return met
+
+
+def capabilities_refresh():
+    """ Forgets the checked requirements, e.g. after the system changed. """
+    CAPABILITIES.clear()
+
+
+def unmet_requirements(requirements):
+    """ Returns the descriptions of the unmet 'requirements'. """
+    return [r.describe() for r in requirements if not requirement_met(r)]
+
+
+def test_requirements(test):
+    """ Returns the requirements of the 'test' case, its class ones first. """
+    method = getattr(test, getattr(test, "_testMethodName", ""), None)
+    return (getattr(type(test), "cros_requirements", ()) +
+            getattr(method, "cros_requirements", ()))
+
+
+def _skip_unmet(test, requirements):
+    unmet = unmet_requirements(requirements)
+    if unmet:
+        test.skipTest(", ".join(unmet))
+
+
+def requires(*requirements):
+    """ Decorator declaring the requirements of a test method or class. """
+    def decorator(obj):
+        if isinstance(obj, type):
+            if "cros_requirements" not in vars(obj):
+                setup = obj.setUp
+
+                @functools.wraps(setup)
+                def setUp(self):
+                    _skip_unmet(self, type(self).cros_requirements)
+                    setup(self)
+                obj.setUp = setUp
+            obj.cros_requirements = \
+                getattr(obj, "cros_requirements", ()) + requirements
+            return obj
+
+        if getattr(obj, "cros_requires_wrapper", False):
+            obj.cros_requirements += requirements
+            return obj
+
+        @functools.wraps(obj)
+        def wrapper(self, *args, **kwargs):
+            _skip_unmet(self, wrapper.cros_requirements)
+            return obj(self, *args, **kwargs)
+        wrapper.cros_requirements = \
+            getattr(obj, "cros_requirements", ()) + requirements
+        wrapper.cros_requires_wrapper = True
+        return wrapper
+    return decorator
+
+
+def requires_device(path):
+    """ Decorator declaring that a test needs the device node 'path'. """
+    return requires(DevicePresent(path))
+
+
+def requires_sysfs(path, name=None, check_devtype=False):
+    """ Decorator declaring that a test needs a device under the sysfs
+        'path', see SysfsDevices.
+    """
+    return requires(SysfsDevices(path, name, check_devtype))
+
+
+def requires_ec_feature(feature, dev="/dev/cros_ec"):
+    """ Decorator declaring that a test needs the EC 'feature'. """
+    return requires(ECFeature(feature, dev))
+
+
+def requires_kernel(low=None, high=None):
+    """ Decorator declaring that a test needs a kernel in [low, high). """
+    return requires(KernelRange(low, high))
+
+
+class UnmetRequirementsTest(unittest.TestCase):
+    """ Stands for a test with unmet requirements, under the same id, and
+        is reported as skipped.
+    """
+
+    def __init__(self, test_id, reasons, description=None):
+        super().__init__("runTest")
+        self.test_id = test_id
+        self.reasons = list(reasons)
+        self.description = description
+
+    def runTest(self):
+        self.skipTest(", ".join(self.reasons))
+
+    def id(self):
+        return self.test_id
+
+    def __str__(self):
+        classname, _, name = self.test_id.rpartition(".")
+        return f"{name} ({classname})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.test_id == other.test_id
+
+    def __hash__(self):
+        return hash((type(self), self.test_id))
+
+    def shortDescription(self):
+        return self.description
+
+
+def _first_line(doc):
+    return doc.strip().splitlines()[0] if doc else None
+
+
+def test_ids_from_source(path, module, loader):
+    """ Returns [(class name, [(test id, description)])] of the test methods
+        defined in the source of 'module' at 'path', without importing it.
+        Classes with a base named *TestCase are test classes.
+    """
+    with open(path) as fh:
+        tree = ast.parse(fh.read(), path)
+    classes = []
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        bases = [ast.unparse(b) for b in node.bases]
+        if not any(b.endswith("TestCase") for b in bases):
+            continue
+        tests = []
+        for item in node.body:
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)) and \
+               item.name.startswith(loader.testMethodPrefix):
+                test_id = f"{module}.{node.name}.{item.name}"
+                if loader_selects(loader, test_id):
+                    tests.append((test_id, _first_line(ast.get_docstring(item))))
+        classes.append((node.name, sorted(tests)))
+    return classes
+
+
+def loader_selects(loader, test_id):
+    """ Returns true if the -k patterns of 'loader' select 'test_id'. """
+    patterns = getattr(loader, "testNamePatterns", None)
+    if not patterns:
+        return True
+    return any(fnmatch.fnmatchcase(test_id, p) for p in patterns)
+
+
+def gate_tests(suite):
+    """ Returns 'suite' with the tests whose requirements are unmet replaced
+        by UnmetRequirementsTest placeholders.
+    """
+    gated = unittest.TestSuite()
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            gated.addTest(gate_tests(test))
+            continue
+        unmet = unmet_requirements(test_requirements(test))
+        if unmet:
+            test = UnmetRequirementsTest(test.id(), unmet,
+                                         test.shortDescription())
+        gated.addTest(test)
+    return gated
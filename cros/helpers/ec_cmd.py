@@ -2,24 +2,50 @@
 # -*- coding: utf-8 -*-
 
 from ctypes import addressof
-from ctypes import c_ubyte, c_uint8, c_uint32, c_uint64
+from ctypes import c_ubyte, c_uint8, c_uint16, c_uint32
 from ctypes import memmove
 from ctypes import sizeof
 from ctypes import Structure
+import atexit
+import errno
 import fcntl
+import functools
+import glob
+import json
+import os
+import stat
+import tempfile
+import threading
+
+from cros.helpers.rootfs import rootfs_path
 
 
 EC_HOST_PARAM_SIZE = 0xFC
+# sizes of struct ec_host_request and struct ec_host_response (protocol v3)
+EC_HOST_REQUEST_HEADER_SIZE = 8
+EC_HOST_RESPONSE_HEADER_SIZE = 8
 EC_DEV_IOCXCMD = 0xC014EC00  # _IOWR(EC_DEV_IOC, 0, struct cros_ec_command)
 
 # EC commands
 EC_CMD_PROTO_VERSION = 0x0000
 EC_CMD_HELLO = 0x0001
 EC_CMD_GET_VERSION = 0x0002
+EC_CMD_GET_CMD_VERSIONS = 0x0008
+EC_CMD_GET_PROTOCOL_INFO = 0x000B
 EC_CMD_GET_FEATURES = 0x000D
 EC_CMD_REBOOT = 0x00D1
+EC_CMD_REBOOT_EC = 0x00D2
+
+# Version of a command sent when the caller does not name one, without
+# querying the MCU.
+EC_VER_DEFAULT = 0
+
+# Features are cached per MCU device path, and persisted for the current
+# boot so that later test processes do not query the EC again.
+ECFEATURES_CACHE = {}
+ECFEATURES_STORE = "/run/cros-ec-tests"
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
 
-ECFEATURES_CACHE = -1
 # EC features
 EC_FEATURE_LIMITED = 0
 EC_FEATURE_FLASH = 1
@@ -62,6 +88,16 @@ EC_FEATURE_REFINED_TABLET_MODE_HYSTERESIS = 37
 EC_FEATURE_SCP = 39
 EC_FEATURE_ISH = 40
 
+# enum ec_status
+EC_RES_SUCCESS = 0
+EC_RES_INVALID_COMMAND = 1
+EC_RES_ERROR = 2
+EC_RES_INVALID_PARAM = 3
+EC_RES_ACCESS_DENIED = 4
+EC_RES_INVALID_RESPONSE = 5
+EC_RES_INVALID_VERSION = 6
+EC_RES_BUSY = 10
+
 # enum ec_current_image
 EC_IMAGE_UNKNOWN = 0
 EC_IMAGE_RO = 1
@@ -79,6 +115,20 @@ class cros_ec_command(Structure):
     ]
 
 
+@functools.lru_cache(maxsize=None)
+def cros_ec_command_type(size):
+    """ Returns the cros_ec_command structure with a 'size' bytes data area.
+        The kernel only copies the data actually sent and received, so the
+        area can be larger than EC_HOST_PARAM_SIZE.
+    """
+    if size <= EC_HOST_PARAM_SIZE:
+        return cros_ec_command
+
+    class cros_ec_command_large(Structure):
+        _fields_ = cros_ec_command._fields_[:-1] + [("data", c_uint8 * size)]
+    return cros_ec_command_large
+
+
 class ec_params_hello(Structure):
     _fields_ = [("in_data", c_uint32)]
 
@@ -96,8 +146,29 @@ class ec_response_get_version(Structure):
     ]
 
 
+class ec_response_proto_version(Structure):
+    _fields_ = [("version", c_uint32)]
+
+
+class ec_params_get_cmd_versions_v1(Structure):
+    _fields_ = [("cmd", c_uint16)]
+
+
+class ec_response_get_cmd_versions(Structure):
+    _fields_ = [("version_mask", c_uint32)]
+
+
+class ec_response_get_protocol_info(Structure):
+    _fields_ = [
+        ("protocol_versions", c_uint32),
+        ("max_request_packet_size", c_uint16),
+        ("max_response_packet_size", c_uint16),
+        ("flags", c_uint32),
+    ]
+
+
 class ec_response_get_features(Structure):
-    _fields_ = [("in_data", c_uint64)]
+    _fields_ = [("flags", c_uint32 * 2)]
 
 
 def EC_FEATURE_MASK_0(event_code):
@@ -108,36 +179,522 @@ def EC_FEATURE_MASK_1(event_code):
     return 1 << (event_code - 32)
 
 
-def is_feature_supported(feature):
-    """ Returns true if the Embedded Controller supports the specified
-        'feature'.
+class IoctlTransport:
+    """ Sends commands to an MCU character device (e.g. /dev/cros_ec) with
+        the EC_DEV_IOCXCMD ioctl.
+
+        The device is opened once and the file descriptor is kept until
+        close() is called, so tight command loops do not pay for the
+        open/close path of the driver on every ioctl. A descriptor closed
+        while commands are in flight on it, e.g. by a reboot test, is only
+        closed once they return, so that its number is not reused under
+        them.
     """
-    global ECFEATURES_CACHE
 
-    if ECFEATURES_CACHE == -1:
-        param, response = None, ec_response_get_features()
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        # descriptor -> commands in flight on it
+        self._users = {}
+        # descriptors closed while in use
+        self._retired = set()
+        self._lock = threading.Lock()
+
+    def fileno(self):
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+            return self._fd
+
+    def open(self):
+        self.fileno()
+
+    def close(self):
+        with self._lock:
+            fd, self._fd = self._fd, None
+            if fd is None:
+                return
+            if fd in self._users:
+                # closed by the last command in flight
+                self._retired.add(fd)
+            else:
+                os.close(fd)
+
+    def _acquire(self):
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+            fd = self._fd
+            self._users[fd] = self._users.get(fd, 0) + 1
+            return fd
+
+    def _release(self, fd):
+        with self._lock:
+            self._users[fd] -= 1
+            if self._users[fd]:
+                return
+            del self._users[fd]
+            if fd in self._retired:
+                self._retired.remove(fd)
+                os.close(fd)
+
+    def xfer(self, cmd):
+        """ Sends the cros_ec_command 'cmd', the response and the result are
+            written back to it.
+        """
+        fd = self._acquire()
+        try:
+            fcntl.ioctl(fd, EC_DEV_IOCXCMD, cmd)
+        finally:
+            self._release(fd)
+
 
-        cmd = send_ec_command("/dev/cros_ec", EC_CMD_GET_FEATURES, param, response)
-        if cmd.result == 0:
-            ECFEATURES_CACHE = response.in_data
+class ECCommandBuffer:
+    """ A preallocated cros_ec_command. Parameters are serialized straight
+        into its data area through params() views, and responses are read
+        through response() views, without copies nor allocations. Both
+        views share the same memory: the response overwrites the
+        parameters.
+    """
+
+    def __init__(self, size=EC_HOST_PARAM_SIZE):
+        self.size = max(size, EC_HOST_PARAM_SIZE)
+        self.cmd = cros_ec_command_type(self.size)()
+        self._views = {}
+
+    def _view(self, struct_type):
+        view = self._views.get(struct_type)
+        if view is None:
+            view = self._views[struct_type] = struct_type.from_buffer(
+                self.cmd.data)
+        return view
+
+    def params(self, struct_type):
+        """ Returns a 'struct_type' view to fill the parameters in. """
+        return self._view(struct_type)
+
+    def response(self, struct_type):
+        """ Returns a 'struct_type' view over the response. """
+        return self._view(struct_type)
+
+    def is_view(self, obj):
+        """ Returns true if 'obj' is a view over this buffer. """
+        return addressof(obj) == addressof(self.cmd.data)
+
+
+class ECProtocolInfo:
+    """ The protocol limits of an MCU, from EC_CMD_GET_PROTOCOL_INFO. MCUs
+        not supporting it (protocol v2) are limited to EC_HOST_PARAM_SIZE.
+    """
+
+    def __init__(self, protocol_versions=0, max_request_packet_size=0,
+                 max_response_packet_size=0):
+        self.protocol_versions = protocol_versions
+        if max_request_packet_size:
+            self.max_param_size = (max_request_packet_size -
+                                   EC_HOST_REQUEST_HEADER_SIZE)
+        else:
+            self.max_param_size = EC_HOST_PARAM_SIZE
+        if max_response_packet_size:
+            self.max_response_size = (max_response_packet_size -
+                                      EC_HOST_RESPONSE_HEADER_SIZE)
         else:
-            return False
+            self.max_response_size = EC_HOST_PARAM_SIZE
+
+    def __eq__(self, other):
+        return (isinstance(other, ECProtocolInfo) and
+                vars(self) == vars(other))
+
+    def __repr__(self):
+        return (f"ECProtocolInfo(versions={self.protocol_versions:#x}, "
+                f"max_param_size={self.max_param_size}, "
+                f"max_response_size={self.max_response_size})")
+
+
+class CrosECDevice:
+    """ A managed handle on an MCU, sending commands over a transport. By
+        default the transport is an IoctlTransport on the 'path' character
+        device. A handle is safe to share between threads, each thread
+        sends its commands from its own ECCommandBuffer.
+
+        The protocol limits and the versions of each command are queried
+        once and cached. The cache is dropped when the MCU reboots, as the
+        image it jumps to may speak another protocol.
+    """
+
+    def __init__(self, path, transport=None):
+        self.path = path
+        self.transport = IoctlTransport(path) if transport is None else transport
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._protocol = None
+        self._cmd_versions = {}
+
+    def buffer(self, size=EC_HOST_PARAM_SIZE):
+        """ Returns the command buffer of the calling thread, with a data
+            area of at least 'size' bytes.
+        """
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.size < size:
+            buf = self._local.buffer = ECCommandBuffer(size)
+        return buf
+
+    def _query(self, command, param, resp, version):
+        """ Sends a command querying the protocol of the MCU from a buffer
+            of its own, so that the views over the buffer of the calling
+            thread, possibly filled already, stay intact.
+        """
+        buf = getattr(self._local, "query_buffer", None)
+        if buf is None:
+            buf = self._local.query_buffer = ECCommandBuffer()
+        return self._send(command, param, resp, version, buf)
+
+    def protocol_info(self):
+        """ Returns the cached ECProtocolInfo of the MCU. """
+        with self._lock:
+            protocol = self._protocol
+        if protocol is None:
+            resp = ec_response_get_protocol_info()
+            cmd = self._query(EC_CMD_GET_PROTOCOL_INFO, None, resp, 0)
+            if cmd.result == EC_RES_SUCCESS:
+                protocol = ECProtocolInfo(resp.protocol_versions,
+                                          resp.max_request_packet_size,
+                                          resp.max_response_packet_size)
+            else:
+                protocol = ECProtocolInfo()
+            with self._lock:
+                self._protocol = protocol
+        return protocol
+
+    @property
+    def max_param_size(self):
+        return self.protocol_info().max_param_size
+
+    @property
+    def max_response_size(self):
+        return self.protocol_info().max_response_size
+
+    def command_versions(self, command):
+        """ Returns the cached mask of the versions of 'command' supported
+            by the MCU, 0 if the command is not supported.
+        """
+        with self._lock:
+            mask = self._cmd_versions.get(command)
+        if mask is None:
+            param = ec_params_get_cmd_versions_v1()
+            param.cmd = command
+            resp = ec_response_get_cmd_versions()
+            cmd = self._query(EC_CMD_GET_CMD_VERSIONS, param, resp, 1)
+            if cmd.result == EC_RES_SUCCESS:
+                mask = resp.version_mask
+            elif cmd.result == EC_RES_INVALID_PARAM:
+                mask = 0
+            else:
+                # GET_CMD_VERSIONS v1 not supported, assume version 0
+                mask = 1
+            with self._lock:
+                self._cmd_versions[command] = mask
+        return mask
+
+    def best_version(self, command, versions=(0,)):
+        """ Returns the highest of 'versions' supported by the MCU for
+            'command', or None if there is none.
+        """
+        mask = self.command_versions(command)
+        supported = [v for v in versions if mask & (1 << v)]
+        return max(supported) if supported else None
+
+    def invalidate(self):
+        """ Drops the cached protocol limits and command versions. """
+        with self._lock:
+            self._protocol = None
+            self._cmd_versions.clear()
+
+    def revalidate(self):
+        """ Queries the protocol limits again. Returns true if they changed,
+            i.e. if the cached protocol assumptions were stale.
+        """
+        with self._lock:
+            old = self._protocol
+        self.invalidate()
+        return old is not None and old != self.protocol_info()
+
+    def open(self):
+        self.transport.open()
+        return self
 
-    return bool(ECFEATURES_CACHE & EC_FEATURE_MASK_0(feature))
+    def close(self):
+        self.transport.close()
 
+    def __enter__(self):
+        return self.open()
 
-def send_ec_command(dev, command, param=None, resp=None):
-    cmd = cros_ec_command()
-    cmd.version = 0
-    cmd.command = command
-    cmd.outsize = 0 if param is None else sizeof(param)
-    cmd.insize = 0 if resp is None else sizeof(resp)
+    def __exit__(self, *exc):
+        self.close()
 
-    if cmd.outsize != 0:
-        memmove(addressof(cmd.data), addressof(param), cmd.outsize)
-    with open(dev) as fh:
-        fcntl.ioctl(fh, EC_DEV_IOCXCMD, cmd)
-    if cmd.insize != 0:
-        memmove(addressof(resp), addressof(cmd.data), cmd.insize)
+    def resolve_version(self, command, version=EC_VER_DEFAULT):
+        """ Returns the version of 'command' to send. 'version' is either a
+            version, sent as is, or the sequence of the versions the caller
+            can encode, in which case the highest one supported by the MCU
+            is chosen. When the MCU supports none of them, the lowest one is
+            sent and the MCU reports the error.
+        """
+        if isinstance(version, int):
+            return version
+        best = self.best_version(command, version)
+        return min(version) if best is None else best
 
-    return cmd
+    def _send(self, command, param, resp, version, buf=None):
+        outsize = 0 if param is None else sizeof(param)
+        insize = 0 if resp is None else sizeof(resp)
+        size = max(outsize, insize)
+        if size > EC_HOST_PARAM_SIZE:
+            protocol = self.protocol_info()
+            if outsize > protocol.max_param_size:
+                raise ValueError(f"Command {command:#x} too large for "
+                                 f"{self.path} ({outsize} bytes, "
+                                 f"{protocol})")
+            # like the kernel, ask for no more than the MCU can answer
+            insize = min(insize, protocol.max_response_size)
+
+        if buf is None:
+            buf = self.buffer(size)
+        cmd = buf.cmd
+        cmd.version = version
+        cmd.command = command
+        cmd.outsize = outsize
+        cmd.insize = insize
+        cmd.result = 0
+
+        if outsize != 0 and not buf.is_view(param):
+            memmove(addressof(cmd.data), addressof(param), outsize)
+        self.transport.xfer(cmd)
+        if insize != 0 and not buf.is_view(resp):
+            memmove(addressof(resp), addressof(cmd.data), insize)
+        return cmd
+
+    def send_command(self, command, param=None, resp=None,
+                     version=EC_VER_DEFAULT):
+        """ Sends 'command' to the MCU, copying 'param' in and the answer
+            back to 'resp', unless they are views over the buffer of the
+            calling thread. Returns the cros_ec_command that was sent,
+            which is reused by the next command of the thread.
+
+            'version' is sent as is, unless it is a sequence of versions,
+            which resolve_version() negotiates with the MCU. Transfers
+            larger than EC_HOST_PARAM_SIZE are checked against the protocol
+            limits of the MCU, and the response is truncated to the largest
+            one it can send. A transfer rejected as too large (EMSGSIZE) is
+            retried once if the protocol limits were stale.
+        """
+        version = self.resolve_version(command, version)
+        try:
+            cmd = self._send(command, param, resp, version)
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE or not self.revalidate():
+                raise
+            cmd = self._send(command, param, resp, version)
+
+        if cmd.result == EC_RES_SUCCESS and \
+           command in (EC_CMD_REBOOT, EC_CMD_REBOOT_EC):
+            # the MCU restarts in an image that may speak another protocol
+            self.invalidate()
+        elif cmd.result == EC_RES_INVALID_VERSION:
+            with self._lock:
+                self._cmd_versions.pop(command, None)
+
+        return cmd
+
+    def send_commands(self, commands):
+        """ Sends a list of (command, param, resp) tuples over this handle
+            and returns the list of EC result codes, in order.
+        """
+        return [self.send_command(*c).result for c in commands]
+
+
+# Pooled devices, by resolved device path.
+EC_DEVICES = {}
+# Transports registered in place of the character devices, by device path.
+EC_TRANSPORTS = {}
+EC_DEVICES_LOCK = threading.Lock()
+
+
+def register_ec_transport(dev, transport):
+    """ Sends the commands for the 'dev' MCU (e.g. /dev/cros_ec) over
+        'transport' instead of its character device. The MCU is then
+        reported as present even if the device does not exist.
+    """
+    with EC_DEVICES_LOCK:
+        EC_TRANSPORTS[dev] = transport
+        device = EC_DEVICES.pop(rootfs_path(dev), None)
+    ECFEATURES_CACHE.pop(rootfs_path(dev), None)
+    if device is not None:
+        device.close()
+
+
+def _is_chardev(path):
+    try:
+        return stat.S_ISCHR(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def ec_device_node_exists(dev):
+    """ Returns true if the node of the 'dev' MCU (e.g. /dev/cros_ec)
+        exists, possibly as the placeholder of a replayed bundle, or if the
+        MCU is emulated.
+    """
+    return dev in EC_TRANSPORTS or os.path.exists(rootfs_path(dev))
+
+
+def ec_device_present(dev):
+    """ Returns true if commands can be sent to the 'dev' MCU (e.g.
+        /dev/cros_ec): its node is a character device, not the placeholder
+        of a replayed bundle, or the MCU is emulated.
+    """
+    return dev in EC_TRANSPORTS or _is_chardev(rootfs_path(dev))
+
+
+def list_ec_devices():
+    """ Returns the sorted paths of the MCUs present, e.g. /dev/cros_ec. """
+    devices = set(EC_TRANSPORTS)
+    for p in glob.glob(rootfs_path("/dev/cros_*")):
+        if _is_chardev(p):
+            devices.add(os.path.join("/dev", os.path.basename(p)))
+    return sorted(devices)
+
+
+def get_ec_device(dev):
+    """ Returns the pooled CrosECDevice for the 'dev' path, opening it on
+        first use.
+    """
+    with EC_DEVICES_LOCK:
+        device = EC_DEVICES.get(rootfs_path(dev))
+        if device is None:
+            device = CrosECDevice(rootfs_path(dev), EC_TRANSPORTS.get(dev))
+            EC_DEVICES[rootfs_path(dev)] = device
+    return device.open()
+
+
+@atexit.register
+def close_ec_devices():
+    """ Closes every pooled MCU handle. """
+    with EC_DEVICES_LOCK:
+        devices = list(EC_DEVICES.values())
+        EC_DEVICES.clear()
+    for device in devices:
+        device.close()
+
+
+def send_ec_command(dev, command, param=None, resp=None,
+                    version=EC_VER_DEFAULT):
+    return get_ec_device(dev).send_command(command, param, resp, version)
+
+
+def send_ec_commands(dev, commands):
+    """ Sends a list of (command, param, resp) tuples to 'dev' over a single
+        pooled handle. Returns the list of EC result codes.
+    """
+    return get_ec_device(dev).send_commands(commands)
+
+
+class CrosECFeatures:
+    """ The feature map reported by EC_CMD_GET_FEATURES for one MCU. """
+
+    def __init__(self, flags):
+        self.flags = tuple(flags)
+
+    def supported(self, feature):
+        if feature < 32:
+            return bool(self.flags[0] & EC_FEATURE_MASK_0(feature))
+        return bool(self.flags[1] & EC_FEATURE_MASK_1(feature))
+
+
+def _boot_id():
+    try:
+        with open(rootfs_path(BOOT_ID_PATH)) as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def _features_store_path():
+    boot_id = _boot_id()
+    if boot_id is None:
+        return None
+    return os.path.join(rootfs_path(ECFEATURES_STORE),
+                        f"ec-features-{boot_id}.json")
+
+
+def _load_features_store():
+    p = _features_store_path()
+    if p is None:
+        return {}
+    try:
+        with open(p) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_features_store(dev, flags):
+    """ Adds the 'dev' feature words to the store of the current boot. Any
+        error is ignored, the store is only an optimization.
+    """
+    p = _features_store_path()
+    if p is None:
+        return
+    store = _load_features_store()
+    store[dev] = list(flags)
+    try:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        # a temporary file per writer, threads of a process included, so
+        # that the store is replaced by a complete file
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(p),
+                                         prefix=".ec-features-",
+                                         delete=False) as fh:
+            json.dump(store, fh)
+        try:
+            os.replace(fh.name, p)
+        except OSError:
+            os.unlink(fh.name)
+            raise
+    except OSError:
+        pass
+
+
+def get_ec_features(dev="/dev/cros_ec"):
+    """ Returns the CrosECFeatures of the MCU behind 'dev', or None if the
+        MCU is not present or could not be queried.
+    """
+    features = ECFEATURES_CACHE.get(rootfs_path(dev))
+    if features is not None:
+        return features
+
+    # features of a registered transport (e.g. an emulator) are not stored
+    store = dev not in EC_TRANSPORTS
+    flags = _load_features_store().get(dev) if store else None
+    if flags is None:
+        if not ec_device_present(dev):
+            return None
+        param, response = None, ec_response_get_features()
+        cmd = send_ec_command(dev, EC_CMD_GET_FEATURES, param, response)
+        if cmd.result != 0:
+            return None
+        flags = list(response.flags)
+        if store:
+            _save_features_store(dev, flags)
+
+    features = ECFEATURES_CACHE[rootfs_path(dev)] = CrosECFeatures(flags)
+    return features
+
+
+def is_feature_supported(feature, dev="/dev/cros_ec"):
+    """ Returns true if the Embedded Controller supports the specified
+        'feature'. The 'dev' parameter selects the MCU to ask, e.g.
+        /dev/cros_fp for the fingerprint MCU.
+    """
+    features = get_ec_features(dev)
+    if features is None:
+        return False
+    return features.supported(feature)
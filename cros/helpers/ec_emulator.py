@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" A software Embedded Controller, usable as transport in place of an MCU
+    character device so that the EC paths of the suite and its tools can
+    run on any Linux machine.
+"""
+
+from ctypes import addressof, memset, sizeof
+import errno
+import random
+import threading
+import time
+
+from cros.helpers import ec_cmd
+
+# Features of the emulated EC by default.
+EMULATOR_DEFAULT_FEATURES = [
+    ec_cmd.EC_FEATURE_FLASH,
+    ec_cmd.EC_FEATURE_MOTION_SENSE,
+    ec_cmd.EC_FEATURE_HOST_EVENTS,
+    ec_cmd.EC_FEATURE_USB_PD,
+    ec_cmd.EC_FEATURE_MOTION_SENSE_FIFO,
+    ec_cmd.EC_FEATURE_RTC,
+    ec_cmd.EC_FEATURE_HOST_EVENT64,
+]
+
+# Added by the EC to the HELLO parameter.
+EC_HELLO_OFFSET = 0x01020304
+
+# Versions mask of the commands of the emulated EC.
+EMULATOR_COMMAND_VERSIONS = {
+    ec_cmd.EC_CMD_PROTO_VERSION: 0b1,
+    ec_cmd.EC_CMD_HELLO: 0b1,
+    ec_cmd.EC_CMD_GET_VERSION: 0b1,
+    ec_cmd.EC_CMD_GET_CMD_VERSIONS: 0b11,
+    ec_cmd.EC_CMD_GET_PROTOCOL_INFO: 0b1,
+    ec_cmd.EC_CMD_GET_FEATURES: 0b1,
+    ec_cmd.EC_CMD_REBOOT: 0b1,
+}
+
+# Maximum (request, response) packet sizes of each image.
+EMULATOR_PACKET_SIZES = {
+    ec_cmd.EC_IMAGE_RO: (0x220, 0x220),
+    ec_cmd.EC_IMAGE_RW: (0x220, 0x220),
+}
+
+
+class ECEmulator:
+    """ Answers HELLO, GET_VERSION, GET_FEATURES, PROTO_VERSION, REBOOT,
+        GET_PROTOCOL_INFO and GET_CMD_VERSIONS.
+
+        'features' is the list of EC_FEATURE_* bits reported, 'image' the
+        image running and 'reboot_image' the image running after a REBOOT.
+        'packet_sizes' maps each image to its maximum request and response
+        packet sizes. Each command takes 'latency' seconds plus a uniform
+        random 'jitter', and fails with EIO with the 'error_rate'
+        probability.
+    """
+
+    def __init__(self, features=EMULATOR_DEFAULT_FEATURES,
+                 image=ec_cmd.EC_IMAGE_RW, reboot_image=ec_cmd.EC_IMAGE_RW,
+                 version_ro="emulator_v1.0.0-ro", version_rw="emulator_v1.0.0-rw",
+                 packet_sizes=EMULATOR_PACKET_SIZES,
+                 latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.features = set(features)
+        self.image = image
+        self.reboot_image = reboot_image
+        self.packet_sizes = dict(packet_sizes)
+        self.version_ro = version_ro
+        self.version_rw = version_rw
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.commands = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._handlers = {
+            ec_cmd.EC_CMD_PROTO_VERSION: self.proto_version,
+            ec_cmd.EC_CMD_HELLO: self.hello,
+            ec_cmd.EC_CMD_GET_VERSION: self.get_version,
+            ec_cmd.EC_CMD_GET_FEATURES: self.get_features,
+            ec_cmd.EC_CMD_REBOOT: self.reboot,
+            ec_cmd.EC_CMD_GET_PROTOCOL_INFO: self.get_protocol_info,
+            ec_cmd.EC_CMD_GET_CMD_VERSIONS: self.get_cmd_versions,
+        }
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _params(self, cmd, struct_type):
+        if cmd.outsize < sizeof(struct_type):
+            return None
+        return struct_type.from_buffer(cmd.data)
+
+    def _response(self, cmd, struct_type):
+        """ Returns the response view, cleared, of the expected size. """
+        resp = struct_type.from_buffer(cmd.data)
+        memset(addressof(resp), 0, sizeof(struct_type))
+        return resp
+
+    def xfer(self, cmd):
+        with self._lock:
+            self.commands += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        if failed:
+            raise OSError(errno.EIO, "Injected EC transfer error")
+
+        handler = self._handlers.get(cmd.command)
+        if handler is None:
+            cmd.result = ec_cmd.EC_RES_INVALID_COMMAND
+            return
+        if not EMULATOR_COMMAND_VERSIONS[cmd.command] & (1 << cmd.version):
+            cmd.result = ec_cmd.EC_RES_INVALID_VERSION
+            return
+        with self._lock:
+            max_request, max_response = self.packet_sizes[self.image]
+            if (cmd.outsize > max_request - ec_cmd.EC_HOST_REQUEST_HEADER_SIZE or
+                    cmd.insize > max_response -
+                    ec_cmd.EC_HOST_RESPONSE_HEADER_SIZE):
+                cmd.result = ec_cmd.EC_RES_INVALID_PARAM
+                return
+            cmd.result = handler(cmd)
+
+    def proto_version(self, cmd):
+        self._response(cmd, ec_cmd.ec_response_proto_version).version = 3
+        return ec_cmd.EC_RES_SUCCESS
+
+    def hello(self, cmd):
+        param = self._params(cmd, ec_cmd.ec_params_hello)
+        if param is None:
+            return ec_cmd.EC_RES_INVALID_PARAM
+        in_data = param.in_data
+        resp = self._response(cmd, ec_cmd.ec_response_hello)
+        resp.out_data = (in_data + EC_HELLO_OFFSET) & 0xFFFFFFFF
+        return ec_cmd.EC_RES_SUCCESS
+
+    def get_version(self, cmd):
+        resp = self._response(cmd, ec_cmd.ec_response_get_version)
+        for field, version in [("version_string_ro", self.version_ro),
+                               ("version_string_rw", self.version_rw)]:
+            data = version.encode()[:31]
+            getattr(resp, field)[:len(data)] = list(data)
+        resp.current_image = self.image
+        return ec_cmd.EC_RES_SUCCESS
+
+    def get_features(self, cmd):
+        resp = self._response(cmd, ec_cmd.ec_response_get_features)
+        for feature in self.features:
+            resp.flags[feature // 32] |= 1 << (feature % 32)
+        return ec_cmd.EC_RES_SUCCESS
+
+    def get_protocol_info(self, cmd):
+        resp = self._response(cmd, ec_cmd.ec_response_get_protocol_info)
+        resp.protocol_versions = 1 << 3
+        (resp.max_request_packet_size,
+         resp.max_response_packet_size) = self.packet_sizes[self.image]
+        return ec_cmd.EC_RES_SUCCESS
+
+    def get_cmd_versions(self, cmd):
+        param = self._params(cmd, ec_cmd.ec_params_get_cmd_versions_v1)
+        if param is None:
+            return ec_cmd.EC_RES_INVALID_PARAM
+        mask = EMULATOR_COMMAND_VERSIONS.get(param.cmd)
+        if mask is None:
+            return ec_cmd.EC_RES_INVALID_PARAM
+        self._response(cmd, ec_cmd.ec_response_get_cmd_versions).version_mask \
+            = mask
+        return ec_cmd.EC_RES_SUCCESS
+
+    def reboot(self, cmd):
+        self.image = self.reboot_image
+        return ec_cmd.EC_RES_SUCCESS
+
+
+def install_emulators(names, **kwargs):
+    """ Registers an ECEmulator built with 'kwargs' for each MCU of 'names'
+        (e.g. cros_ec), and returns them by device path.
+    """
+    emulators = {}
+    for name in names:
+        dev = f"/dev/{name}"
+        emulators[dev] = ECEmulator(**kwargs)
+        ec_cmd.register_ec_transport(dev, emulators[dev])
+    return emulators
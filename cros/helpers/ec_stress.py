@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Concurrent host command load on the MCUs.
+
+    Several workers, threads or processes, send read-only host commands to
+    every MCU for a fixed duration, so that the locks shared by the
+    cros_ec core and the transports are contended. Each worker records the
+    latency of its commands and its failures, and the results are reported
+    per MCU with the throughput fairness between its workers.
+"""
+
+from array import array
+import multiprocessing
+import threading
+import time
+
+from cros.helpers import ec_cmd
+from cros.helpers.stats import summarize
+
+# magic numbers sent and expected back on HELLO
+EC_HELLO_IN = 0xA0B0C0D0
+EC_HELLO_OUT = 0xA1B2C3D4
+
+# Delay before the workers start together, to let them all spawn.
+STRESS_START_DELAY = {"threads": 0.05, "processes": 0.5}
+
+
+def _hello(buf):
+    param = buf.params(ec_cmd.ec_params_hello)
+    response = buf.response(ec_cmd.ec_response_hello)
+
+    def setup():
+        # the previous response overwrote the parameters
+        param.in_data = EC_HELLO_IN
+
+    return (ec_cmd.EC_CMD_HELLO, param, response, setup,
+            lambda: response.out_data == EC_HELLO_OUT)
+
+
+def _get_version(buf):
+    response = buf.response(ec_cmd.ec_response_get_version)
+    return ec_cmd.EC_CMD_GET_VERSION, None, response, None, None
+
+
+def _get_features(buf):
+    response = buf.response(ec_cmd.ec_response_get_features)
+    return ec_cmd.EC_CMD_GET_FEATURES, None, response, None, None
+
+
+# name -> factory of (command, param, response, parameters setup, response
+# check), with the parameters and the response as views over the command
+# buffer so that loops do not copy nor allocate.
+READ_ONLY_COMMANDS = {
+    "hello": _hello,
+    "get_version": _get_version,
+    "get_features": _get_features,
+}
+
+
+class WorkerResult:
+    """ The outcome of a stress worker: the latency in ns of each command
+        answered correctly, and the count of commands that were 'lost' (the
+        transfer failed), 'failed' (EC error result) or answered with a
+        'bad' response, e.g. a wrong HELLO magic.
+    """
+
+    def __init__(self, dev, worker):
+        self.dev = dev
+        self.worker = worker
+        self.latencies = array("q")
+        self.lost = 0
+        self.failed = 0
+        self.bad = 0
+        self.elapsed = 0.0
+
+    @property
+    def count(self):
+        return len(self.latencies) + self.lost + self.failed + self.bad
+
+
+def stress_worker(dev, worker, commands, start_at, duration):
+    """ Sends 'commands' in turn to 'dev' from 'start_at' (a monotonic time)
+        for 'duration' seconds, and returns the WorkerResult.
+    """
+    device = ec_cmd.get_ec_device(dev)
+    buf = device.buffer()
+    loop = [READ_ONLY_COMMANDS[name](buf) for name in commands]
+    result = WorkerResult(dev, worker)
+    latencies = result.latencies
+    clock = time.perf_counter_ns
+
+    delay = start_at - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+    start = clock()
+    deadline = start + int(duration * 1e9)
+    n = 0
+    while clock() < deadline:
+        command, param, response, setup, check = loop[n % len(loop)]
+        n += 1
+        if setup is not None:
+            setup()
+        t0 = clock()
+        try:
+            cmd = device.send_command(command, param, response)
+        except OSError:
+            result.lost += 1
+            continue
+        t1 = clock()
+        if cmd.result != ec_cmd.EC_RES_SUCCESS:
+            result.failed += 1
+        elif check is not None and not check():
+            result.bad += 1
+        else:
+            latencies.append(t1 - t0)
+    result.elapsed = (clock() - start) / 1e9
+    return result
+
+
+def _stress_worker(args):
+    return stress_worker(*args)
+
+
+def jain_fairness(values):
+    """ Returns Jain's fairness index of 'values', from 1/n when a single
+        value is non-zero to 1 when they are all equal.
+    """
+    values = list(values)
+    total = sum(values)
+    squares = sum(v * v for v in values)
+    if not squares:
+        return 1.0
+    return total * total / (len(values) * squares)
+
+
+def run_stress(devices, commands, workers, duration, mode="threads"):
+    """ Runs 'workers' workers per MCU of 'devices' for 'duration' seconds,
+        as threads or processes depending on 'mode', and returns the list
+        of WorkerResult.
+    """
+    start_at = time.monotonic() + STRESS_START_DELAY[mode]
+    jobs = [(dev, worker, commands, start_at, duration)
+            for dev in devices for worker in range(workers)]
+    if mode == "processes":
+        # forked so that the emulated transports are inherited
+        with multiprocessing.get_context("fork").Pool(len(jobs)) as pool:
+            return pool.map(_stress_worker, jobs)
+
+    results = [None] * len(jobs)
+
+    def run(i):
+        results[i] = stress_worker(*jobs[i])
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(len(jobs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize_stress(results):
+    """ Returns {device: summary} of the WorkerResult list 'results', with
+        the throughput, the latency percentiles in microseconds, the
+        failure counts and the Jain fairness of the worker throughputs.
+    """
+    by_device = {}
+    for result in results:
+        by_device.setdefault(result.dev, []).append(result)
+
+    summary = {}
+    for dev, workers in by_device.items():
+        rates = [len(w.latencies) / w.elapsed if w.elapsed else 0.0
+                 for w in workers]
+        entry = {
+            "workers": len(workers),
+            "count": sum(w.count for w in workers),
+            "lost": sum(w.lost for w in workers),
+            "failed": sum(w.failed for w in workers),
+            "bad": sum(w.bad for w in workers),
+            "commands_per_s": sum(rates),
+            "fairness": jain_fairness(rates),
+        }
+        latencies = array("q")
+        for w in workers:
+            latencies.extend(w.latencies)
+        if latencies:
+            st = summarize([v / 1000 for v in latencies], (50, 90, 99))
+            for key in ["p50", "p90", "p99", "max", "mean"]:
+                entry[f"{key}_us"] = st[key]
+        summary[dev] = entry
+    return summary
+
+
+def stress_failures(summary):
+    """ Returns the list of lost and wrong responses in 'summary'. """
+    failures = []
+    for dev, entry in summary.items():
+        if entry["lost"]:
+            failures.append(f"{dev}: {entry['lost']} lost responses")
+        if entry["bad"]:
+            failures.append(f"{dev}: {entry['bad']} wrong responses")
+    return failures
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Buffered sampling of IIO devices through their character device.
+
+    The frame layout is read once from the 'scan_elements' directory and
+    frames are decoded a whole buffer at a time, with NumPy when available
+    or with the standard library otherwise.
+"""
+
+from array import array
+import errno
+import math
+import os
+import re
+import selectors
+import sys
+import time
+
+from cros.helpers.rootfs import rootfs_path
+from cros.helpers.sysfs import SysfsAttributeReader, sysfs_read_attributes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# array type codes of the signed integers of 1, 2, 4 and 8 bytes
+ARRAY_TYPECODES = {1: "b", 2: "h", 4: "i", 8: "q"}
+
+
+class ScanChannel:
+    """ A channel of an IIO scan, described by its *_type attribute, e.g.
+        'le:s16/16>>0'. Only the first element of repeated channels is
+        decoded.
+    """
+
+    TYPE_RE = re.compile(r"(be|le):(s|u)(\d+)/(\d+)(?:X(\d+))?>>(\d+)")
+
+    def __init__(self, name, index, type_desc):
+        m = self.TYPE_RE.match(type_desc.strip())
+        if m is None:
+            raise ValueError(f"Invalid scan type for {name}: {type_desc}")
+        self.name = name
+        self.index = index
+        self.big_endian = m.group(1) == "be"
+        self.signed = m.group(2) == "s"
+        self.realbits = int(m.group(3))
+        self.storagebits = int(m.group(4))
+        self.repeat = int(m.group(5) or 1)
+        self.shift = int(m.group(6))
+        self.offset = 0
+
+    def __repr__(self):
+        return f"ScanChannel({self.name!r}, {self.index})"
+
+    @property
+    def storagebytes(self):
+        return self.storagebits // 8
+
+    @property
+    def length(self):
+        return self.storagebytes * self.repeat
+
+    @property
+    def is_plain(self):
+        """ True if the value fills its storage, without shift nor mask. """
+        return self.shift == 0 and self.realbits == self.storagebits
+
+
+class ScanLayout:
+    """ The frame layout of a set of enabled scan channels, computed like
+        the kernel does: channels in index order, each aligned to its own
+        length, and the frame aligned to the largest one.
+    """
+
+    def __init__(self, channels):
+        self.channels = sorted(channels, key=lambda c: c.index)
+        offset, largest = 0, 1
+        for c in self.channels:
+            offset = -(-offset // c.length) * c.length
+            c.offset = offset
+            offset += c.length
+            largest = max(largest, c.length)
+        self.frame_size = -(-offset // largest) * largest
+
+    @classmethod
+    def from_scan_elements(cls, path, names):
+        """ Builds the layout of channels 'names' (e.g. 'accel_x') from a
+            scan_elements directory.
+        """
+        attrs = {}
+        for name in names:
+            attrs[f"in_{name}_index"] = int
+            attrs[f"in_{name}_type"] = str
+        values = sysfs_read_attributes(path, attrs).check()
+        return cls([ScanChannel(name, values[f"in_{name}_index"],
+                                values[f"in_{name}_type"])
+                    for name in names])
+
+    def _numpy_decode(self, data, count):
+        dtype = numpy.dtype({
+            "names": [c.name for c in self.channels],
+            "formats": [(">" if c.big_endian else "<") +
+                        ("i" if c.signed and c.is_plain else "u") +
+                        str(c.storagebytes) for c in self.channels],
+            "offsets": [c.offset for c in self.channels],
+            "itemsize": self.frame_size,
+        })
+        frames = numpy.frombuffer(data, dtype=dtype, count=count)
+        decoded = {}
+        for c in self.channels:
+            v = frames[c.name].astype(numpy.int64)
+            if not c.is_plain:
+                v = (v >> c.shift) & ((1 << c.realbits) - 1)
+                if c.signed:
+                    sign = 1 << (c.realbits - 1)
+                    v = (v ^ sign) - sign
+            decoded[c.name] = v
+        return decoded
+
+    def _array_decode(self, data, count):
+        size = count * self.frame_size
+        data = bytes(data[:size])
+        decoded = {}
+        for c in self.channels:
+            # gather the bytes of the channel with strided slices
+            n = c.storagebytes
+            raw = bytearray(count * n)
+            for i in range(n):
+                raw[i::n] = data[c.offset + i:size:self.frame_size]
+            typecode = ARRAY_TYPECODES[n]
+            if not (c.signed and c.is_plain):
+                typecode = typecode.upper()
+            v = array(typecode, raw)
+            if c.big_endian != (sys.byteorder == "big"):
+                v.byteswap()
+            if not c.is_plain:
+                mask = (1 << c.realbits) - 1
+                sign = 1 << (c.realbits - 1) if c.signed else 0
+                v = array("q", ((((x >> c.shift) & mask) ^ sign) - sign
+                                for x in v))
+            decoded[c.name] = v
+        return decoded
+
+    def decode(self, data):
+        """ Decodes the complete frames of 'data' into a dict of channel name
+            to the sequence of its values.
+        """
+        count = len(data) // self.frame_size
+        if numpy is not None:
+            return self._numpy_decode(data, count)
+        return self._array_decode(data, count)
+
+    def decode_file(self, path):
+        """ Decodes a file of recorded frames. """
+        with open(path, "rb") as fh:
+            return self.decode(fh.read())
+
+
+def _write_attribute(path, value):
+    with open(path, "w") as fh:
+        fh.write(str(value))
+
+
+def _read_attribute(path):
+    with open(path) as fh:
+        return fh.read().strip()
+
+
+class IIOBufferSampler:
+    """ Streams the 'channels' of an IIO device from its buffer.
+
+        start() enables the requested scan elements and the buffer, and
+        stop() restores the previous configuration. 'dev_path' is the sysfs
+        directory of the device, e.g. /sys/bus/iio/devices/iio:device0.
+    """
+
+    def __init__(self, dev_path, channels, buffer_length=1024):
+        self.dev_path = dev_path
+        self.devname = os.path.basename(dev_path)
+        self.channels = list(channels)
+        self.buffer_length = buffer_length
+        self.layout = None
+        self.data = bytearray()
+        self._fd = None
+        self._saved = {}
+
+    def _attr(self, *parts):
+        return os.path.join(self.dev_path, *parts)
+
+    def start(self):
+        scan = self._attr("scan_elements")
+        for entry in os.listdir(scan):
+            if entry.endswith("_en"):
+                self._saved[entry] = _read_attribute(os.path.join(scan, entry))
+        for attr in ["buffer/enable", "buffer/length"]:
+            self._saved[attr] = _read_attribute(self._attr(attr))
+
+        try:
+            _write_attribute(self._attr("buffer/enable"), 0)
+            for entry in self._saved:
+                if entry.endswith("_en"):
+                    enable = entry[3:-3] in self.channels
+                    _write_attribute(os.path.join(scan, entry), int(enable))
+            self.layout = ScanLayout.from_scan_elements(scan, self.channels)
+            _write_attribute(self._attr("buffer/length"), self.buffer_length)
+            _write_attribute(self._attr("buffer/enable"), 1)
+            self._fd = os.open(rootfs_path(f"/dev/{self.devname}"),
+                               os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            self.stop()
+            raise
+        return self
+
+    def stop(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        saved, self._saved = self._saved, {}
+        if "buffer/enable" not in saved:
+            return
+        _write_attribute(self._attr("buffer/enable"), 0)
+        for attr, value in saved.items():
+            if attr.endswith("_en"):
+                _write_attribute(self._attr("scan_elements", attr), value)
+        _write_attribute(self._attr("buffer/length"), saved["buffer/length"])
+        _write_attribute(self._attr("buffer/enable"), saved["buffer/enable"])
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def fileno(self):
+        return self._fd
+
+    def read_available(self):
+        """ Appends the frames available in the buffer to 'data'. """
+        size = self.layout.frame_size * self.buffer_length
+        while True:
+            try:
+                chunk = os.read(self._fd, size)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+            if not chunk:
+                return
+            self.data += chunk
+
+    def samples(self):
+        """ Returns the decoded samples read so far. """
+        return self.layout.decode(bytes(self.data))
+
+    def save(self, path):
+        """ Writes the frames read so far to 'path'. A frame file stored as
+            /dev/iio:deviceN of a replayed root filesystem is read back
+            instead of the device buffer.
+        """
+        with open(path, "wb") as fh:
+            fh.write(self.data)
+
+
+def sample_buffers(samplers, window):
+    """ Reads all started 'samplers' concurrently for 'window' seconds and
+        returns a dict of sampler to its decoded samples.
+    """
+    if not samplers:
+        return {}
+    with selectors.DefaultSelector() as sel:
+        for sampler in samplers:
+            try:
+                sel.register(sampler, selectors.EVENT_READ)
+            except PermissionError:
+                # not pollable (e.g. a recorded file), read once below
+                pass
+        deadline = time.monotonic() + window
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in sel.select(remaining):
+                key.fileobj.read_available()
+    for sampler in samplers:
+        sampler.read_available()
+    return {sampler: sampler.samples() for sampler in samplers}
+
+
+def sample_devices(dev_paths, channels, window):
+    """ Samples 'channels' of all the IIO devices 'dev_paths' together for
+        'window' seconds. Returns a dict of device path to its decoded
+        samples, devices whose buffer cannot be enabled are left out.
+    """
+    started = []
+    try:
+        for dev_path in dev_paths:
+            sampler = IIOBufferSampler(dev_path, channels)
+            try:
+                started.append(sampler.start())
+            except OSError:
+                pass
+        samples = sample_buffers(started, window)
+    finally:
+        for sampler in started:
+            sampler.stop()
+    return {sampler.dev_path: s for sampler, s in samples.items()}
+
+
+def read_raw_samples(dev_path, channels, count):
+    """ Polls the in_*_raw attributes of 'channels' 'count' times. Used
+        when the buffer of a device cannot be enabled. The attributes are
+        kept open by a reader of their own, closed once polled.
+    """
+    samples = {name: array("q") for name in channels}
+    attrs = {f"in_{name}_raw": int for name in channels}
+    reader = SysfsAttributeReader()
+    try:
+        for _ in range(count):
+            values = reader.read(dev_path, attrs, cache=True).check()
+            for name in channels:
+                samples[name].append(values[f"in_{name}_raw"])
+    finally:
+        reader.close()
+    return samples
+
+
+def magnitude(x, y, z, scale=1.0):
+    """ Returns the per-sample magnitude of the (x, y, z) vectors, scaled
+        by 'scale'.
+    """
+    if numpy is not None:
+        v = numpy.stack([numpy.asarray(a, dtype=float) for a in (x, y, z)])
+        return numpy.sqrt(numpy.sum(v * v, axis=0)) * scale
+    return array("d", (math.sqrt(a * a + b * b + c * c) * scale
+                       for a, b, c in zip(x, y, z)))
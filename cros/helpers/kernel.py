@@ -1,6 +1,121 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import functools
+import gzip
+import os
+import re
+
+from cros.helpers.rootfs import get_rootfs
+
+
+class KernelInfo:
+    """ Version and build configuration of a kernel, read from the proc
+        files under 'root'. The version is parsed once on first use, and
+        the kernel config is decompressed and indexed once when an option
+        is first queried.
+    """
+
+    VERSION_RE = re.compile(r"(\d+)\.(\d+)(?:\.(\d+))?")
+    CONFIG_RE = re.compile(r"(CONFIG_\w+)=(.*)")
+    CONFIG_UNSET_RE = re.compile(r"# (CONFIG_\w+) is not set")
+
+    def __init__(self, root="/"):
+        self.root = root
+        self._release = None
+        self._version = None
+        self._config = None
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    @property
+    def release(self):
+        """ The kernel release string, e.g. '6.1.0-rc3'. """
+        if self._release is None:
+            with open(self._path("proc", "version")) as fh:
+                self._release = fh.read().split()[2]
+        return self._release
+
+    @property
+    def version(self):
+        """ The kernel version as a (version, major, minor) tuple. """
+        if self._version is None:
+            m = self.VERSION_RE.match(self.release)
+            if m is None:
+                raise ValueError(f"Cannot parse kernel release {self.release}")
+            self._version = tuple(int(v or 0) for v in m.groups())
+        return self._version
+
+    def lower_than(self, version, major, minor):
+        """ Returns true if the running kernel is older than the given
+            version.
+        """
+        return self.version < (version, major, minor)
+
+    def greater_than(self, version, major, minor):
+        """ Returns true if the running kernel is newer than the given
+            version.
+        """
+        return self.version > (version, major, minor)
+
+    def in_range(self, low=None, high=None):
+        """ Returns true if low <= running kernel < high. Both bounds are
+            (version, major, minor) tuples and may be None.
+        """
+        if low is not None and self.version < tuple(low):
+            return False
+        if high is not None and self.version >= tuple(high):
+            return False
+        return True
+
+    @property
+    def config(self):
+        """ The kernel config as a dict of CONFIG_ option to value. Options
+            that are not set map to 'n'. Empty if /proc/config.gz is not
+            available.
+        """
+        if self._config is None:
+            config = {}
+            try:
+                with gzip.open(self._path("proc", "config.gz"), "rt") as fh:
+                    for line in fh:
+                        m = self.CONFIG_RE.match(line)
+                        if m:
+                            config[m.group(1)] = m.group(2).strip('"')
+                            continue
+                        m = self.CONFIG_UNSET_RE.match(line)
+                        if m:
+                            config[m.group(1)] = "n"
+            except OSError:
+                pass
+            self._config = config
+        return self._config
+
+    def config_value(self, option):
+        """ Returns the value of a CONFIG_ option, or None if unknown. The
+            CONFIG_ prefix is optional.
+        """
+        if not option.startswith("CONFIG_"):
+            option = f"CONFIG_{option}"
+        return self.config.get(option)
+
+    def config_enabled(self, option):
+        """ Returns true if a CONFIG_ option is built-in or a module. """
+        return self.config_value(option) in ("y", "m")
+
+
+@functools.lru_cache(maxsize=None)
+def _kernel_info(root):
+    return KernelInfo(root)
+
+
+def get_kernel_info(root=None):
+    """ Returns the shared KernelInfo for 'root', by default the configured
+        root filesystem.
+    """
+    return _kernel_info(get_rootfs() if root is None else root)
+
 
 def version_to_int(version, major, minor):
     """ Return an integer from kernel version to allow to compare with
@@ -14,20 +129,18 @@ def current_kernel_version():
     """ Returns the current kernel version as an integer you can
         compare.
     """
-    with open("/proc/version") as fh:
-        current = fh.read().split()[2].split("-")[0].split(".")
-    return version_to_int(int(current[0]), int(current[1]), int(current[2]))
+    return version_to_int(*get_kernel_info().version)
 
 
 def kernel_lower_than(version, major, minor):
     """ Returns true if the given version is lower than the running kernel
         version.
     """
-    return current_kernel_version() < version_to_int(version, major, minor)
+    return get_kernel_info().lower_than(version, major, minor)
 
 
 def kernel_greater_than(version, major, minor):
     """ Returns true if the given version is greater than the running kernel
         version.
     """
-    return current_kernel_version() > version_to_int(version, major, minor)
+    return get_kernel_info().greater_than(version, major, minor)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Measurements recorded by a test in addition to its outcome. The runners
+    report them with the result of the test, e.g. as the test cases of a
+    LAVA test set named after the test.
+"""
+
+
+def format_measurement(value):
+    """ Returns the text of a measurement 'value': integers as is, floats
+        with 6 decimals (i.e. microseconds for durations).
+    """
+    if isinstance(value, float):
+        return f"{value:.6f}"
+    return str(value)
+
+
+def record_measurement(test, name, value, units):
+    """ Records the numeric measurement 'name' of the running 'test' case,
+        e.g. record_measurement(self, "step1_latency", 0.012, "seconds").
+        The value is stored formatted by format_measurement().
+    """
+    if not hasattr(test, "cros_measurements"):
+        test.cros_measurements = []
+    test.cros_measurements.append((name, format_measurement(value), units))
+
+
+def test_measurements(test):
+    """ Returns the [(name, value, units)] recorded by the 'test' case. """
+    return list(getattr(test, "cros_measurements", []))
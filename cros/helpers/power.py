@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Sampling of the power_supply telemetry of the EC charger and battery.
+
+    The attributes are kept open by a SysfsAttributeReader, so that a
+    sample costs one pread() per attribute. The samples are stored in
+    fixed-size ring buffers, which keeps long captures in constant memory.
+"""
+
+from array import array
+import json
+import struct
+import sys
+import time
+
+from cros.helpers.stats import summarize
+from cros.helpers.sysfs import SysfsAttributeReader, SysfsReadError
+from cros.helpers.sysfs import sysfs_find_devices, sysfs_read_attributes
+
+POWER_SUPPLY_PATH = "/sys/class/power_supply"
+
+# Device name prefixes of the power supplies driven by the EC.
+POWER_SUPPLY_DEVICES = ["CROS_USBPD_CHARGER", "BAT"]
+
+# Attributes sampled by default, the ones missing on a device are left out.
+TELEMETRY_ATTRIBUTES = [
+    "voltage_now",
+    "current_now",
+    "power_now",
+    "charge_now",
+    "capacity",
+]
+
+# Attributes whose design limits only apply while the supply is online,
+# e.g. an offline charger may report any voltage.
+ONLINE_ATTRIBUTES = ["voltage_now", "current_now"]
+
+# Value stored for a failed read, e.g. ENODATA on an offline charger.
+MISSING = -(1 << 63)
+
+# Binary export: magic, then the length of a JSON header describing the
+# channels, then one record per sample of little-endian int64 values, the
+# CLOCK_MONOTONIC time in ns followed by the channels.
+BINARY_MAGIC = b"CRPW"
+BINARY_HEADER = struct.Struct("<4sI")
+
+
+class RingBuffer:
+    """ Fixed-size buffer of 'capacity' integers of the array 'typecode',
+        the oldest values being overwritten when it is full.
+    """
+
+    def __init__(self, capacity, typecode="q"):
+        if capacity <= 0:
+            raise ValueError("ring buffer capacity must be positive")
+        self.capacity = capacity
+        self._data = array(typecode, bytes(capacity *
+                                           array(typecode).itemsize))
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def overwritten(self):
+        """ Number of values lost because the buffer was full. """
+        return max(self.count - self.capacity, 0)
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.count += 1
+
+    def values(self):
+        """ Returns the stored values, oldest first, as an array. """
+        if self.count < self.capacity:
+            return self._data[:self._next]
+        return self._data[self._next:] + self._data[:self._next]
+
+
+class PowerChannel:
+    """ An attribute of a power supply read through 'reader', which keeps
+        it open, with its samples and the cost of each successful read in
+        ns.
+    """
+
+    def __init__(self, reader, dev, attr, capacity):
+        self.reader = reader
+        self.dev = dev
+        self.attr = attr
+        self.name = f"{dev.devname}/{attr}"
+        self.path = dev.attribute_path(attr)
+        self.values = RingBuffer(capacity)
+        self.costs = RingBuffer(capacity)
+        self.errors = 0
+        self.last_error = None
+
+    def read(self):
+        t0 = time.perf_counter_ns()
+        value = self.reader.read_value(self.path, int, cache=True)
+        cost = time.perf_counter_ns() - t0
+        if isinstance(value, SysfsReadError):
+            self.last_error = value
+            self.errors += 1
+            value = MISSING
+        else:
+            self.costs.append(cost)
+        self.values.append(value)
+        return value
+
+
+def power_supplies(prefixes=POWER_SUPPLY_DEVICES):
+    """ Returns the power supply devices whose name starts with one of
+        'prefixes'.
+    """
+    return [dev for prefix in prefixes
+            for dev in sysfs_find_devices(POWER_SUPPLY_PATH, prefix, False)]
+
+
+# Attributes advertising the design limits, and 'charge_full', the last
+# full charge measured, which may exceed the design one.
+DESIGN_ATTRIBUTES = {
+    "voltage_min_design": int,
+    "voltage_max_design": int,
+    "charge_full_design": int,
+    "charge_full": int,
+    "current_max": int,
+}
+
+
+def design_limits(dev):
+    """ Returns the {attribute: (low, high)} limits advertised by the power
+        supply 'dev', either bound possibly None.
+    """
+    design = sysfs_read_attributes(dev, DESIGN_ATTRIBUTES)
+    limits = {"capacity": (0, 100)}
+    vmin = design.get("voltage_min_design")
+    vmax = design.get("voltage_max_design")
+    if vmin is not None or vmax is not None:
+        limits["voltage_now"] = (vmin if vmin is not None else 0, vmax)
+    # a battery may hold more than designed, bound it by what it last held
+    charge_full = design.get("charge_full")
+    if charge_full is None:
+        charge_full = design.get("charge_full_design")
+    if charge_full is not None:
+        limits["charge_now"] = (0, charge_full)
+    current_max = design.get("current_max")
+    if current_max is not None:
+        limits["current_now"] = (-current_max, current_max)
+    return limits
+
+
+class PowerSampler:
+    """ Samples the 'attributes' of the power supplies 'devices' into ring
+        buffers of 'capacity' samples, along with the 'online' attribute of
+        the supplies having one. Use as a context manager, or call close(),
+        to release the attribute descriptors.
+    """
+
+    def __init__(self, devices, attributes=TELEMETRY_ATTRIBUTES,
+                 capacity=4096):
+        self.timestamps = RingBuffer(capacity)
+        self.reader = SysfsAttributeReader()
+        self.channels = []
+        self.limits = {}
+        # device name -> channel of its 'online' attribute
+        self.online = {}
+        for dev in devices:
+            if dev.has("online"):
+                self.online[dev.devname] = PowerChannel(self.reader, dev,
+                                                        "online", capacity)
+            limits = design_limits(dev)
+            for attr in attributes:
+                if not dev.has(attr):
+                    continue
+                channel = PowerChannel(self.reader, dev, attr, capacity)
+                self.channels.append(channel)
+                if attr in limits:
+                    self.limits[channel.name] = limits[attr]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+
+    def sample(self):
+        self.timestamps.append(time.monotonic_ns())
+        for channel in self.online.values():
+            channel.read()
+        for channel in self.channels:
+            channel.read()
+
+    def run(self, rate, duration):
+        """ Samples at 'rate' Hz for 'duration' seconds. Samples are taken
+            on a fixed schedule, a late sample does not delay the next ones.
+            Returns the number of samples taken.
+        """
+        period = 1.0 / rate
+        start = time.monotonic()
+        n = 0
+        while True:
+            now = time.monotonic()
+            if now - start >= duration:
+                return n
+            target = start + n * period
+            if target > now:
+                time.sleep(target - now)
+            self.sample()
+            n += 1
+
+    def violations(self, tolerance=0.0):
+        """ Returns the list of samples outside the design limits widened by
+            'tolerance' (a ratio of the limit), as messages. The samples of
+            ONLINE_ATTRIBUTES taken while their supply was offline are
+            ignored.
+        """
+        messages = []
+        for channel in self.channels:
+            low, high = self.limits.get(channel.name, (None, None))
+            if low is not None:
+                low -= abs(low) * tolerance
+            if high is not None:
+                high += abs(high) * tolerance
+            values = channel.values.values()
+            online = self.online.get(channel.dev.devname)
+            if online is not None and channel.attr in ONLINE_ATTRIBUTES:
+                values = [v for v, o in zip(values, online.values.values())
+                          if o != 0]
+            bad = [v for v in values if v != MISSING and
+                   ((low is not None and v < low) or
+                    (high is not None and v > high))]
+            if bad:
+                messages.append(f"{channel.name}: {len(bad)} samples out of "
+                                f"[{low}, {high}], e.g. {bad[0]}")
+        return messages
+
+    def summary(self):
+        """ Returns {channel: summary} of the values and the read cost in
+            microseconds of every channel, the cost being left out of the
+            channels without any successful read.
+        """
+        result = {}
+        for channel in self.channels:
+            values = [v for v in channel.values.values() if v != MISSING]
+            costs = [c / 1000 for c in channel.costs.values()]
+            entry = {"samples": len(channel.values), "errors": channel.errors}
+            if channel.last_error is not None:
+                entry["last_error"] = str(channel.last_error)
+            if values:
+                st = summarize(values, ())
+                entry.update(min=st["min"], mean=st["mean"], max=st["max"])
+            if costs:
+                st = summarize(costs, (50, 99))
+                entry.update(cost_p50_us=st["p50"], cost_p99_us=st["p99"],
+                             cost_max_us=st["max"])
+            result[channel.name] = entry
+        return result
+
+    def rows(self):
+        """ Yields the stored samples as (timestamp_ns, value...) tuples. """
+        columns = [self.timestamps.values()] + \
+                  [channel.values.values() for channel in self.channels]
+        return zip(*columns)
+
+    def write_csv(self, fh):
+        """ Writes the samples as CSV to the text file 'fh', failed reads
+            being left empty.
+        """
+        fh.write(",".join(["timestamp_ns"] +
+                          [channel.name for channel in self.channels]) + "\n")
+        for row in self.rows():
+            fh.write(",".join("" if v == MISSING else str(v)
+                              for v in row) + "\n")
+
+    def write_binary(self, fh):
+        """ Writes the samples in the binary format to the binary file
+            'fh'.
+        """
+        header = json.dumps({
+            "channels": [channel.name for channel in self.channels],
+            "missing": MISSING,
+        }).encode()
+        fh.write(BINARY_HEADER.pack(BINARY_MAGIC, len(header)))
+        fh.write(header)
+        records = array("q", (v for row in self.rows() for v in row))
+        if sys.byteorder != "little":
+            records.byteswap()
+        fh.write(records.tobytes())
+
+
+def read_binary(fh):
+    """ Reads back a binary export from the binary file 'fh'. Returns the
+        channel names and the list of (timestamp_ns, value...) tuples.
+    """
+    magic, length = BINARY_HEADER.unpack(fh.read(BINARY_HEADER.size))
+    if magic != BINARY_MAGIC:
+        raise ValueError("not a power telemetry capture")
+    header = json.loads(fh.read(length))
+    channels = header["channels"]
+    records = array("q")
+    records.frombytes(fh.read())
+    if sys.byteorder != "little":
+        records.byteswap()
+    width = len(channels) + 1
+    return channels, [tuple(records[i:i + width])
+                      for i in range(0, len(records), width)]
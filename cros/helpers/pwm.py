@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Parser of the PWM debugfs file, e.g.::
+
+    0: platform/cros-ec-pwm.0.auto, 3 PWM devices
+     pwm-0   (backlight           ): requested enabled period: 1000000 ns duty: 500000 ns polarity: normal
+     pwm-1   ((null)              ): period: 0 ns duty: 0 ns polarity: normal
+"""
+
+import re
+
+from cros.helpers.rootfs import rootfs_path
+
+DEBUGFS_PWM = "/sys/kernel/debug/pwm"
+
+# Device name of the EC PWM chip, e.g. 'cros-ec-pwm' or '...:ec-pwm'.
+EC_PWM_DEVICE_RE = re.compile(r"ec-pwm")
+
+CHIP_RE = re.compile(r"^(?:(\d+): )?(\S+?)(?:, (\d+) PWM devices?)?$")
+CHANNEL_RE = re.compile(r"^\s*pwm-(\d+)\s+\((.*)\):(.*)$")
+VALUE_RE = re.compile(r"(period|duty): (\d+) ns")
+POLARITY_RE = re.compile(r"polarity: (\S+)")
+
+
+class PWMChannel:
+    """ A channel of a PWM chip. 'label' is the name of its consumer, or
+        None if it is not requested. 'period' and 'duty' are in ns.
+    """
+
+    def __init__(self, index, label, requested=False, enabled=False,
+                 period=0, duty=0, polarity="normal"):
+        self.index = index
+        self.label = label
+        self.requested = requested
+        self.enabled = enabled
+        self.period = period
+        self.duty = duty
+        self.polarity = polarity
+
+    def __repr__(self):
+        return f"PWMChannel({self.index}, {self.label!r}, duty={self.duty})"
+
+    @property
+    def duty_cycle(self):
+        """ The duty cycle as a ratio of the period, 0 if there is none. """
+        return self.duty / self.period if self.period else 0.0
+
+    @classmethod
+    def parse(cls, line):
+        """ Returns the channel of a debugfs 'line', or None. """
+        m = CHANNEL_RE.match(line)
+        if m is None:
+            return None
+        label = m.group(2).strip()
+        flags = m.group(3)
+        values = dict((k, int(v)) for k, v in VALUE_RE.findall(flags))
+        polarity = POLARITY_RE.search(flags)
+        return cls(int(m.group(1)),
+                   None if label in ("", "(null)") else label,
+                   requested=" requested" in flags,
+                   enabled=" enabled" in flags,
+                   period=values.get("period", 0),
+                   duty=values.get("duty", 0),
+                   polarity=polarity.group(1) if polarity else "normal")
+
+
+class PWMChip:
+    """ A PWM chip: its 'device' (e.g. platform/cros-ec-pwm.0.auto) and
+        its channels.
+    """
+
+    def __init__(self, device, npwm=None):
+        self.device = device
+        self.npwm = npwm
+        self.channels = []
+
+    def __repr__(self):
+        return f"PWMChip({self.device!r}, {self.channels!r})"
+
+    @property
+    def is_ec(self):
+        return EC_PWM_DEVICE_RE.search(self.device) is not None
+
+    def channel(self, label):
+        """ Returns the channel requested by 'label', or None. """
+        for channel in self.channels:
+            if channel.label == label:
+                return channel
+        return None
+
+
+def parse_pwm(text):
+    """ Returns the list of PWMChip described by the debugfs 'text'. """
+    chips = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if line[0].isspace():
+            channel = PWMChannel.parse(line)
+            if channel is not None and chips:
+                chips[-1].channels.append(channel)
+            continue
+        m = CHIP_RE.match(line.strip())
+        if m is not None:
+            npwm = int(m.group(3)) if m.group(3) else None
+            chips.append(PWMChip(m.group(2), npwm))
+    return chips
+
+
+def read_pwm(path=DEBUGFS_PWM):
+    """ Reads and parses the PWM debugfs file of the root filesystem. """
+    with open(rootfs_path(path)) as fh:
+        return parse_pwm(fh.read())
+
+
+def ec_pwm_channel(chips, label):
+    """ Returns the channel of an EC PWM chip requested by 'label', or
+        None.
+    """
+    for chip in chips:
+        if chip.is_ec:
+            channel = chip.channel(label)
+            if channel is not None:
+                return channel
+    return None
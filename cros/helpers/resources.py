@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Declarations used by the runners to schedule tests concurrently. A test
+    method without declaration is an independent read-only check.
+"""
+
+
+def uses_resources(*resources):
+    """ Decorator declaring that a test talks to the given resources (e.g.
+        an MCU name), and must not run concurrently with any other test
+        using one of them.
+    """
+    def decorator(func):
+        func.cros_resources = frozenset(resources)
+        return func
+    return decorator
+
+
+def exclusive(func):
+    """ Decorator declaring that a test changes the system state (e.g. an
+        MCU reboot) and must run alone.
+    """
+    func.cros_exclusive = True
+    return func
+
+
+def test_resources(test):
+    """ Returns the resources declared by the 'test' case. """
+    method = getattr(test, getattr(test, "_testMethodName", ""), None)
+    return getattr(method, "cros_resources", frozenset())
+
+
+def test_is_exclusive(test):
+    """ Returns true if the 'test' case must run alone. """
+    method = getattr(test, getattr(test, "_testMethodName", ""), None)
+    return getattr(method, "cros_exclusive", False)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+# Environment variable used to relocate every /sys, /dev, /proc and /run
+# path used by the helpers and the tests, e.g. to an extracted capture.
+ROOTFS_ENV = "CROS_EC_TESTS_ROOT"
+
+ROOTFS = os.environ.get(ROOTFS_ENV, "/")
+
+
+def get_rootfs():
+    """ Returns the root the system paths are resolved against. """
+    return ROOTFS
+
+
+def set_rootfs(root):
+    """ Resolves all system paths against 'root' from now on. """
+    global ROOTFS
+    ROOTFS = os.path.abspath(root)
+
+
+def rootfs_path(path):
+    """ Returns the absolute system 'path' resolved against the root. """
+    if ROOTFS == "/":
+        return path
+    return os.path.join(ROOTFS, path.lstrip("/"))
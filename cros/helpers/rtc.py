@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Reads of an RTC through its character device and its sysfs
+    'since_epoch' attribute, and measure of its drift against the system
+    clocks.
+"""
+
+from ctypes import c_int
+from ctypes import Structure
+import calendar
+import fcntl
+import os
+import time
+
+RTC_RD_TIME = 0x80247009  # _IOR('p', 0x09, struct rtc_time)
+
+
+class rtc_time(Structure):
+    _fields_ = [
+        ("tm_sec", c_int),
+        ("tm_min", c_int),
+        ("tm_hour", c_int),
+        ("tm_mday", c_int),
+        ("tm_mon", c_int),
+        ("tm_year", c_int),
+        ("tm_wday", c_int),
+        ("tm_yday", c_int),
+        ("tm_isdst", c_int),
+    ]
+
+
+def rtc_read_time(fd, tm=None):
+    """ Returns the time of the RTC open as 'fd' in seconds since the epoch,
+        read with the RTC_RD_TIME ioctl into 'tm' if given.
+    """
+    if tm is None:
+        tm = rtc_time()
+    fcntl.ioctl(fd, RTC_RD_TIME, tm)
+    return calendar.timegm((tm.tm_year + 1900, tm.tm_mon + 1, tm.tm_mday,
+                            tm.tm_hour, tm.tm_min, tm.tm_sec))
+
+
+def rtc_read_since_epoch(fd):
+    """ Returns the value of a 'since_epoch' attribute open as 'fd'. """
+    return int(os.pread(fd, 32, 0))
+
+
+class RTCEdge:
+    """ A transition of the RTC to second 'rtc', and the CLOCK_MONOTONIC and
+        CLOCK_REALTIME times at which it was seen, taken halfway between
+        the last read of the previous second and the first read of 'rtc'.
+        'uncertainty' is half the time between those reads, in seconds.
+    """
+
+    def __init__(self, rtc, monotonic, realtime, uncertainty=0.0):
+        self.rtc = rtc
+        self.monotonic = monotonic
+        self.realtime = realtime
+        self.uncertainty = uncertainty
+
+
+class RTCSampler:
+    """ Reads an RTC through 'read' (a callable returning its time in
+        seconds) and records the read latencies and the second edges.
+    """
+
+    def __init__(self, read):
+        self.read = read
+        self.latencies = []
+        self.edges = []
+        self._last = None
+
+    def sample(self):
+        mono0, real0 = time.monotonic(), time.time()
+        t0 = time.perf_counter()
+        value = self.read()
+        self.latencies.append(time.perf_counter() - t0)
+        mono1, real1 = time.monotonic(), time.time()
+        if self._last is not None and value != self._last[0]:
+            _, last_mono, last_real = self._last
+            self.edges.append(RTCEdge(value, (last_mono + mono1) / 2,
+                                      (last_real + real1) / 2,
+                                      (mono1 - last_mono) / 2))
+        self._last = (value, mono0, real0)
+        return value
+
+    def drift_ppm(self, clock="monotonic"):
+        """ Returns the drift of the RTC against 'clock' (monotonic or
+            realtime) in parts per million between the first and the last
+            edges, positive if the RTC is fast, or None with less than two
+            edges.
+        """
+        if len(self.edges) < 2:
+            return None
+        first, last = self.edges[0], self.edges[-1]
+        elapsed = getattr(last, clock) - getattr(first, clock)
+        return ((last.rtc - first.rtc) - elapsed) / elapsed * 1e6
+
+    def drift_resolution_ppm(self):
+        """ Returns the uncertainty of drift_ppm() in parts per million,
+            due to the time between the reads around the first and the last
+            edges, or None with less than two edges.
+        """
+        if len(self.edges) < 2:
+            return None
+        first, last = self.edges[0], self.edges[-1]
+        elapsed = last.monotonic - first.monotonic
+        return (first.uncertainty + last.uncertainty) / elapsed * 1e6
+
+    def offset(self):
+        """ Returns the offset of the RTC from CLOCK_REALTIME in seconds at
+            the last edge, or None if no edge was seen.
+        """
+        if not self.edges:
+            return None
+        return self.edges[-1].rtc - self.edges[-1].realtime
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+# Prefix of the environment variables overriding test settings, e.g.
+# CROS_EC_TESTS_ACCEL_WINDOW=5 for the 'ACCEL_WINDOW' setting.
+SETTINGS_ENV_PREFIX = "CROS_EC_TESTS_"
+
+
+def get_setting(name, default):
+    """ Returns the 'name' setting from the environment, converted to the
+        type of 'default', or 'default' if it is not set.
+    """
+    value = os.environ.get(SETTINGS_ENV_PREFIX + name)
+    if value is None:
+        return default
+    return type(default)(value)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Descriptive statistics over samples. NumPy is used when available,
+    otherwise the samples are processed with the standard library.
+"""
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def percentile(values, p):
+    """ Returns the 'p' percentile (0-100) of 'values', interpolated
+        linearly between the closest ranks.
+    """
+    if numpy is not None:
+        return float(numpy.percentile(values, p))
+    values = sorted(values)
+    if not values:
+        raise ValueError("percentile of empty data")
+    k = (len(values) - 1) * p / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(values, percentiles=(50, 90, 99)):
+    """ Returns a dict with the count, mean, variance, standard deviation,
+        min, max and the requested percentiles (as 'p50'...) of 'values'.
+    """
+    if numpy is not None:
+        a = numpy.asarray(values, dtype=float)
+        if a.size == 0:
+            raise ValueError("summary of empty data")
+        summary = {
+            "count": int(a.size),
+            "mean": float(a.mean()),
+            "variance": float(a.var()),
+            "min": float(a.min()),
+            "max": float(a.max()),
+        }
+        for p, v in zip(percentiles, numpy.percentile(a, percentiles)):
+            summary[f"p{p}"] = float(v)
+    else:
+        a = sorted(values)
+        if not a:
+            raise ValueError("summary of empty data")
+        mean = math.fsum(a) / len(a)
+        summary = {
+            "count": len(a),
+            "mean": mean,
+            "variance": math.fsum((v - mean) ** 2 for v in a) / len(a),
+            "min": float(a[0]),
+            "max": float(a[-1]),
+        }
+        for p in percentiles:
+            summary[f"p{p}"] = float(percentile(a, p))
+    summary["stddev"] = math.sqrt(summary["variance"])
+    return summary
+
+
+class RunningStats:
+    """ Count, mean and variance of a stream of values, updated in constant
+        memory (Welford's algorithm). Partial statistics computed separately
+        can be combined with merge().
+    """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
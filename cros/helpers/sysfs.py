@@ -1,7 +1,333 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import errno
 import os
+import select
+import threading
+import time
+
+from cros.helpers.rootfs import rootfs_path
+
+# Device directories indexed in a single pass on first use. They are
+# resolved against the configured root filesystem.
+SYSFS_INDEXED_PATHS = [
+    "/sys/bus/iio/devices",
+    "/sys/class/rtc",
+    "/sys/class/extcon",
+    "/sys/class/power_supply",
+    "/sys/class/chromeos",
+    "/sys/class/backlight",
+]
+
+# Largest content of a sysfs attribute.
+SYSFS_PAGE_SIZE = 4096
+
+
+class SysfsDevice:
+    """ A device directory of the sysfs index. 'devname' is the directory
+        name (e.g. iio:device0) and 'name' the content of its 'name'
+        attribute, or None if it has none.
+    """
+
+    def __init__(self, path, name, entries):
+        self.path = path
+        self.devname = os.path.basename(path)
+        self.name = name
+        # sub directory -> {entry name: is a directory}
+        self._listings = {"": entries}
+
+    def __repr__(self):
+        return f"SysfsDevice({self.path!r}, {self.name!r})"
+
+    def entries(self, subdir=""):
+        """ Returns the {entry name: is a directory} listing of 'subdir'. """
+        subdir = subdir.strip("/")
+        listing = self._listings.get(subdir)
+        if listing is None:
+            listing = _scan_entries(os.path.join(self.path, subdir))
+            self._listings[subdir] = listing
+        return listing
+
+    def attribute_path(self, attr):
+        return os.path.join(self.path, attr)
+
+    def has(self, attr):
+        """ Returns true if the 'attr' entry exists. 'attr' may be nested,
+            e.g. 'power/autosuspend_delay_ms', and a trailing '/' requires
+            the entry to be a directory.
+        """
+        want_dir = attr.endswith("/")
+        subdir, _, entry = attr.rstrip("/").rpartition("/")
+        listing = self.entries(subdir)
+        if entry not in listing:
+            return False
+        return listing[entry] or not want_dir
+
+
+def _scan_entries(path):
+    entries = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    entries[entry.name] = entry.is_dir()
+                except OSError:
+                    entries[entry.name] = False
+    except OSError:
+        pass
+    return entries
+
+
+def _scan_devices(path):
+    devices = []
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return devices
+    with it:
+        for entry in it:
+            devpath = os.path.join(path, entry.name)
+            entries = _scan_entries(devpath)
+            name = None
+            if "name" in entries and not entries["name"]:
+                try:
+                    with open(os.path.join(devpath, "name")) as fh:
+                        name = fh.read()
+                except OSError:
+                    pass
+            devices.append(SysfsDevice(devpath, name, entries))
+    devices.sort(key=lambda d: d.devname)
+    return devices
+
+
+class SysfsIndex:
+    """ Cached index of device directories to their name and attributes.
+        The well-known paths are scanned together on first use, any other
+        path is scanned the first time it is queried. Paths are system
+        paths, the devices carry the path resolved against the root.
+    """
+
+    def __init__(self, paths=SYSFS_INDEXED_PATHS):
+        self._paths = paths
+        self._devices = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        paths = [rootfs_path(os.path.normpath(p)) for p in self._paths]
+        return {p: _scan_devices(p) for p in paths}
+
+    def devices(self, path):
+        """ Returns the list of SysfsDevice found under 'path'. """
+        path = rootfs_path(os.path.normpath(path))
+        with self._lock:
+            if self._devices is None:
+                self._devices = self._build()
+            devices = self._devices.get(path)
+            if devices is None:
+                devices = self._devices[path] = _scan_devices(path)
+        return devices
+
+    def device(self, path, devname):
+        """ Returns the SysfsDevice 'devname' under 'path', or None. """
+        for dev in self.devices(path):
+            if dev.devname == devname:
+                return dev
+        return None
+
+    def refresh(self):
+        """ Drops the index, it is rebuilt on next query. """
+        with self._lock:
+            self._devices = None
+
+
+class SysfsReadError:
+    """ Why the attribute 'path' could not be read: 'reason' is 'missing',
+        'unreadable' (with the 'errno' of the failure) or 'invalid' when
+        the content does not parse.
+    """
+
+    def __init__(self, path, reason, message, errno=None):
+        self.path = path
+        self.reason = reason
+        self.message = message
+        self.errno = errno
+
+    def __repr__(self):
+        return f"SysfsReadError({self.path!r}, {self.reason!r})"
+
+    def __str__(self):
+        return self.message
+
+
+class SysfsAttributes:
+    """ Result of a batched read: 'values' maps the attributes read to
+        their parsed value, 'errors' maps the others to a SysfsReadError.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.errors = {}
+
+    def __getitem__(self, attr):
+        return self.values[attr]
+
+    def get(self, attr, default=None):
+        return self.values.get(attr, default)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def error_message(self):
+        return ", ".join(str(e) for e in self.errors.values())
+
+    def check(self):
+        """ Raises OSError for the first error, for callers which cannot go
+            on without all the attributes. Returns self otherwise.
+        """
+        for error in self.errors.values():
+            raise OSError(error.errno or errno.EINVAL, error.message,
+                          error.path)
+        return self
+
+
+class SysfsAttributeReader:
+    """ Reads and parses sysfs attributes. An attribute is read with a
+        single pread() of a page, the largest content sysfs returns.
+        Attributes read with 'cache' are kept open, so that reading them
+        again costs a single syscall.
+    """
+
+    def __init__(self):
+        self._fds = {}
+        self._lock = threading.Lock()
+
+    def _read(self, path, cache):
+        if not cache:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                return os.pread(fd, SYSFS_PAGE_SIZE, 0)
+            finally:
+                os.close(fd)
+        fd = self._fds.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY)
+            with self._lock:
+                if path in self._fds:
+                    os.close(fd)
+                    fd = self._fds[path]
+                else:
+                    self._fds[path] = fd
+        try:
+            return os.pread(fd, SYSFS_PAGE_SIZE, 0)
+        except OSError as e:
+            if e.errno == errno.ENODEV:
+                # the device is gone, reopen on next read
+                self._forget(path)
+            raise
+
+    def _forget(self, path):
+        with self._lock:
+            fd = self._fds.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def read_value(self, path, parser=str, cache=False):
+        """ Returns the content of the attribute 'path' converted by
+            'parser', or a SysfsReadError.
+        """
+        try:
+            raw = self._read(path, cache)
+        except FileNotFoundError:
+            return SysfsReadError(path, "missing", f"{path} not found",
+                                  errno.ENOENT)
+        except OSError as e:
+            return SysfsReadError(path, "unreadable", f"{path}: {e.strerror}",
+                                  e.errno)
+        text = raw.decode(errors="replace").strip()
+        try:
+            return parser(text)
+        except ValueError:
+            return SysfsReadError(path, "invalid",
+                                  f"{path}: invalid value {text!r}")
+
+    def read(self, dev, attrs, cache=False):
+        """ Reads the attributes 'attrs' of 'dev', a SysfsDevice or a device
+            directory, and returns a SysfsAttributes. 'attrs' is a list of
+            attribute names read as strings, or a {name: parser} dict, e.g.
+            {"scale": float}. The attributes missing from the index of a
+            SysfsDevice are reported without being opened.
+        """
+        if not isinstance(attrs, dict):
+            attrs = dict.fromkeys(attrs, str)
+        is_indexed = isinstance(dev, SysfsDevice)
+        base = dev.path if is_indexed else dev
+        result = SysfsAttributes()
+        for attr, parser in attrs.items():
+            path = os.path.join(base, attr)
+            if is_indexed and not dev.has(attr):
+                value = SysfsReadError(path, "missing", f"{path} not found",
+                                       errno.ENOENT)
+            else:
+                value = self.read_value(path, parser, cache)
+            if isinstance(value, SysfsReadError):
+                result.errors[attr] = value
+            else:
+                result.values[attr] = value
+        return result
+
+    def close(self):
+        """ Closes the cached descriptors. """
+        with self._lock:
+            fds, self._fds = self._fds, {}
+        for fd in fds.values():
+            os.close(fd)
+
+
+SYSFS_INDEX = SysfsIndex()
+SYSFS_READER = SysfsAttributeReader()
+
+
+def sysfs_index():
+    """ Returns the process wide sysfs index. """
+    return SYSFS_INDEX
+
+
+def sysfs_refresh():
+    """ Drops the process wide sysfs index and the cached attribute
+        descriptors. Call this after any operation that changes the device
+        set, e.g. an MCU reboot.
+    """
+    SYSFS_INDEX.refresh()
+    SYSFS_READER.close()
+
+
+def sysfs_read_attributes(dev, attrs, cache=False):
+    """ Reads the attributes 'attrs' of 'dev' with the process wide reader,
+        see SysfsAttributeReader.read().
+    """
+    return SYSFS_READER.read(dev, attrs, cache)
+
+
+def sysfs_read_value(path, parser=str, cache=False):
+    """ Reads the attribute 'path' with the process wide reader, see
+        SysfsAttributeReader.read_value().
+    """
+    return SYSFS_READER.read_value(path, parser, cache)
+
+
+def sysfs_find_devices(path, name, check_devtype):
+    """ Returns the devices under 'path' matching 'name'. With
+        'check_devtype' the 'name' attribute must start with 'name',
+        otherwise the device directory name must.
+    """
+    matches = []
+    for dev in SYSFS_INDEX.devices(path):
+        devtype = dev.name if check_devtype else dev.devname
+        if devtype is not None and devtype.startswith(name):
+            matches.append(dev)
+    return matches
 
 
 def sysfs_check_attributes_exists(s, path, name, files, check_devtype):
@@ -10,21 +336,62 @@ def sysfs_check_attributes_exists(s, path, name, files, check_devtype):
         before checking a device path.
     """
     match = 0
-    for devname in os.listdir(path):
+    for dev in SYSFS_INDEX.devices(path):
         if check_devtype:
-            p = os.path.join(path, devname, "name")
-            if not os.path.exists(p):
-                s.skipTest(f"{p} not found")
-            with open(p) as fh:
-                devtype = fh.read()
-            if not devtype.startswith(name):
+            if dev.name is None:
+                s.skipTest(f"{dev.attribute_path('name')} not found")
+            if not dev.name.startswith(name):
                 continue
         else:
-            if not devname.startswith(name):
+            if not dev.devname.startswith(name):
                 continue
         match += 1
         for filename in files:
-            p = os.path.join(path, devname, filename)
-            s.assertTrue(os.path.exists(p), msg=f"{p} not found")
+            s.assertTrue(dev.has(filename),
+                         msg=f"{dev.attribute_path(filename)} not found")
     if match == 0:
         s.skipTest(f"No {name} found")
+
+
+def _read_fd(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            return b"".join(chunks).decode(errors="replace").strip()
+        chunks.append(chunk)
+
+
+def sysfs_wait_for(path, predicate, timeout=1.0, min_interval=0.001,
+                   max_interval=0.1):
+    """ Waits until the content of the file 'path' satisfies 'predicate',
+        called with the stripped content, and returns that content.
+
+        Between reads the file is polled for POLLPRI, so attributes
+        notified by their driver (sysfs_notify) are read back as soon as
+        they change. Other files, e.g. debugfs ones, are read back after
+        an interval doubling from 'min_interval' up to 'max_interval'.
+        Raises TimeoutError if the condition is not met after 'timeout'
+        seconds.
+    """
+    deadline = time.monotonic() + timeout
+    interval = min_interval
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        poller = select.poll()
+        poller.register(fd, select.POLLPRI | select.POLLERR)
+        while True:
+            value = _read_fd(fd)
+            if predicate(value):
+                return value
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{path} still {value!r} after {timeout}s")
+            if poller.poll(min(interval, remaining) * 1000):
+                # notified, read the new value right away
+                interval = min_interval
+            else:
+                interval = min(interval * 2, max_interval)
+    finally:
+        os.close(fd)
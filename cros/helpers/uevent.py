@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Kernel uevents of the extcon, power_supply and typec devices, matched
+    to the sysfs state changes they announce.
+
+    A source produces a time-ordered stream of observations: UEvent read
+    from a NETLINK_KOBJECT_UEVENT socket, and StateChange seen by polling
+    the state attributes of the tracked devices. LiveUEventSource observes
+    the running system, RecordedUEventSource replays a stream written by
+    write_observations(), so that captures can be analyzed offline.
+
+    UEventMatcher pairs each event with the state change of the same
+    device, and reports the event-to-state latency, the state changes
+    without event, the socket overruns and the events received out of
+    order. The holes in the event seqnums are only informational: the
+    seqnums are global, but the events of the devices of other network
+    namespaces, e.g. the network devices of containers, are not received.
+"""
+
+import errno
+import json
+import os
+import select
+import socket
+import time
+
+from cros.helpers.rootfs import rootfs_path
+from cros.helpers.stats import summarize
+from cros.helpers.sysfs import SysfsAttributeReader, SysfsIndex
+
+NETLINK_KOBJECT_UEVENT = 15
+# multicast group of the uevents sent by the kernel, the udev one is 2
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 8192
+UEVENT_RCVBUF = 1 << 20
+
+# subsystem -> (class directory, attributes holding the device state)
+UEVENT_SUBSYSTEMS = {
+    "extcon": ("/sys/class/extcon", ["state"]),
+    "power_supply": ("/sys/class/power_supply", ["online", "status",
+                                                  "present"]),
+    "typec": ("/sys/class/typec", []),
+}
+
+# Largest hole in the uevent seqnums whose events are tracked one by one,
+# so that those received late are not reported as missing.
+UEVENT_MAX_TRACKED_HOLE = 1024
+
+# Pseudo attribute of a typec port holding whether a partner is attached.
+TYPEC_PARTNER = "partner"
+
+
+class UEvent:
+    """ A kernel uevent: 'action' (add, change...) of the device 'devpath'
+        (relative to /sys), its 'seqnum' and environment, and the
+        CLOCK_MONOTONIC 'time' it was received at.
+    """
+
+    def __init__(self, action, devpath, env, time):
+        self.action = action
+        self.devpath = devpath
+        self.env = env
+        self.time = time
+
+    def __repr__(self):
+        return f"UEvent({self.action!r}, {self.devpath!r}, {self.seqnum})"
+
+    @property
+    def subsystem(self):
+        return self.env.get("SUBSYSTEM")
+
+    @property
+    def seqnum(self):
+        seqnum = self.env.get("SEQNUM")
+        return None if seqnum is None else int(seqnum)
+
+    @classmethod
+    def parse(cls, data, received=None):
+        """ Returns the uevent of a kernel netlink message, or None for
+            anything else, e.g. a message of udev.
+        """
+        fields = data.rstrip(b"\0").split(b"\0")
+        header = fields[0].decode(errors="replace")
+        action, sep, devpath = header.partition("@")
+        if not sep or not devpath.startswith("/"):
+            return None
+        env = {}
+        for field in fields[1:]:
+            key, sep, value = field.decode(errors="replace").partition("=")
+            if sep:
+                env[key] = value
+        return cls(action, devpath, env,
+                   time.monotonic() if received is None else received)
+
+    def to_json(self):
+        return {"type": "uevent", "time": self.time, "action": self.action,
+                "devpath": self.devpath, "env": self.env}
+
+
+class StateChange:
+    """ The state of the device 'devpath' seen changing at the
+        CLOCK_MONOTONIC 'time'. 'changes' maps each attribute changed to
+        its (old, new) values, a value of None meaning that the attribute
+        could not be read.
+    """
+
+    def __init__(self, devpath, subsystem, changes, time):
+        self.devpath = devpath
+        self.subsystem = subsystem
+        self.changes = changes
+        self.time = time
+
+    def __repr__(self):
+        return f"StateChange({self.devpath!r}, {self.changes!r})"
+
+    def to_json(self):
+        return {"type": "state", "time": self.time, "devpath": self.devpath,
+                "subsystem": self.subsystem,
+                "changes": {attr: list(values)
+                            for attr, values in self.changes.items()}}
+
+
+class NetlinkUEventSource:
+    """ Receives the kernel uevents from a NETLINK_KOBJECT_UEVENT socket.
+        'overruns' counts the times the socket buffer overflowed, i.e.
+        events were lost.
+    """
+
+    def __init__(self, rcvbuf=UEVENT_RCVBUF):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                  NETLINK_KOBJECT_UEVENT)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        except OSError:
+            self.sock.close()
+            raise
+        self.overruns = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def receive(self, timeout=None):
+        """ Returns the next uevent, or None if none came within 'timeout'
+            seconds.
+        """
+        while True:
+            ready, _, _ = select.select([self.sock], [], [], timeout)
+            if not ready:
+                return None
+            try:
+                data = self.sock.recv(UEVENT_BUFFER_SIZE)
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                self.overruns += 1
+                continue
+            event = UEvent.parse(data)
+            if event is not None:
+                return event
+
+
+class SysfsStateTracker:
+    """ Polls the state attributes of the devices of 'subsystems' (keys of
+        UEVENT_SUBSYSTEMS), read through descriptors kept open, and
+        returns their changes. Only the devices for which 'select', called
+        with the subsystem and the device directory, returns true are
+        tracked.
+    """
+
+    def __init__(self, subsystems=UEVENT_SUBSYSTEMS, select=None):
+        self.subsystems = list(subsystems)
+        self.select = select
+        self.index = SysfsIndex([UEVENT_SUBSYSTEMS[s][0] for s in subsystems])
+        self.reader = SysfsAttributeReader()
+        self.sys_root = rootfs_path("/sys")
+        # devpath -> (subsystem, sysfs directory)
+        self.devices = {}
+        self.scan()
+        self.state = {}
+        self.poll()
+
+    def devpath(self, path):
+        """ Returns the devpath of a sysfs device directory, as in the
+            uevents.
+        """
+        path = os.path.realpath(path)
+        return "/" + os.path.relpath(path, os.path.realpath(self.sys_root))
+
+    def scan(self):
+        """ Looks up the devices of the tracked subsystems, e.g. after an
+            'add' uevent.
+        """
+        self.index.refresh()
+        for subsystem in self.subsystems:
+            for dev in self.index.devices(UEVENT_SUBSYSTEMS[subsystem][0]):
+                if subsystem == "typec" and (
+                        not dev.devname.startswith("port") or
+                        "-" in dev.devname):
+                    # partners, cables and plugs are tracked through ports
+                    continue
+                if self.select is not None and \
+                   not self.select(subsystem, dev.path):
+                    continue
+                self.devices[self.devpath(dev.path)] = (subsystem, dev.path)
+
+    def _read(self, subsystem, path):
+        if subsystem == "typec":
+            partner = os.path.join(path, f"{os.path.basename(path)}-partner")
+            return {TYPEC_PARTNER: "yes" if os.path.isdir(partner) else "no"}
+        attrs = self.reader.read(path, UEVENT_SUBSYSTEMS[subsystem][1],
+                                 cache=True)
+        values = {}
+        for attr in UEVENT_SUBSYSTEMS[subsystem][1]:
+            error = attrs.errors.get(attr)
+            if error is None:
+                values[attr] = attrs[attr]
+            elif error.reason != "missing":
+                values[attr] = None
+        return values
+
+    def poll(self, now=None):
+        """ Reads the state of every tracked device and returns the list of
+            StateChange since the previous poll.
+        """
+        if now is None:
+            now = time.monotonic()
+        changes = []
+        for devpath, (subsystem, path) in self.devices.items():
+            values = self._read(subsystem, path)
+            old = self.state.get(devpath)
+            self.state[devpath] = values
+            if old is None:
+                continue
+            changed = {attr: (old.get(attr), value)
+                       for attr, value in values.items()
+                       if old.get(attr) != value}
+            if changed:
+                changes.append(StateChange(devpath, subsystem, changed, now))
+        return changes
+
+    def close(self):
+        self.reader.close()
+
+
+class LiveUEventSource:
+    """ Observes the running system: the uevents of 'netlink' and the state
+        changes of 'tracker', polled every 'interval' seconds and right
+        after each event.
+    """
+
+    def __init__(self, netlink, tracker, interval=0.01):
+        self.netlink = netlink
+        self.tracker = tracker
+        self.interval = interval
+
+    @property
+    def overruns(self):
+        return self.netlink.overruns
+
+    def observations(self, duration):
+        """ Yields the UEvent and StateChange seen for 'duration' seconds,
+            in time order.
+        """
+        deadline = time.monotonic() + duration
+        next_poll = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            event = self.netlink.receive(max(min(next_poll, deadline) - now,
+                                             0))
+            if event is not None:
+                yield event
+                if event.action == "add":
+                    self.tracker.scan()
+            elif time.monotonic() < next_poll:
+                continue
+            yield from self.tracker.poll()
+            next_poll = time.monotonic() + self.interval
+
+    def close(self):
+        self.netlink.close()
+        self.tracker.close()
+
+
+def observation_from_json(record):
+    if record["type"] == "uevent":
+        return UEvent(record["action"], record["devpath"], record["env"],
+                      record["time"])
+    return StateChange(record["devpath"], record["subsystem"],
+                       {attr: tuple(values)
+                        for attr, values in record["changes"].items()},
+                       record["time"])
+
+
+class RecordedUEventSource:
+    """ Replays the observations recorded in the JSON lines file 'path'.
+        'overruns' is the number of socket overflows of the recording.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.overruns = 0
+
+    def observations(self, duration=None):
+        with open(self.path) as fh:
+            first = None
+            for line in fh:
+                record = json.loads(line)
+                if record["type"] == "overruns":
+                    self.overruns = record["count"]
+                    continue
+                if first is None:
+                    first = record["time"]
+                if duration is not None and record["time"] - first > duration:
+                    return
+                yield observation_from_json(record)
+
+    def close(self):
+        pass
+
+
+def write_observations(observations, fh, source=None):
+    """ Writes 'observations' as JSON lines to the text file 'fh', passing
+        them through. The socket overflows of 'source' are written last.
+    """
+    for observation in observations:
+        fh.write(json.dumps(observation.to_json(), sort_keys=True) + "\n")
+        yield observation
+    if source is not None:
+        fh.write(json.dumps({"type": "overruns",
+                             "count": source.overruns}) + "\n")
+
+
+def _related(a, b):
+    """ Returns true if the devpaths 'a' and 'b' are the same device, or a
+        device and one of its children, e.g. a typec port and its partner.
+    """
+    return a == b or a.startswith(b + "/") or b.startswith(a + "/")
+
+
+class UEventMatcher:
+    """ Pairs the uevents of the tracked 'subsystems' with the state changes
+        of the same device seen less than 'window' seconds apart.
+    """
+
+    def __init__(self, subsystems=UEVENT_SUBSYSTEMS, window=1.0):
+        self.subsystems = set(subsystems)
+        self.window = window
+        self.pending_events = []
+        self.pending_changes = []
+        self.matches = []
+        self.unmatched_events = []
+        self.missed = []
+        self.out_of_order = []
+        self.events = 0
+        # seqnums not received yet, and the size of the holes too large
+        # to be tracked one by one
+        self.missing_seqnums = set()
+        self.untracked_seqnums = 0
+        self._last_seqnum = None
+
+    @property
+    def seqnum_gaps(self):
+        """ Number of seqnums never received. """
+        return len(self.missing_seqnums) + self.untracked_seqnums
+
+    def _check_seqnum(self, event):
+        seqnum = event.seqnum
+        if seqnum is None:
+            return
+        last = self._last_seqnum
+        if last is not None:
+            if seqnum <= last:
+                # late rather than lost
+                self.missing_seqnums.discard(seqnum)
+                self.out_of_order.append(event)
+                return
+            # a hole is an event of another network namespace, or one lost
+            # by the socket, which the overruns tell apart
+            if seqnum - last - 1 > UEVENT_MAX_TRACKED_HOLE:
+                self.untracked_seqnums += seqnum - last - 1
+            else:
+                self.missing_seqnums.update(range(last + 1, seqnum))
+        self._last_seqnum = seqnum
+
+    def _expire(self, now):
+        limit = now - self.window
+        while self.pending_events and self.pending_events[0].time < limit:
+            self.unmatched_events.append(self.pending_events.pop(0))
+        while self.pending_changes and self.pending_changes[0].time < limit:
+            self.missed.append(self.pending_changes.pop(0))
+
+    def feed(self, observation):
+        self._expire(observation.time)
+        if isinstance(observation, UEvent):
+            self._check_seqnum(observation)
+            if observation.subsystem not in self.subsystems:
+                return
+            self.events += 1
+            for i, change in enumerate(self.pending_changes):
+                if _related(change.devpath, observation.devpath):
+                    self.matches.append((observation,
+                                         self.pending_changes.pop(i)))
+                    return
+            self.pending_events.append(observation)
+        else:
+            for i, event in enumerate(self.pending_events):
+                if _related(event.devpath, observation.devpath):
+                    self.matches.append((self.pending_events.pop(i),
+                                         observation))
+                    return
+            self.pending_changes.append(observation)
+
+    def finish(self):
+        """ Expires the observations still pending at the end of the
+            stream.
+        """
+        self._expire(float("inf"))
+
+    def report(self, overruns=0):
+        """ Returns a dict with the event-to-state latency summary per
+            subsystem (in seconds, negative when the state changed before
+            the event was received), the counts of missed, unmatched and
+            out of order events, the seqnums never received and the socket
+            'overruns'.
+        """
+        latencies = {}
+        for event, change in self.matches:
+            latencies.setdefault(change.subsystem, []).append(
+                change.time - event.time)
+        report = {
+            "events": self.events,
+            "matched": len(self.matches),
+            "missed": len(self.missed),
+            "unmatched_events": len(self.unmatched_events),
+            "out_of_order": len(self.out_of_order),
+            "seqnum_gaps": self.seqnum_gaps,
+            "overruns": overruns,
+            "latency": {},
+        }
+        for subsystem, values in latencies.items():
+            st = summarize(values, (50, 90, 99))
+            report["latency"][subsystem] = {
+                key: st[key] for key in ["count", "min", "p50", "p90", "p99",
+                                         "max"]}
+        return report
+
+
+def uevent_failures(report):
+    """ Returns the list of anomalies of a UEventMatcher report: state
+        changes without event, socket overruns (i.e. events lost) and
+        events out of order. The seqnum gaps are not anomalies.
+    """
+    failures = []
+    if report["missed"]:
+        failures.append(f"{report['missed']} state changes without uevent")
+    if report["overruns"]:
+        failures.append(f"{report['overruns']} socket overruns, uevents "
+                        "lost")
+    if report["out_of_order"]:
+        failures.append(f"{report['out_of_order']} uevents out of order")
+    return failures
@@ -1,48 +1,388 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import functools
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
+from cros.helpers.bundle import extract_bundle
+from cros.helpers.capabilities import UnmetRequirementsTest
+from cros.helpers.ec_emulator import install_emulators
+from cros.helpers.measurements import format_measurement, test_measurements
+from cros.helpers.resources import test_is_exclusive, test_resources
+from cros.helpers.rootfs import set_rootfs
+from cros.runners.reporters import REPORTERS, TestTiming, make_reporter
+
+
+# Optional measurements emitted for each test, in addition to its duration.
+TIMING_MEASUREMENTS = ["cpu", "syscalls"]
+
+
+def _reporter(spec):
+    try:
+        return make_reporter(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 
 class LavaTestResult(unittest.TextTestResult):
-    def writeLavaSignal(self, test, result):
-        test_case_id = test.id().rsplit(".")[-1]
+    """ Writes a LAVA test case signal for each test, with its duration as
+        measurement. The measurements recorded by a test, and optionally
+        its CPU time and syscalls, are emitted as the test cases of a test
+        set named after the test. The slowest tests are summarized at the
+        end of the run. Every event is also forwarded to the 'reporters'
+        results.
+    """
+
+    def __init__(self, stream, descriptions, verbosity):
+        super().__init__(stream, descriptions, verbosity)
+        self.measurements = []
+        self.slowest = 10
+        self.reporters = []
+        self.timings = {}
+        self._signaled = set()
+        self._run_start = None
+
+    def _forward(self, name, *args):
+        for reporter in self.reporters:
+            getattr(reporter, name)(*args)
+
+    def startTestRun(self):
+        super().startTestRun()
+        self._run_start = time.perf_counter()
+        self._forward("startTestRun")
+
+    def startTest(self, test):
+        super().startTest(test)
+        timing = self.timings.setdefault(test, TestTiming())
+        self._forward("setTestTiming", test, timing)
+        self._forward("startTest", test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        self._forward("stopTest", test)
+
+    def setTestTiming(self, test, timing):
+        """ Sets the timing of a test measured elsewhere, e.g. on a worker
+            thread, before its outcome is reported.
+        """
+        self.timings[test] = timing
 
+    def writeSignal(self, test_case_id, result, measurement=None, units=None):
         # LAVA signal must be start-of-line.  Print a newline if verbosity >= 1.
         if self.showAll or self.dots:
             self.stream.writeln()
 
-        self.stream.writeln(
-            f"<LAVA_SIGNAL_TESTCASE TEST_CASE_ID={test_case_id} RESULT={result}>"
-        )
+        signal = f"<LAVA_SIGNAL_TESTCASE TEST_CASE_ID={test_case_id} RESULT={result}"
+        if measurement is not None:
+            signal += f" MEASUREMENT={measurement} UNITS={units}"
+        self.stream.writeln(f"{signal}>")
+        self.stream.flush()
+
+    def writeLavaSignal(self, test, result):
+        test_case_id = test.id().rsplit(".")[-1]
+        timing = self.timings.get(test)
+        if timing is None or test in self._signaled:
+            self.writeSignal(test_case_id, result)
+            return
+        self._signaled.add(test)
+
+        timing.stop()
+        self.writeSignal(test_case_id, result, format_measurement(timing.wall),
+                         "seconds")
+        measurements = []
+        if "cpu" in self.measurements:
+            measurements.append(("cpu_time", format_measurement(timing.cpu),
+                                 "seconds"))
+        if "syscalls" in self.measurements and timing.syscalls is not None:
+            measurements.append(("syscalls",
+                                 format_measurement(timing.syscalls),
+                                 "syscalls"))
+        measurements += test_measurements(test)
+        if measurements:
+            self.writeTestSet(test_case_id, measurements)
+
+    def writeTestSet(self, name, measurements):
+        """ Writes the (name, value, units) 'measurements' as the test cases
+            of the LAVA test set 'name'.
+        """
+        self.stream.writeln(f"<LAVA_SIGNAL_TESTSET START {name}>")
+        for test_case_id, value, units in measurements:
+            self.writeSignal(test_case_id, "pass", value, units)
+        self.stream.writeln("<LAVA_SIGNAL_TESTSET STOP>")
+        self.stream.flush()
+
+    def stopTestRun(self):
+        super().stopTestRun()
+        self._forward("stopTestRun")
+        if self._run_start is None:
+            return
+        duration = time.perf_counter() - self._run_start
+        self.writeSignal("cros_ec_tests_duration", "pass",
+                         format_measurement(duration), "seconds")
+        if self.slowest <= 0:
+            return
+        timed = [(t.wall, test.id()) for test, t in self.timings.items()
+                 if t.wall is not None]
+        timed.sort(reverse=True)
+        self.stream.writeln()
+        self.stream.writeln(f"Slowest {min(self.slowest, len(timed))} tests:")
+        for wall, test_id in timed[:self.slowest]:
+            self.stream.writeln(f"  {wall:10.6f}s  {test_id}")
         self.stream.flush()
 
     def addSuccess(self, test):
         super().addSuccess(test)
         self.writeLavaSignal(test, "pass")
+        self._forward("addSuccess", test)
 
     def addError(self, test, err):
         super().addError(test, err)
         self.writeLavaSignal(test, "unknown")
+        self._forward("addError", test, err)
 
     def addFailure(self, test, err):
         super().addFailure(test, err)
         self.writeLavaSignal(test, "fail")
+        self._forward("addFailure", test, err)
 
     def addSkip(self, test, reason):
         super().addSkip(test, reason)
         self.writeLavaSignal(test, "skip")
+        self._forward("addSkip", test, reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._forward("addExpectedFailure", test, err)
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._forward("addUnexpectedSuccess", test)
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        self._forward("addSubTest", test, subtest, err)
+
+
+class RecordingTestResult(unittest.TestResult):
+    """ Records the outcome of a test run on a worker thread, so that it can
+        be replayed later on the real result from the main thread.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.events = []
+        self.timing = None
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.timing = TestTiming()
+
+    def stopTest(self, test):
+        self.timing.stop()
+        super().stopTest(test)
+
+    def _record(name):
+        def record(self, test, *args):
+            self.timing.stop()
+            self.events.append((name, test, args))
+        return record
+
+    addSuccess = _record("addSuccess")
+    addError = _record("addError")
+    addFailure = _record("addFailure")
+    addSkip = _record("addSkip")
+    addExpectedFailure = _record("addExpectedFailure")
+    addUnexpectedSuccess = _record("addUnexpectedSuccess")
+    addSubTest = _record("addSubTest")
+    del _record
+
+    def addDuration(self, test, elapsed):
+        # reported by unittest since Python 3.12
+        self.events.append(("addDuration", test, (elapsed,)))
+
+    def replay(self, test, result):
+        if self.timing is not None and hasattr(result, "setTestTiming"):
+            result.setTestTiming(test, self.timing)
+        result.startTest(test)
+        for name, t, args in self.events:
+            method = getattr(result, name, None)
+            if method is not None:
+                method(t, *args)
+        result.stopTest(test)
+
+
+def iter_test_cases(suite):
+    """ Yields the test cases of a suite, depth first. """
+    if isinstance(suite, unittest.TestSuite):
+        for test in suite:
+            yield from iter_test_cases(test)
+    else:
+        yield suite
+
+
+class ParallelTestSuite:
+    """ Runs the test cases of 'suite' on a pool of 'jobs' threads.
+
+        Tests declaring the same resources never run concurrently, and
+        exclusive tests run alone once every test before them completed.
+        Outcomes are reported on the result in suite order, from the
+        calling thread only. Class and module fixtures are not supported.
+    """
+
+    def __init__(self, suite, jobs):
+        self.suite = suite
+        self.jobs = jobs
+        self._locks = collections.defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    def countTestCases(self):
+        return self.suite.countTestCases()
+
+    def _run_one(self, test):
+        with self._locks_lock:
+            locks = [self._locks[r] for r in sorted(test_resources(test))]
+        for lock in locks:
+            lock.acquire()
+        try:
+            recorder = RecordingTestResult()
+            test(recorder)
+            return recorder
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _flush(self, pending, result):
+        for test, future in pending:
+            future.result().replay(test, result)
+        pending.clear()
+
+    def __call__(self, result):
+        pending = []
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as pool:
+            for test in iter_test_cases(self.suite):
+                if result.shouldStop:
+                    break
+                if test_is_exclusive(test):
+                    self._flush(pending, result)
+                    self._run_one(test).replay(test, result)
+                else:
+                    pending.append((test, pool.submit(self._run_one, test)))
+            self._flush(pending, result)
+        return result
 
 
 class LavaTestRunner(unittest.TextTestRunner):
-    __init__ = functools.partialmethod(
-                    unittest.TextTestRunner.__init__,
-                    resultclass=LavaTestResult)
+    def __init__(self, *args, jobs=1, measurements=(), slowest=10,
+                 reporters=(), **kwargs):
+        kwargs.setdefault("resultclass", LavaTestResult)
+        super().__init__(*args, **kwargs)
+        self.jobs = jobs
+        self.measurements = list(measurements)
+        self.slowest = slowest
+        self.reporters = list(reporters)
+
+    def _makeResult(self):
+        result = super()._makeResult()
+        if isinstance(result, LavaTestResult):
+            result.measurements = self.measurements
+            result.slowest = self.slowest
+            result.reporters = self.reporters
+        return result
+
+    def run(self, test):
+        if self.jobs > 1:
+            test = ParallelTestSuite(test, self.jobs)
+        return super().run(test)
+
+
+class LavaTestProgram(unittest.TestProgram):
+    """ unittest.TestProgram with the cros-ec-tests specific options. """
+
+    def _getParentArgParser(self):
+        parser = super()._getParentArgParser()
+        group = parser.add_argument_group("cros-ec-tests options")
+        group.add_argument("--root", metavar="DIR",
+                           help="Resolve /sys, /dev, /proc and /run "
+                                "against DIR")
+        group.add_argument("--replay", metavar="BUNDLE",
+                           help="Run against a bundle captured with "
+                                "cros.tools.capture")
+        group.add_argument("--emulate", action="append", metavar="MCU",
+                           help="Answer the EC commands of MCU (e.g. "
+                                "cros_ec) with an emulator")
+        group.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                           help="Run tests on N worker threads, 0 for one "
+                                "per CPU (default: 1)")
+        group.add_argument("--measure", action="append", default=[],
+                           choices=TIMING_MEASUREMENTS,
+                           help="Also report the CPU time or the read/write "
+                                "syscalls of each test")
+        group.add_argument("--slowest", type=int, default=10, metavar="N",
+                           help="Summarize the N slowest tests, 0 to "
+                                "disable (default: 10)")
+        group.add_argument("--report", action="append", default=[],
+                           type=_reporter, metavar="FORMAT:PATH",
+                           help="Also write the results to PATH, FORMAT is "
+                                f"one of {', '.join(REPORTERS)}")
+        group.add_argument("--list", action="store_true",
+                           help="List the tests that would run on this "
+                                "system, and why the others are skipped")
+        return parser
+
+    def createTests(self, *args, **kwargs):
+        if self.replay:
+            # removed at exit
+            self._replay_dir = tempfile.TemporaryDirectory(prefix="cros-ec-")
+            self.root = extract_bundle(self.replay, self._replay_dir.name)
+        if self.root:
+            set_rootfs(self.root)
+        if self.emulate:
+            install_emulators(self.emulate)
+        super().createTests(*args, **kwargs)
+
+    def listTests(self):
+        for test in iter_test_cases(self.test):
+            if isinstance(test, UnmetRequirementsTest):
+                print(f"{test.id()}: skip ({', '.join(test.reasons)})")
+            else:
+                print(f"{test.id()}: run")
+
+    def runTests(self):
+        if self.list:
+            self.listTests()
+            if self.exit:
+                sys.exit(0)
+            return
+        if isinstance(self.testRunner, type) and \
+           issubclass(self.testRunner, LavaTestRunner):
+            kwargs = {}
+            if getattr(self, "durations", None) is not None:
+                # --durations, since Python 3.12
+                kwargs["durations"] = self.durations
+            self.testRunner = self.testRunner(
+                verbosity=self.verbosity,
+                failfast=self.failfast,
+                buffer=self.buffer,
+                warnings=self.warnings,
+                tb_locals=self.tb_locals,
+                jobs=self.jobs or os.cpu_count(),
+                measurements=self.measure,
+                slowest=self.slowest,
+                reporters=self.report,
+                **kwargs,
+            )
+        super().runTests()
 
 
 if __name__ == "__main__":
-    unittest.main(
+    LavaTestProgram(
         module="cros.tests",
         testRunner=LavaTestRunner,
         # these make sure that some options that are not applicable
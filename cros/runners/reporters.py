@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Machine-readable reporters of the test results.
+
+    Reporters are unittest results fed by :class:`LavaTestResult` in
+    addition to the LAVA signals, several of them can be used in the same
+    run. They are selected on the runner command line with
+    ``--report FORMAT:PATH``.
+"""
+
+import abc
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ET
+
+from cros.helpers.kernel import get_kernel_info
+from cros.helpers.measurements import test_measurements
+from cros.helpers.rootfs import rootfs_path
+
+# Files holding the board name, the first one found is used.
+BOARD_NAME_PATHS = [
+    "/proc/device-tree/model",
+    "/sys/class/dmi/id/product_name",
+]
+
+
+def _thread_syscalls():
+    """ Returns the read and write syscalls made by the calling thread, or
+        None when the kernel does not account them.
+    """
+    try:
+        with open("/proc/thread-self/io") as fh:
+            counters = dict(line.split(":") for line in fh)
+        return int(counters["syscr"]) + int(counters["syscw"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class TestTiming:
+    """ Wall-clock duration, CPU time and read/write syscalls of a test,
+        measured on the thread running it.
+    """
+
+    def __init__(self):
+        self.wall = None
+        self.cpu = None
+        self.syscalls = None
+        self._start = (time.perf_counter(), time.thread_time(),
+                       _thread_syscalls())
+
+    def stop(self):
+        if self.wall is not None:
+            return self
+        wall, cpu, syscalls = self._start
+        self.wall = time.perf_counter() - wall
+        self.cpu = time.thread_time() - cpu
+        if syscalls is not None:
+            end = _thread_syscalls()
+            self.syscalls = None if end is None else end - syscalls
+        return self
+
+
+def board_name():
+    """ Returns the name of the board under test, or None if unknown. """
+    for path in BOARD_NAME_PATHS:
+        try:
+            with open(rootfs_path(path), "rb") as fh:
+                name = fh.read().rstrip(b"\0\n").decode(errors="replace")
+        except OSError:
+            continue
+        if name:
+            return name
+    return None
+
+
+def kernel_release():
+    try:
+        return get_kernel_info().release
+    except OSError:
+        return None
+
+
+class ReporterResult(unittest.TestResult, abc.ABC):
+    """ Base class of the reporters: collects the outcome and the timing of
+        every test and hands them to report() as soon as the test stops.
+    """
+
+    def __init__(self, stream=None, descriptions=None, verbosity=None):
+        super().__init__(stream, descriptions, verbosity)
+        self.timings = {}
+        self.run_start = None
+        self.run_end = None
+        self._outcomes = {}
+
+    def setTestTiming(self, test, timing):
+        self.timings[test] = timing
+
+    def startTestRun(self):
+        super().startTestRun()
+        self.run_start = time.time()
+
+    def stopTestRun(self):
+        self.run_end = time.time()
+        super().stopTestRun()
+
+    def startTest(self, test):
+        super().startTest(test)
+        self.timings.setdefault(test, TestTiming())
+
+    def _outcome(self, test, result, message=None):
+        timing = self.timings.get(test)
+        if timing is None:
+            # failures and skips of class or module fixtures are reported
+            # on an _ErrorHolder, which is never started nor stopped
+            self.report(test, result, message, TestTiming().stop())
+            return
+        timing.stop()
+        # keep the first failure, e.g. over a tearDown error
+        if self._outcomes.get(test, ("pass",))[0] == "pass":
+            self._outcomes[test] = (result, message)
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._outcome(test, "pass")
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._outcome(test, "unknown", self._exc_info_to_string(err, test))
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._outcome(test, "fail", self._exc_info_to_string(err, test))
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._outcome(test, "skip", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._outcome(test, "pass")
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._outcome(test, "fail", "unexpected success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            failed = issubclass(err[0], test.failureException)
+            self._outcome(test, "fail" if failed else "unknown",
+                          self._exc_info_to_string(err, test))
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        timing = self.timings.setdefault(test, TestTiming()).stop()
+        result, message = self._outcomes.pop(test, ("unknown", None))
+        self.report(test, result, message, timing)
+
+    @abc.abstractmethod
+    def report(self, test, result, message, timing):
+        """ Reports the 'result' (pass, fail, skip or unknown) of 'test',
+            with the failure or skip 'message' and its TestTiming.
+        """
+
+
+class JSONLReporter(ReporterResult):
+    """ Writes one JSON record per line to 'path': a 'run' record with the
+        board and the kernel, a 'test' record as soon as each test stops,
+        and a 'summary' record at the end. Every record is flushed, so an
+        interrupted run still leaves the results of the completed tests.
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self._fh = None
+
+    def _write(self, record):
+        self._fh.write(json.dumps(record, sort_keys=True) + "\n")
+        self._fh.flush()
+
+    def startTestRun(self):
+        super().startTestRun()
+        self._fh = open(self.path, "w")
+        self._write({
+            "type": "run",
+            "start": self.run_start,
+            "hostname": socket.gethostname(),
+            "board": board_name(),
+            "kernel": kernel_release(),
+        })
+
+    def report(self, test, result, message, timing):
+        record = {
+            "type": "test",
+            "id": test.id(),
+            "name": test.id().rsplit(".")[-1],
+            "result": result,
+            "duration": timing.wall,
+            "cpu_time": timing.cpu,
+            "syscalls": timing.syscalls,
+        }
+        if message is not None:
+            record["message"] = message
+        measurements = test_measurements(test)
+        if measurements:
+            record["measurements"] = {name: {"value": value, "units": units}
+                                      for name, value, units in measurements}
+        self._write(record)
+
+    def stopTestRun(self):
+        super().stopTestRun()
+        self._write({
+            "type": "summary",
+            "tests": self.testsRun,
+            "failures": len(self.failures),
+            "errors": len(self.errors),
+            "skipped": len(self.skipped),
+            "duration": self.run_end - self.run_start,
+        })
+        self._fh.close()
+        self._fh = None
+
+
+class JUnitReporter(ReporterResult):
+    """ Writes the results as a JUnit XML file to 'path' at the end of the
+        run, with one testsuite per test class.
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.cases = []
+
+    def report(self, test, result, message, timing):
+        self.cases.append((test, result, message, timing.wall))
+
+    def stopTestRun(self):
+        super().stopTestRun()
+        root = ET.Element("testsuites", name="cros-ec-tests",
+                          time=f"{self.run_end - self.run_start:.6f}")
+        properties = {"board": board_name(), "kernel": kernel_release()}
+        suites = {}
+        for test, result, message, wall in self.cases:
+            classname, _, name = test.id().rpartition(".")
+            suite = suites.get(classname)
+            if suite is None:
+                suite = suites[classname] = ET.SubElement(
+                    root, "testsuite", name=classname,
+                    hostname=socket.gethostname(),
+                    timestamp=time.strftime("%Y-%m-%dT%H:%M:%S",
+                                            time.gmtime(self.run_start)))
+                props = ET.SubElement(suite, "properties")
+                for key, value in properties.items():
+                    if value is not None:
+                        ET.SubElement(props, "property", name=key, value=value)
+            case = ET.SubElement(suite, "testcase", classname=classname,
+                                 name=name, time=f"{wall:.6f}")
+            if result == "fail":
+                ET.SubElement(case, "failure",
+                              message=message.splitlines()[-1]).text = message
+            elif result == "unknown":
+                text = message or ""
+                ET.SubElement(case, "error",
+                              message=(text.splitlines() or [""])[-1]).text = text
+            elif result == "skip":
+                ET.SubElement(case, "skipped", message=message or "")
+
+        for suite in suites.values():
+            cases = suite.findall("testcase")
+            suite.set("tests", str(len(cases)))
+            for tag, attr in [("failure", "failures"), ("error", "errors"),
+                              ("skipped", "skipped")]:
+                suite.set(attr, str(sum(1 for c in cases
+                                        if c.find(tag) is not None)))
+            suite.set("time", f"{sum(float(c.get('time')) for c in cases):.6f}")
+
+        tree = ET.ElementTree(root)
+        ET.indent(tree)
+        # written aside and renamed, so a report is never seen half written
+        with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(self.path) or ".", prefix=".junit-",
+                suffix=".xml", delete=False) as fh:
+            try:
+                tree.write(fh, encoding="utf-8", xml_declaration=True)
+            except BaseException:
+                os.unlink(fh.name)
+                raise
+        try:
+            os.replace(fh.name, self.path)
+        except OSError:
+            os.unlink(fh.name)
+            raise
+
+
+# --report format -> reporter class
+REPORTERS = {
+    "jsonl": JSONLReporter,
+    "junit": JUnitReporter,
+}
+
+
+def make_reporter(spec):
+    """ Returns the reporter of a 'FORMAT:PATH' specification. """
+    fmt, sep, path = spec.partition(":")
+    if not sep or not path or fmt not in REPORTERS:
+        raise ValueError(f"Invalid report '{spec}', expected one of "
+                         f"{', '.join(f'{f}:PATH' for f in REPORTERS)}")
+    return REPORTERS[fmt](path)
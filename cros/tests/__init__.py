@@ -1,7 +1,93 @@
-from .cros_ec_accel import *
-from .cros_ec_extcon import *
-from .cros_ec_gyro import *
-from .cros_ec_mcu import *
-from .cros_ec_power import *
-from .cros_ec_pwm import *
-from .cros_ec_rtc import *
+""" The test suite. Test modules are imported on demand: the requirements
+    of each module listed in TEST_MODULES are checked first, and the tests
+    of a module whose requirements are unmet are reported as skipped from
+    its source, without importing it. Test modules and classes can still
+    be accessed as attributes of the package, e.g. to run a test by name.
+"""
+
+import functools
+import importlib
+import importlib.util
+import unittest
+
+from cros.helpers import capabilities
+from cros.helpers.capabilities import DevicePresent, ECFeature, SysfsDevices
+from cros.helpers.ec_cmd import EC_FEATURE_MOTION_SENSE_FIFO, EC_FEATURE_RTC
+
+# test module -> requirements shared by all its tests
+TEST_MODULES = {
+    "cros_ec_accel": [
+        SysfsDevices("/sys/bus/iio/devices", "cros-ec-accel", True),
+    ],
+    "cros_ec_extcon": [SysfsDevices("/sys/class/extcon")],
+    "cros_ec_fifo": [
+        SysfsDevices("/sys/bus/iio/devices", "cros-ec-", True),
+        ECFeature(EC_FEATURE_MOTION_SENSE_FIFO),
+    ],
+    "cros_ec_gyro": [
+        SysfsDevices("/sys/bus/iio/devices", "cros-ec-gyro", True),
+    ],
+    "cros_ec_mcu": [],
+    "cros_ec_power": [SysfsDevices("/sys/class/power_supply")],
+    "cros_ec_pwm": [SysfsDevices("/sys/class/backlight")],
+    "cros_ec_rtc": [
+        DevicePresent("/dev/cros_ec"),
+        ECFeature(EC_FEATURE_RTC),
+    ],
+    "cros_ec_uevent": [],
+}
+
+
+def _module_tests(loader, name, unmet):
+    """ Returns [(class name, tests)] of the test module 'name'. """
+    module = f"{__name__}.{name}"
+    if unmet:
+        path = importlib.util.find_spec(module).origin
+        return [(classname, [capabilities.UnmetRequirementsTest(
+                    test_id, unmet, description)
+                    for test_id, description in tests])
+                for classname, tests in
+                capabilities.test_ids_from_source(path, module, loader)]
+    suite = loader.loadTestsFromModule(importlib.import_module(module))
+    classes = []
+    for tests in suite:
+        tests = list(capabilities.gate_tests(tests))
+        if tests:
+            classes.append((tests[0].id().split(".")[-2], tests))
+    return classes
+
+
+def load_tests(loader, standard_tests, pattern):
+    classes = []
+    for name, requirements in TEST_MODULES.items():
+        unmet = capabilities.unmet_requirements(requirements)
+        classes.extend(_module_tests(loader, name, unmet))
+    # same order as test classes loaded from a single namespace
+    classes.sort(key=lambda c: c[0])
+    suite = loader.suiteClass()
+    for _, tests in classes:
+        suite.addTest(loader.suiteClass(tests))
+    return suite
+
+
+@functools.lru_cache(maxsize=None)
+def _test_classes():
+    """ Returns {class name: module} of the test classes, from the sources. """
+    loader = unittest.TestLoader()
+    classes = {}
+    for name in TEST_MODULES:
+        module = f"{__name__}.{name}"
+        path = importlib.util.find_spec(module).origin
+        for classname, _ in capabilities.test_ids_from_source(path, module,
+                                                              loader):
+            classes[classname] = module
+    return classes
+
+
+def __getattr__(name):
+    if name in TEST_MODULES:
+        return importlib.import_module(f"{__name__}.{name}")
+    module = _test_classes().get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import glob
-import math
-import os
 import unittest
 
+from cros.helpers.capabilities import requires_sysfs
 from cros.helpers.ec_cmd import EC_FEATURE_MOTION_SENSE_FIFO
 from cros.helpers.ec_cmd import is_feature_supported
+from cros.helpers.iio import magnitude, read_raw_samples, sample_devices
 from cros.helpers.kernel import kernel_greater_than
 from cros.helpers.kernel import kernel_lower_than
+from cros.helpers.resources import exclusive, uses_resources
+from cros.helpers.settings import get_setting
+from cros.helpers.stats import summarize
 from cros.helpers.sysfs import sysfs_check_attributes_exists
+from cros.helpers.sysfs import sysfs_index
+from cros.helpers.sysfs import sysfs_read_attributes
 
+ACCEL_AXES = ["accel_x", "accel_y", "accel_z"]
 
+
+@requires_sysfs("/sys/bus/iio/devices", "cros-ec-accel", True)
 class TestCrosECAccel(unittest.TestCase):
+    @uses_resources("cros_ec")
     def test_cros_ec_accel_iio_abi(self):
         """ Checks the cros-ec accelerometer IIO ABI. """
         files = [
@@ -49,47 +57,56 @@ class TestCrosECAccel(unittest.TestCase):
         )
 
 
+    @exclusive
     def test_cros_ec_accel_iio_data_is_valid(self):
         """ Validates accelerometer data by computing the magnitude. If the
             magnitude is not closed to 1G, that means data are invalid or
             the machine is in movement or there is a earth quake.
+
+            All the accelerometers are sampled together through their IIO
+            buffer for ACCEL_WINDOW seconds, and the mean and the 5th to 95th
+            percentiles of the magnitude must be close to 1G, so that a
+            single noisy sample does not fail the test.
         """
         ACCEL_1G_IN_MS2 = 9.8185
         ACCEL_MAG_VALID_OFFSET = 0.25
         exp = ACCEL_1G_IN_MS2
         err = exp * ACCEL_MAG_VALID_OFFSET
 
-        match = 0
-        for dev in glob.glob("/sys/bus/iio/devices/*"):
-            p = os.path.join(dev, "name")
-            if not os.path.exists(p):
-                self.skipTest(f"{p} not found")
-            with open(p) as fh:
-                devtype = fh.read()
-            if not devtype.startswith("cros-ec-accel"):
+        devices = []
+        for dev in sysfs_index().devices("/sys/bus/iio/devices"):
+            if dev.name is None:
+                self.skipTest(f"{dev.attribute_path('name')} not found")
+            if not dev.name.startswith("cros-ec-accel"):
                 continue
 
-            p = os.path.join(dev, "scale")
-            if not os.path.exists(p):
-                self.skipTest(f"{p} not found")
-            with open(p) as fh:
-                accel_scale = float(fh.read())
+            for axis in ACCEL_AXES:
+                if not dev.has(f"in_{axis}_raw"):
+                    self.skipTest(f"{dev.attribute_path(f'in_{axis}_raw')} "
+                                  "not found")
+            attrs = sysfs_read_attributes(dev, {"scale": float})
+            if not attrs.ok:
+                self.skipTest(attrs.error_message())
+            devices.append((dev, attrs["scale"]))
+        if not devices:
+            self.skipTest("No accelerometer found")
 
-            mag = 0
-            for axis in ["in_accel_x_raw", "in_accel_y_raw", "in_accel_z_raw"]:
-                axis_path = os.path.join(dev, axis)
-                if not os.path.exists(axis_path):
-                    self.skipTest(f"{axis_path} not found")
+        samples = sample_devices([dev.path for dev, _ in devices], ACCEL_AXES,
+                                 get_setting("ACCEL_WINDOW", 2.0))
 
-                with open(axis_path) as fh:
-                    value = int(fh.read())
-                value *= accel_scale
-                mag += value * value
-            mag = math.sqrt(mag)
+        for dev, accel_scale in devices:
+            s = samples.get(dev.path)
+            if s is None or len(s["accel_x"]) == 0:
+                s = read_raw_samples(dev.path, ACCEL_AXES,
+                                     get_setting("ACCEL_RAW_SAMPLES", 10))
+            mag = magnitude(*(s[axis] for axis in ACCEL_AXES), accel_scale)
+            st = summarize(mag, (5, 50, 95))
 
-            self.assertTrue(abs(mag - exp) <= err,
+            self.assertTrue(abs(st["mean"] - exp) <= err,
                             msg=("Incorrect accelerometer data "
-                                 f"in {dev} ({abs(mag - exp)})"))
-            match += 1
-        if match == 0:
-            self.skipTest("No accelerometer found")
+                                 f"in {dev.path} ({abs(st['mean'] - exp)}, "
+                                 f"variance {st['variance']})"))
+            self.assertTrue(st["p5"] >= exp - err and st["p95"] <= exp + err,
+                            msg=("Noisy accelerometer data in "
+                                 f"{dev.path} (p5 {st['p5']}, "
+                                 f"p95 {st['p95']}, {st['count']} samples)"))
@@ -1,30 +1,31 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import glob
 import os
 import unittest
 
+from cros.helpers.capabilities import requires_sysfs
+from cros.helpers.sysfs import sysfs_index
 
+
+@requires_sysfs("/sys/class/extcon")
 class TestCrosECextcon(unittest.TestCase):
     def test_cros_ec_extcon_usbc_abi(self):
         """ Checks the cros-ec extcon ABI. """
         match = 0
-        for dev in glob.glob("/sys/class/extcon/*"):
-            with open(os.path.join(dev, "name")) as fh:
-                devtype = fh.read()
-            if ".spi:ec@0:extcon@" not in devtype:
+        for dev in sysfs_index().devices("/sys/class/extcon"):
+            if dev.name is None or ".spi:ec@0:extcon@" not in dev.name:
                 continue
 
-            p = os.path.join(dev, "state")
-            self.assertTrue(os.path.exists(p), msg=f"{p} not found")
+            self.assertTrue(dev.has("state"),
+                            msg=f"{dev.attribute_path('state')} not found")
 
-            for cable in os.listdir(dev):
+            for cable in dev.entries():
                 if cable.startswith("cable"):
-                    p = os.path.join(dev, cable, "name")
-                    self.assertTrue(os.path.exists(p), msg=f"{p} not found")
-                    p = os.path.join(dev, cable, "state")
-                    self.assertTrue(os.path.exists(p), msg=f"{p} not found")
+                    for attr in ["name", "state"]:
+                        p = os.path.join(cable, attr)
+                        self.assertTrue(dev.has(p),
+                                        msg=f"{dev.attribute_path(p)} not found")
                     match += 1
         if match == 0:
             self.skipTest("No extcon device found")
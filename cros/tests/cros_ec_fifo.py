@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from cros.helpers.capabilities import requires_ec_feature, requires_sysfs
+from cros.helpers.ec_cmd import EC_FEATURE_MOTION_SENSE_FIFO
+from cros.helpers.iio import IIOBufferSampler, sample_buffers
+from cros.helpers.measurements import record_measurement
+from cros.helpers.resources import exclusive
+from cros.helpers.settings import get_setting
+from cros.helpers.stats import summarize
+from cros.helpers.sysfs import sysfs_find_devices, sysfs_read_attributes
+
+TIMESTAMP_CHANNEL = "timestamp"
+
+
+def fifo_sensors():
+    """ Returns the cros-ec motion sensors streaming through the FIFO, i.e.
+        with a list of sampling frequencies and a timestamp channel.
+    """
+    return [dev for dev in sysfs_find_devices("/sys/bus/iio/devices",
+                                              "cros-ec-", True)
+            if dev.has("sampling_frequency_available") and
+            dev.has(f"scan_elements/in_{TIMESTAMP_CHANNEL}_en")]
+
+
+def scan_channels(dev):
+    """ Returns the names of the scan elements of 'dev', e.g. accel_x. """
+    return sorted(entry[3:-3] for entry in dev.entries("scan_elements")
+                  if entry.startswith("in_") and entry.endswith("_en"))
+
+
+def frequency_list(text):
+    """ Parses a sampling_frequency_available attribute. """
+    return [float(f) for f in text.split()]
+
+
+def _write(path, value):
+    with open(path, "w") as fh:
+        fh.write(str(value))
+
+
+def timestamp_stats(timestamps, frequency, settle):
+    """ Returns the delivery statistics of the sample 'timestamps' (ns) of
+        a sensor sampling at 'frequency' Hz, ignoring the samples of the
+        first 'settle' seconds: delivered rate, duplicated and dropped
+        samples, and jitter as the standard deviation of the intervals
+        relative to the period.
+    """
+    timestamps = list(timestamps)
+    if timestamps:
+        start = timestamps[0] + int(settle * 1e9)
+        timestamps = [t for t in timestamps if t >= start]
+    if len(timestamps) < 3:
+        return None
+    period = 1e9 / frequency
+    deltas = [b - a for a, b in zip(timestamps, timestamps[1:])]
+    duplicates = sum(1 for d in deltas if d <= 0)
+    dropped = sum(round(d / period) - 1 for d in deltas if d > 1.5 * period)
+    elapsed = timestamps[-1] - timestamps[0]
+    st = summarize([d for d in deltas if d > 0] or [0])
+    return {
+        "samples": len(timestamps),
+        "rate": (len(timestamps) - 1) / elapsed * 1e9 if elapsed > 0 else 0.0,
+        "duplicates": duplicates,
+        "dropped": dropped,
+        "jitter": st["stddev"] / period,
+    }
+
+
+@requires_ec_feature(EC_FEATURE_MOTION_SENSE_FIFO)
+@requires_sysfs("/sys/bus/iio/devices", "cros-ec-", True)
+class TestCrosECFIFO(unittest.TestCase):
+    def setUp(self):
+        self.saved_frequencies = {}
+
+    def set_frequency(self, dev, frequency):
+        """ Sets the sampling frequency of 'dev', restored at the end of the
+            test, and returns the frequency applied.
+        """
+        path = dev.attribute_path("sampling_frequency")
+        if path not in self.saved_frequencies:
+            saved = sysfs_read_attributes(dev, ["sampling_frequency"]).check()
+            self.saved_frequencies[path] = saved["sampling_frequency"]
+            self.addCleanup(_write, path, self.saved_frequencies[path])
+        _write(path, frequency)
+        return sysfs_read_attributes(dev, {"sampling_frequency": float}) \
+            .check()["sampling_frequency"]
+
+    @exclusive
+    def test_cros_ec_fifo_rate_and_jitter(self):
+        """ Streams every cros-ec motion sensor through the EC FIFO at each
+            of its available sampling frequencies, and checks from the
+            sample timestamps that:
+
+            * the delivered rate is within CROS_EC_TESTS_FIFO_RATE_TOLERANCE
+              (a ratio) of the sampling frequency,
+            * there are at most FIFO_MAX_DUPLICATES duplicated timestamps,
+            * at most FIFO_MAX_DROP_RATIO of the samples are missing,
+            * the interval jitter is under FIFO_MAX_JITTER of the period.
+
+            The sensors are sampled together, each at the i-th of its
+            frequencies, for FIFO_WINDOW seconds. The samples of the first
+            FIFO_SETTLE seconds, possibly taken at the previous frequency,
+            are left out.
+        """
+        window = get_setting("FIFO_WINDOW", 2.0)
+        settle = get_setting("FIFO_SETTLE", 0.2)
+        rate_tolerance = get_setting("FIFO_RATE_TOLERANCE", 0.1)
+        max_duplicates = get_setting("FIFO_MAX_DUPLICATES", 0)
+        max_drop_ratio = get_setting("FIFO_MAX_DROP_RATIO", 0.01)
+        max_jitter = get_setting("FIFO_MAX_JITTER", 0.25)
+
+        sensors = {}
+        errors = []
+        for dev in fifo_sensors():
+            attrs = sysfs_read_attributes(
+                dev, {"sampling_frequency_available": frequency_list})
+            if not attrs.ok:
+                errors.append(attrs.error_message())
+                continue
+            sensors[dev] = [f for f in attrs["sampling_frequency_available"]
+                            if f > 0]
+        if not sensors and not errors:
+            self.skipTest("No cros-ec motion sensor with timestamps found")
+
+        for step in range(max((len(f) for f in sensors.values()), default=0)):
+            samplers = {}
+            try:
+                for dev, frequencies in sensors.items():
+                    if step >= len(frequencies):
+                        continue
+                    frequency = self.set_frequency(dev, frequencies[step])
+                    sampler = IIOBufferSampler(dev.path, scan_channels(dev))
+                    try:
+                        samplers[sampler.start()] = (dev, frequency)
+                    except OSError as e:
+                        errors.append(f"{dev.path}: cannot enable the "
+                                      f"buffer ({e.strerror})")
+                samples = sample_buffers(list(samplers), window)
+            finally:
+                for sampler in samplers:
+                    sampler.stop()
+
+            for sampler, (dev, frequency) in samplers.items():
+                name = f"{dev.devname}_{frequency:g}hz".replace(":", "_") \
+                                                       .replace(".", "_")
+                st = timestamp_stats(samples[sampler][TIMESTAMP_CHANNEL],
+                                     frequency, settle)
+                if st is None:
+                    errors.append(f"{name}: no samples")
+                    continue
+                for key, units in [("rate", "hz"), ("dropped", "samples"),
+                                   ("duplicates", "samples"),
+                                   ("jitter", "ratio")]:
+                    record_measurement(self, f"{name}_{key}", st[key], units)
+
+                if abs(st["rate"] - frequency) > rate_tolerance * frequency:
+                    errors.append(f"{name}: delivered {st['rate']:.2f} Hz")
+                if st["duplicates"] > max_duplicates:
+                    errors.append(f"{name}: {st['duplicates']} duplicated "
+                                  "samples")
+                if st["dropped"] > max_drop_ratio * (st["samples"] +
+                                                     st["dropped"]):
+                    errors.append(f"{name}: {st['dropped']} dropped samples")
+                if st["jitter"] > max_jitter:
+                    errors.append(f"{name}: jitter {st['jitter']:.2f} of "
+                                  "the period")
+        self.assertFalse(errors, msg=", ".join(errors))
@@ -3,14 +3,25 @@
 
 import unittest
 
+from cros.helpers.capabilities import requires_sysfs
 from cros.helpers.ec_cmd import EC_FEATURE_MOTION_SENSE_FIFO
 from cros.helpers.ec_cmd import is_feature_supported
+from cros.helpers.iio import read_raw_samples, sample_devices
 from cros.helpers.kernel import kernel_greater_than
 from cros.helpers.kernel import kernel_lower_than
+from cros.helpers.resources import exclusive, uses_resources
+from cros.helpers.settings import get_setting
+from cros.helpers.stats import summarize
 from cros.helpers.sysfs import sysfs_check_attributes_exists
+from cros.helpers.sysfs import sysfs_find_devices
+from cros.helpers.sysfs import sysfs_read_attributes
 
+GYRO_AXES = ["anglvel_x", "anglvel_y", "anglvel_z"]
 
+
+@requires_sysfs("/sys/bus/iio/devices", "cros-ec-gyro", True)
 class TestCrosECGyro(unittest.TestCase):
+    @uses_resources("cros_ec")
     def test_cros_ec_gyro_iio_abi(self):
         """ Checks the cros-ec gyroscope IIO ABI. """
         files = [
@@ -44,3 +55,49 @@ class TestCrosECGyro(unittest.TestCase):
         sysfs_check_attributes_exists(
             self, "/sys/bus/iio/devices", "cros-ec-gyro", files, True
         )
+
+    @exclusive
+    def test_cros_ec_gyro_iio_data_is_valid(self):
+        """ Validates gyroscope data at rest. All the gyroscopes are sampled
+            together through their IIO buffer for GYRO_WINDOW seconds. For
+            each axis, the bias (mean) and the noise (standard deviation) of
+            the angular velocity must stay below GYRO_BIAS_TOLERANCE and
+            GYRO_NOISE_TOLERANCE rad/s, otherwise data are invalid or the
+            machine is in movement.
+        """
+        bias_tolerance = get_setting("GYRO_BIAS_TOLERANCE", 0.1)
+        noise_tolerance = get_setting("GYRO_NOISE_TOLERANCE", 0.05)
+
+        devices = []
+        for dev in sysfs_find_devices("/sys/bus/iio/devices", "cros-ec-gyro",
+                                      True):
+            for axis in GYRO_AXES:
+                if not dev.has(f"in_{axis}_raw"):
+                    self.skipTest(f"{dev.attribute_path(f'in_{axis}_raw')} "
+                                  "not found")
+            attrs = sysfs_read_attributes(dev, {"scale": float})
+            if not attrs.ok:
+                self.skipTest(attrs.error_message())
+            devices.append((dev, attrs["scale"]))
+        if not devices:
+            self.skipTest("No gyroscope found")
+
+        samples = sample_devices([dev.path for dev, _ in devices], GYRO_AXES,
+                                 get_setting("GYRO_WINDOW", 2.0))
+
+        for dev, gyro_scale in devices:
+            s = samples.get(dev.path)
+            if s is None or len(s["anglvel_x"]) == 0:
+                s = read_raw_samples(dev.path, GYRO_AXES,
+                                     get_setting("GYRO_RAW_SAMPLES", 10))
+            for axis in GYRO_AXES:
+                st = summarize(s[axis], ())
+                bias = st["mean"] * gyro_scale
+                noise = st["stddev"] * gyro_scale
+                self.assertTrue(abs(bias) <= bias_tolerance,
+                                msg=(f"Gyroscope {axis} bias too high in "
+                                     f"{dev.path} ({bias} rad/s)"))
+                self.assertTrue(noise <= noise_tolerance,
+                                msg=(f"Gyroscope {axis} noise too high in "
+                                     f"{dev.path} ({noise} rad/s, "
+                                     f"{st['count']} samples)"))
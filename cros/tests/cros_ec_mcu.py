@@ -7,7 +7,14 @@ import unittest
 from cros.helpers.ec_cmd import ec_params_hello, ec_response_hello
 from cros.helpers.ec_cmd import send_ec_command
 from cros.helpers import ec_cmd
+from cros.helpers.capabilities import requires_device
+from cros.helpers.ec_stress import READ_ONLY_COMMANDS, run_stress
+from cros.helpers.ec_stress import stress_failures, summarize_stress
+from cros.helpers.measurements import record_measurement
+from cros.helpers.resources import exclusive, uses_resources
+from cros.helpers.settings import get_setting
 from cros.helpers.sysfs import sysfs_check_attributes_exists
+from cros.helpers.sysfs import sysfs_refresh
 
 
 class TestCrosECMCU(unittest.TestCase):
@@ -16,7 +23,7 @@ class TestCrosECMCU(unittest.TestCase):
             the standard MCU ABI in /sys/class/chromeos.
         """
         dev = os.path.join("/dev", name)
-        if not os.path.exists(dev):
+        if not ec_cmd.ec_device_node_exists(dev):
             self.skipTest(f"MCU {name} not supported")
 
         files = ["flashinfo", "reboot", "version"]
@@ -24,31 +31,66 @@ class TestCrosECMCU(unittest.TestCase):
             self, "/sys/class/chromeos/", name, files, False
         )
 
+    @uses_resources("cros_ec")
     def test_cros_ec_abi(self):
         """ Checks the standard ABI for the main Embedded Controller. """
         self.check_abi("cros_ec")
 
+    @uses_resources("cros_fp")
+    @requires_device("/dev/cros_fp")
     def test_cros_fp_abi(self):
         """ Checks the standard ABI for the Fingerprint EC. """
         self.check_abi("cros_fp")
 
+    @uses_resources("cros_tp")
+    @requires_device("/dev/cros_tp")
     def test_cros_tp_abi(self):
         """ Checks the standard ABI for the Touchpad EC. """
         self.check_abi("cros_tp")
 
+    @uses_resources("cros_pd")
+    @requires_device("/dev/cros_pd")
     def test_cros_pd_abi(self):
         """ Checks the standard ABI for the Power Delivery EC. """
         self.check_abi("cros_pd")
 
+    @uses_resources("cros_ec")
     def test_cros_ec_chardev(self):
         """ Checks the main Embedded controller character device. """
-        self.assertTrue(os.path.exists("/dev/cros_ec"),
+        self.assertTrue(ec_cmd.ec_device_node_exists("/dev/cros_ec"),
                         msg="/dev/cros_ec not found")
 
+    @uses_resources("cros_ec", "cros_fp", "cros_tp", "cros_pd")
+    def test_cros_ec_features(self):
+        """ Checks the feature map cached for each MCU, possibly loaded from
+            the store of the current boot, against the 64 feature bits the
+            MCU answers to GET_FEATURES now. Run with --emulate to check it
+            against a stand-in device.
+        """
+        devices = ec_cmd.list_ec_devices()
+        if not devices:
+            self.skipTest("No MCU found")
+        for dev in devices:
+            features = ec_cmd.get_ec_features(dev)
+            if features is None:
+                continue
+            response = ec_cmd.ec_response_get_features()
+            cmd = send_ec_command(dev, ec_cmd.EC_CMD_GET_FEATURES, None,
+                                  response)
+            self.assertEqual(cmd.result, 0,
+                             msg=f"Error sending GET_FEATURES to {dev}")
+            flags = list(response.flags)
+            self.assertEqual(list(features.flags), flags,
+                             msg=f"Stale feature map cached for {dev}")
+            for feature in range(64):
+                expected = bool(flags[feature // 32] & (1 << feature % 32))
+                self.assertEqual(features.supported(feature), expected,
+                                 msg=f"Feature {feature} of {dev}")
+
     def check_hello(self, name):
         """ Checks basic comunication with MCU. """
         dev = os.path.join("/dev", name)
-        if not os.path.exists(dev):
+        if not ec_cmd.ec_device_present(dev):
             self.skipTest(f"MCU {name} not found")
 
         param, response = ec_params_hello(), ec_response_hello()
@@ -61,36 +103,91 @@ class TestCrosECMCU(unittest.TestCase):
         self.assertEqual(response.out_data, 0xA1B2C3D4,
                          msg=f"Wrong EC HELLO magic number ({response.out_data})")
 
+    @uses_resources("cros_ec")
     def test_cros_ec_hello(self):
         """ Checks basic comunication with the main Embedded controller. """
         self.check_hello("cros_ec")
 
+    @uses_resources("cros_fp")
+    @requires_device("/dev/cros_fp")
     def test_cros_fp_hello(self):
         """ Checks basic comunication with the fingerprint controller. """
         self.check_hello("cros_fp")
 
+    @uses_resources("cros_tp")
+    @requires_device("/dev/cros_tp")
     def test_cros_tp_hello(self):
         """ Checks basic comunication with the touchpad controller. """
         self.check_hello("cros_tp")
 
+    @uses_resources("cros_pd")
+    @requires_device("/dev/cros_pd")
     def test_cros_pd_hello(self):
         """ Checks basic comunication with the power delivery controller. """
         self.check_hello("cros_pd")
 
+    @exclusive
+    def test_cros_ec_hello_stress(self):
+        """ Sends HELLO, GET_VERSION and GET_FEATURES from
+            CROS_EC_TESTS_STRESS_WORKERS threads to every MCU present, all
+            at once, for STRESS_DURATION seconds.
+
+            The throughput, latency percentiles and fairness between the
+            workers of each MCU are reported. A lost response or a wrong
+            HELLO magic fails the test: the cros_ec core and the transports
+            share locks, which must not drop commands under contention.
+
+            The stress keeps every MCU busy and holds the whole run, so the
+            test is skipped unless STRESS_DURATION is set.
+        """
+        duration = get_setting("STRESS_DURATION", 0.0)
+        if duration <= 0:
+            self.skipTest("CROS_EC_TESTS_STRESS_DURATION not set")
+        devices = ec_cmd.list_ec_devices()
+        if not devices:
+            self.skipTest("No MCU found")
+        results = run_stress(devices, list(READ_ONLY_COMMANDS),
+                             get_setting("STRESS_WORKERS", 4), duration)
+        summary = summarize_stress(results)
+
+        for dev, entry in summary.items():
+            name = os.path.basename(dev)
+            record_measurement(self, f"{name}_throughput",
+                               entry["commands_per_s"], "commands/s")
+            if "p99_us" in entry:
+                record_measurement(self, f"{name}_latency_p99",
+                                   entry["p99_us"] / 1e6, "seconds")
+            record_measurement(self, f"{name}_fairness", entry["fairness"],
+                               "ratio")
+            record_measurement(self, f"{name}_errors", entry["failed"],
+                               "commands")
+        failures = stress_failures(summary)
+        self.assertFalse(failures, msg=", ".join(failures))
+
     def check_reboot_rw(self, name):
         dev = os.path.join("/dev", name)
-        if not os.path.exists(dev):
+        if not ec_cmd.ec_device_present(dev):
             self.skipTest(f"MCU {name} not found")
 
+        device = ec_cmd.get_ec_device(dev)
+        protocol = device.protocol_info()
+
         cmd = send_ec_command(dev, ec_cmd.EC_CMD_REBOOT)
         self.assertEqual(cmd.result, 0, msg="Failed to REBOOT")
+        # the MCU devices may be re-registered after a reboot
+        sysfs_refresh()
 
-        param, response = None, ec_response_get_version()
+        # the reboot dropped the protocol cached before the RO/RW transition
+        param, response = None, ec_cmd.ec_response_get_version()
         cmd = send_ec_command(dev, ec_cmd.EC_CMD_GET_VERSION, param, response)
-        self.assertEqual(cmd.result, 0, msg="Failed to GET_VERSION")
-        self.assertEqual(response.current_image, EC_IMAGE_RW,
+        if cmd.result != 0:
+            self.fail(f"Failed to GET_VERSION (protocol {protocol} before "
+                      f"reboot, {device.protocol_info()} after)")
+        self.assertEqual(response.current_image, ec_cmd.EC_IMAGE_RW,
                          msg="Current EC image is not RW")
 
+    @exclusive
+    @requires_device("/dev/cros_fp")
     def test_cros_fp_reboot(self):
         """ Test reboot command on Fingerprint MCU.
 
@@ -3,10 +3,16 @@
 
 import unittest
 
+from cros.helpers.capabilities import requires_sysfs
+from cros.helpers.measurements import record_measurement
+from cros.helpers.power import PowerSampler, power_supplies
+from cros.helpers.resources import uses_resources
+from cros.helpers.settings import get_setting
 from cros.helpers.sysfs import sysfs_check_attributes_exists
 
 
 class TestCrosECPower(unittest.TestCase):
+    @requires_sysfs("/sys/class/power_supply", "CROS_USBPD_CHARGER")
     def test_cros_ec_usbpd_charger_abi(self):
         """ Check the cros USBPD charger ABI. """
         files = [
@@ -27,6 +33,7 @@ class TestCrosECPower(unittest.TestCase):
             self, "/sys/class/power_supply/", "CROS_USBPD_CHARGER", files, False
         )
 
+    @requires_sysfs("/sys/class/power_supply", "BAT")
     def test_cros_ec_battery_abi(self):
         """ Check the cros battery ABI. """
         files = [
@@ -51,3 +58,37 @@ class TestCrosECPower(unittest.TestCase):
         sysfs_check_attributes_exists(
             self, "/sys/class/power_supply/", "BAT", files, False
         )
+
+    @uses_resources("cros_ec")
+    @requires_sysfs("/sys/class/power_supply")
+    def test_cros_ec_power_telemetry(self):
+        """ Samples the charger and battery telemetry for POWER_WINDOW
+            seconds at POWER_RATE Hz, and checks that the values stay
+            within the design limits of the power supplies, widened by
+            POWER_LIMIT_TOLERANCE. The voltage and current of an offline
+            supply are not checked.
+
+            The median and worst cost of a read of each attribute are
+            reported as measurements.
+        """
+        window = get_setting("POWER_WINDOW", 2.0)
+        rate = get_setting("POWER_RATE", 20.0)
+        tolerance = get_setting("POWER_LIMIT_TOLERANCE", 0.05)
+        devices = power_supplies()
+        if not devices:
+            self.skipTest("No EC power supply found")
+
+        with PowerSampler(devices, capacity=int(window * rate) + 1) as sampler:
+            if not sampler.channels:
+                self.skipTest("No power supply telemetry found")
+            sampler.run(rate, window)
+
+        for name, summary in sampler.summary().items():
+            name = name.replace("/", "_")
+            for key in ["cost_p50_us", "cost_max_us"]:
+                # no cost for an attribute never read, e.g. ENODATA
+                if key in summary:
+                    record_measurement(self, f"{name}_{key[:-3]}",
+                                       summary[key] / 1e6, "seconds")
+        violations = sampler.violations(tolerance)
+        self.assertFalse(violations, msg=", ".join(violations))
@@ -1,44 +1,152 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import re
-import unittest
 import os
+import time
+import unittest
+
+from cros.helpers.capabilities import requires_sysfs
+from cros.helpers.measurements import record_measurement
+from cros.helpers.pwm import DEBUGFS_PWM, ec_pwm_channel, parse_pwm, read_pwm
+from cros.helpers.resources import exclusive
+from cros.helpers.rootfs import rootfs_path
+from cros.helpers.settings import get_setting
+from cros.helpers.sysfs import sysfs_index, sysfs_read_attributes
+from cros.helpers.sysfs import sysfs_wait_for
+
+
+def ec_backlight_duty(content):
+    """ Returns the duty of the EC backlight PWM in the debugfs 'content',
+        or None.
+    """
+    channel = ec_pwm_channel(parse_pwm(content), "backlight")
+    return None if channel is None else channel.duty
 
 
 class TestCrosECPWM(unittest.TestCase):
+    def setUp(self):
+        self.backlight = sysfs_index().device("/sys/class/backlight",
+                                              "backlight")
+
+    def check_ec_backlight(self):
+        """ Skips the test if the backlight is not driven by an EC PWM, and
+            returns the current EC backlight channel.
+        """
+        if self.backlight is None:
+            self.skipTest("No backlight pwm found")
+        attrs = sysfs_read_attributes(self.backlight, {"brightness": int,
+                                                       "max_brightness": int})
+        if not attrs.ok:
+            self.skipTest(attrs.error_message())
+        self.max_brightness = attrs["max_brightness"]
+
+        debugfs_pwm = rootfs_path(DEBUGFS_PWM)
+        if not os.path.exists(debugfs_pwm):
+            self.skipTest(f"{debugfs_pwm} not found")
+
+        channel = ec_pwm_channel(read_pwm(), "backlight")
+        if channel is None:
+            self.skipTest("No EC backlight pwm found")
+
+        self.addCleanup(self.write_brightness, attrs["brightness"])
+        return channel
+
+    def read_brightness(self):
+        attrs = sysfs_read_attributes(self.backlight, {"brightness": int},
+                                      cache=True)
+        return attrs.check()["brightness"]
+
+    def write_brightness(self, brightness):
+        with open(self.backlight.attribute_path("brightness"), "w") as fh:
+            fh.write(str(brightness))
+
+    def set_brightness(self, brightness, duty_before, interval=None):
+        """ Writes 'brightness' and waits for the EC backlight duty to move
+            away from 'duty_before', unless the brightness is unchanged.
+            Returns the new duty, or None on timeout.
+
+            debugfs cannot be polled for changes, so the duty is read back
+            every 'interval' seconds if given, instead of with a backoff.
+        """
+        intervals = {}
+        if interval is not None:
+            intervals = {"min_interval": interval, "max_interval": interval}
+        changed = brightness != self.read_brightness()
+        self.write_brightness(brightness)
+
+        def updated(content):
+            duty = ec_backlight_duty(content)
+            return duty is not None and (not changed or duty != duty_before)
+
+        try:
+            content = sysfs_wait_for(rootfs_path(DEBUGFS_PWM), updated,
+                                     get_setting("PWM_TIMEOUT", 1.0),
+                                     **intervals)
+        except TimeoutError:
+            return None
+        return ec_backlight_duty(content)
+
+    @exclusive
+    @requires_sysfs("/sys/class/backlight", "backlight")
     def test_cros_ec_pwm_backlight(self):
         """ Check that the backlight is connected to a pwm of the EC and that
             programming a brightness level to the backlight affects the PWM
             duty cycle.
         """
-        if not os.path.exists("/sys/class/backlight/backlight/max_brightness"):
-            self.skipTest("No backlight pwm found")
+        channel = self.check_ec_backlight()
+        brightness = int(self.max_brightness / 2)
+        duty = self.set_brightness(brightness, channel.duty)
+        if duty is None:
+            duty = ec_pwm_channel(read_pwm(), "backlight").duty
+            self.assertNotEqual(duty, 0, msg="duty should not be 0")
+            self.fail(f"duty not updated from {channel.duty}")
+        self.assertNotEqual(duty, 0, msg="duty should not be 0")
 
-        if not os.path.exists("/sys/kernel/debug/pwm"):
-            self.skipTest("/sys/kernel/debug/pwm not found")
+    @exclusive
+    @requires_sysfs("/sys/class/backlight", "backlight")
+    def test_cros_ec_pwm_backlight_sweep(self):
+        """ Sweeps the backlight brightness over increasing levels and checks
+            that the EC PWM duty cycle follows monotonically.
 
-        with open("/sys/kernel/debug/pwm") as fh:
-            pwm = fh.read()
-        for s in pwm.split("\n\n"):
-            if re.match(r".*:ec-pwm.*backlight", s, re.DOTALL):
-                ec_pwm = s
-                break
-        else:
-            self.skipTest("No EC backlight pwm found")
+            The latency between each brightness write and the duty update
+            is reported as the 'stepN_latency' measurement, and must stay
+            under CROS_EC_TESTS_PWM_MAX_LATENCY seconds. The duty is read
+            back every PWM_POLL_INTERVAL seconds, the resolution of the
+            latencies.
+        """
+        channel = self.check_ec_backlight()
+        steps = get_setting("PWM_SWEEP_STEPS", 5)
+        max_latency = get_setting("PWM_MAX_LATENCY", 0.2)
+        interval = get_setting("PWM_POLL_INTERVAL", 0.001)
+        max_brightness = self.max_brightness
+        if max_brightness < steps:
+            self.skipTest(f"Only {max_brightness} brightness levels")
 
-        with open("/sys/class/backlight/backlight/max_brightness") as fh:
-            brightness = int(int(fh.read()) / 2)
-        with open("/sys/class/backlight/backlight/brightness", "w") as fh:
-            fh.write(str(brightness))
-        for s in ec_pwm.split("\n"):
-            if "backlight" not in s:
-                continue
-
-            m = re.search(r"duty: (\d+)", s)
-            if m:
-                duty = int(m.group(1))
-                self.assertNotEqual(duty, 0, msg="duty should not be 0")
-                break
-        else:
-            self.fail("Failed to parse duty")
+        # start from the lowest level so that the first step is timed too
+        levels = [max_brightness * (i + 1) // steps for i in range(steps)]
+        # but not from 0, which may turn the panel and its PWM off
+        start = max(max_brightness // (2 * steps), 1)
+        duty = self.set_brightness(start, channel.duty)
+        if duty is None:
+            duty = ec_pwm_channel(read_pwm(), "backlight").duty
+
+        duties, slow = [], []
+        for i, brightness in enumerate(levels):
+            start = time.perf_counter()
+            new_duty = self.set_brightness(brightness, duty, interval)
+            latency = time.perf_counter() - start
+            if new_duty is None:
+                self.fail(f"duty not updated from {duty} at brightness "
+                          f"{brightness}")
+            record_measurement(self, f"step{i}_latency", latency, "seconds")
+            if latency > max_latency:
+                slow.append(f"{brightness} ({latency:.3f}s)")
+            duty = new_duty
+            duties.append(duty)
+
+        for (b0, d0), (b1, d1) in zip(zip(levels, duties),
+                                      zip(levels[1:], duties[1:])):
+            self.assertGreater(d1, d0, msg=f"duty {d0} at brightness {b0} "
+                                           f"then {d1} at {b1}")
+        self.assertFalse(slow, msg="Slow PWM updates at brightness "
+                                   f"{', '.join(slow)}, over {max_latency}s")
@@ -1,20 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import glob
 import os
+import time
 import unittest
 
+from cros.helpers.capabilities import requires_ec_feature, requires_sysfs
 from cros.helpers.ec_cmd import EC_FEATURE_RTC
-from cros.helpers.ec_cmd import is_feature_supported
+from cros.helpers.measurements import record_measurement
+from cros.helpers.resources import uses_resources
+from cros.helpers.rootfs import rootfs_path
+from cros.helpers.rtc import RTCSampler, rtc_read_since_epoch
+from cros.helpers.rtc import rtc_read_time, rtc_time
+from cros.helpers.settings import get_setting
+from cros.helpers.stats import summarize
+from cros.helpers.sysfs import sysfs_find_devices
 
 
 class TestCrosECRTC(unittest.TestCase):
+    @uses_resources("cros_ec")
+    @requires_ec_feature(EC_FEATURE_RTC)
+    @requires_sysfs("/sys/class/rtc", "cros-ec-rtc", True)
     def test_cros_ec_rtc_abi(self):
         """ Check the cros RTC ABI. """
-        if not is_feature_supported(EC_FEATURE_RTC):
-            self.skipTest("EC_FEATURE_RTC not supported, skipping")
-
         files = [
             "date",
             "hctosys",
@@ -25,15 +33,116 @@ class TestCrosECRTC(unittest.TestCase):
         ]
 
         match = 0
-        for dev in glob.glob("/sys/class/rtc/*"):
-            with open(os.path.join(dev, "name")) as fh:
-                devtype = fh.read()
-            if not devtype.startswith("cros-ec-rtc"):
-                continue
-
+        for dev in sysfs_find_devices("/sys/class/rtc", "cros-ec-rtc", True):
             match += 1
             for filename in files:
-                p = os.path.join(dev, filename)
-                self.assertTrue(os.path.exists(p), msg=f"{p} not found")
+                self.assertTrue(dev.has(filename),
+                                msg=f"{dev.attribute_path(filename)} not found")
         if match == 0:
             self.skipTest("No RTC device found")
+
+    def record_latencies(self, name, latencies):
+        st = summarize(latencies, (50, 99))
+        for key in ["p50", "p99", "max"]:
+            record_measurement(self, f"{name}_{key}", st[key], "seconds")
+        return st
+
+    def open_rtc(self):
+        """ Opens the character device and the 'since_epoch' attribute of
+            the EC RTC, closed at the end of the test, and returns their
+            samplers.
+        """
+        dev = sysfs_find_devices("/sys/class/rtc", "cros-ec-rtc", True)[0]
+        fds = []
+        for path in [rootfs_path(f"/dev/{dev.devname}"),
+                     dev.attribute_path("since_epoch")]:
+            try:
+                fds.append(os.open(path, os.O_RDONLY))
+            except OSError as e:
+                self.skipTest(f"Cannot open {path}: {e.strerror}")
+            self.addCleanup(os.close, fds[-1])
+        rtc_fd, epoch_fd = fds
+
+        tm = rtc_time()
+        ioctl = RTCSampler(lambda: rtc_read_time(rtc_fd, tm))
+        sysfs = RTCSampler(lambda: rtc_read_since_epoch(epoch_fd))
+        try:
+            ioctl.sample()
+        except OSError as e:
+            self.skipTest(f"RTC_RD_TIME not supported on {dev.devname}: {e}")
+        return ioctl, sysfs
+
+    @uses_resources("cros_ec")
+    @requires_ec_feature(EC_FEATURE_RTC)
+    @requires_sysfs("/sys/class/rtc", "cros-ec-rtc", True)
+    def test_cros_ec_rtc_latency(self):
+        """ Reads the EC RTC through its character device (RTC_RD_TIME) and
+            through 'since_epoch' every CROS_EC_TESTS_RTC_READ_INTERVAL
+            seconds for RTC_WINDOW seconds. Each read is an EC command, so
+            the default run is kept short.
+
+            The read latency percentiles of both paths are reported, and
+            their p99 must stay under CROS_EC_TESTS_RTC_MAX_LATENCY seconds:
+            slow EC RTC reads stall suspend and resume.
+        """
+        window = get_setting("RTC_WINDOW", 1.0)
+        interval = get_setting("RTC_READ_INTERVAL", 0.01)
+        max_latency = get_setting("RTC_MAX_LATENCY", 0.05)
+        ioctl, sysfs = self.open_rtc()
+
+        deadline = time.monotonic() + window
+        while time.monotonic() < deadline:
+            rtc = ioctl.sample()
+            epoch = sysfs.sample()
+            # both reads may fall on each side of a second transition
+            self.assertLessEqual(abs(epoch - rtc), 1,
+                                 msg=f"RTC_RD_TIME {rtc} but since_epoch "
+                                     f"{epoch}")
+            time.sleep(interval)
+
+        st_ioctl = self.record_latencies("ioctl", ioctl.latencies)
+        st_sysfs = self.record_latencies("since_epoch", sysfs.latencies)
+        for name, st in [("RTC_RD_TIME", st_ioctl),
+                         ("since_epoch", st_sysfs)]:
+            self.assertLessEqual(st["p99"], max_latency,
+                                 msg=f"{name} p99 latency {st['p99']:.6f}s")
+
+    @uses_resources("cros_ec")
+    @requires_ec_feature(EC_FEATURE_RTC)
+    @requires_sysfs("/sys/class/rtc", "cros-ec-rtc", True)
+    def test_cros_ec_rtc_drift(self):
+        """ Reads the EC RTC with RTC_RD_TIME every
+            CROS_EC_TESTS_RTC_DRIFT_READ_INTERVAL seconds for
+            RTC_DRIFT_WINDOW seconds. The drift of the RTC against
+            CLOCK_MONOTONIC and CLOCK_REALTIME is measured from the second
+            transitions seen, and must stay under RTC_MAX_DRIFT_PPM plus the
+            resolution of the measurement, which shrinks as the window
+            grows (about 2 * interval / window).
+
+            The drift is only resolved over long windows, which keep the EC
+            busy, so the test is skipped unless RTC_DRIFT_WINDOW is set.
+        """
+        window = get_setting("RTC_DRIFT_WINDOW", 0.0)
+        if window <= 0:
+            self.skipTest("CROS_EC_TESTS_RTC_DRIFT_WINDOW not set")
+        interval = get_setting("RTC_DRIFT_READ_INTERVAL", 0.002)
+        max_drift = get_setting("RTC_MAX_DRIFT_PPM", 1000.0)
+        ioctl, _ = self.open_rtc()
+
+        deadline = time.monotonic() + window
+        while time.monotonic() < deadline:
+            ioctl.sample()
+            time.sleep(interval)
+
+        drift = ioctl.drift_ppm("monotonic")
+        if drift is None:
+            self.fail(f"Less than 2 RTC second transitions in {window}s")
+        resolution = ioctl.drift_resolution_ppm()
+        record_measurement(self, "drift_monotonic", drift, "ppm")
+        record_measurement(self, "drift_resolution", resolution, "ppm")
+        record_measurement(self, "drift_realtime", ioctl.drift_ppm("realtime"),
+                           "ppm")
+        record_measurement(self, "offset_realtime", ioctl.offset(), "seconds")
+        self.assertLessEqual(abs(drift), max_drift + resolution,
+                             msg=f"RTC drift {drift:.1f} ppm (+/- "
+                                 f"{resolution:.1f}) against CLOCK_MONOTONIC")
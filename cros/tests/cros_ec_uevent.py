@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import unittest
+
+from cros.helpers.measurements import record_measurement
+from cros.helpers.power import POWER_SUPPLY_DEVICES
+from cros.helpers.resources import exclusive
+from cros.helpers.rootfs import get_rootfs
+from cros.helpers.settings import get_setting
+from cros.helpers.uevent import LiveUEventSource, NetlinkUEventSource
+from cros.helpers.uevent import SysfsStateTracker, UEVENT_SUBSYSTEMS
+from cros.helpers.uevent import UEventMatcher, uevent_failures
+
+
+def is_cros_ec_device(subsystem, path):
+    """ Returns true for the devices driven by the EC: the extcon devices,
+        the EC chargers and batteries, and the typec ports.
+    """
+    if subsystem == "power_supply":
+        return any(os.path.basename(path).startswith(prefix)
+                   for prefix in POWER_SUPPLY_DEVICES)
+    return True
+
+
+class TestCrosECUEvent(unittest.TestCase):
+    def setUp(self):
+        if get_rootfs() != "/":
+            self.skipTest("uevents are only observed on the running system")
+        try:
+            self.netlink = NetlinkUEventSource()
+        except OSError as e:
+            self.skipTest(f"Cannot listen to uevents ({e.strerror})")
+        self.addCleanup(self.netlink.close)
+        self.tracker = SysfsStateTracker(UEVENT_SUBSYSTEMS, is_cros_ec_device)
+        self.addCleanup(self.tracker.close)
+        if not self.tracker.devices:
+            self.skipTest("No extcon, power_supply or typec device found")
+
+    def wait_for_event(self, devpath, timeout):
+        """ Returns the next uevent of 'devpath' with the events received
+            meanwhile, or None and those events after 'timeout' seconds.
+        """
+        events = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, events
+            event = self.netlink.receive(remaining)
+            if event is None:
+                return None, events
+            events.append(event)
+            if event.devpath == devpath:
+                return event, events
+
+    @exclusive
+    def test_cros_ec_uevent_delivery(self):
+        """ Triggers a synthetic 'change' uevent on each extcon, power_supply
+            and typec device of the EC, and checks that it is received in
+            order within CROS_EC_TESTS_UEVENT_TIMEOUT seconds. The delay
+            between the trigger and the reception is reported for each
+            device.
+        """
+        timeout = get_setting("UEVENT_TIMEOUT", 1.0)
+        matcher = UEventMatcher(UEVENT_SUBSYSTEMS)
+        errors = []
+        for devpath, (subsystem, path) in self.tracker.devices.items():
+            start = time.monotonic()
+            try:
+                with open(os.path.join(path, "uevent"), "w") as fh:
+                    fh.write("change")
+            except OSError as e:
+                self.skipTest(f"Cannot trigger uevents ({e.strerror})")
+            event, events = self.wait_for_event(devpath, timeout)
+            for received in events:
+                matcher.feed(received)
+            if event is None:
+                errors.append(f"{devpath}: no uevent after {timeout}s")
+                continue
+            name = os.path.basename(path).replace("-", "_")
+            record_measurement(self, f"{name}_uevent_latency",
+                               event.time - start, "seconds")
+        matcher.finish()
+        errors.extend(uevent_failures(matcher.report(self.netlink.overruns)))
+        self.assertFalse(errors, msg=", ".join(errors))
+
+    @exclusive
+    def test_cros_ec_uevent_hotplug(self):
+        """ Observes the uevents and the sysfs state of the extcon,
+            power_supply and typec devices of the EC for
+            CROS_EC_TESTS_UEVENT_WINDOW seconds, e.g. while a lab controller
+            plugs and unplugs USB-C cables.
+
+            The event-to-state latency of each subsystem is reported, and
+            the test fails on a state change without uevent, on socket
+            overruns or on uevents out of order. It runs alone, so that the
+            sysfs writes of other tests are not seen as state changes.
+            Skipped unless UEVENT_WINDOW is set.
+        """
+        window = get_setting("UEVENT_WINDOW", 0.0)
+        if window <= 0:
+            self.skipTest("CROS_EC_TESTS_UEVENT_WINDOW not set")
+        source = LiveUEventSource(self.netlink, self.tracker,
+                                  get_setting("UEVENT_INTERVAL", 0.01))
+        matcher = UEventMatcher(UEVENT_SUBSYSTEMS,
+                                get_setting("UEVENT_MATCH_WINDOW", 1.0))
+        for observation in source.observations(window):
+            matcher.feed(observation)
+        matcher.finish()
+
+        report = matcher.report(self.netlink.overruns)
+        for subsystem, st in report["latency"].items():
+            for key in ["p50", "max"]:
+                record_measurement(self, f"{subsystem}_latency_{key}",
+                                   st[key], "seconds")
+        failures = uevent_failures(report)
+        self.assertFalse(failures, msg=", ".join(failures))
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Aggregates the results of many runs of the test suite, e.g. the runs
+    of a kernel candidate on a fleet of boards.
+
+    Every input is either a LAVA log holding ``LAVA_SIGNAL_TESTCASE`` lines
+    or a JSONL report written with ``--report jsonl:PATH``, optionally
+    gzipped. Directories are walked recursively. Inputs are read as
+    streams and only the per test, board and kernel counters are kept, so
+    memory does not grow with the number of runs. Large input sets are
+    spread over several processes.
+
+    The board and the kernel of a run come from the JSONL run record, or
+    from the "Linux version" banner of a LAVA log. Otherwise they are
+    taken from the input path, laid out as ``<kernel>/<board>/<run>``.
+"""
+
+import argparse
+import collections
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import sys
+import zlib
+
+from cros.helpers.stats import RunningStats
+
+RESULTS = ["pass", "fail", "skip", "unknown"]
+
+# Results counted as failures.
+FAILED_RESULTS = ["fail", "unknown"]
+
+LAVA_SIGNAL_RE = re.compile(
+    r"<LAVA_SIGNAL_TESTCASE TEST_CASE_ID=(\S+) RESULT=(\w+)"
+    r"(?: MEASUREMENT=(\S+) UNITS=(\S+))?>")
+LAVA_TESTSET_RE = re.compile(r"<LAVA_SIGNAL_TESTSET (START|STOP)\b")
+LINUX_BANNER_RE = re.compile(r"Linux version (\S+)")
+
+# Extra test case of the LAVA runner carrying the run duration.
+RUN_DURATION_ID = "cros_ec_tests_duration"
+
+JSONL_SUFFIXES = (".jsonl", ".json")
+
+# Inputs handed to a worker process at once.
+CHUNK_SIZE = 32
+
+
+class Cell:
+    """ Outcome counters and duration statistics of a test on a board and
+        a kernel, over all the aggregated runs.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.duration = RunningStats()
+
+    def add(self, result, duration):
+        self.counts[result] += 1
+        if duration is not None:
+            self.duration.add(duration)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.duration.merge(other.duration)
+        return self
+
+    @property
+    def failed(self):
+        return sum(self.counts[r] for r in FAILED_RESULTS)
+
+    def to_json(self):
+        return {
+            "counts": dict(self.counts),
+            "duration": [self.duration.count, self.duration.mean,
+                         self.duration.m2],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        cell = cls()
+        cell.counts.update(data["counts"])
+        cell.duration = RunningStats(*data["duration"])
+        return cell
+
+    def label(self):
+        """ Short text of the cell for the matrix: the single outcome of
+            all runs, or the passed/total ratio when they differ.
+        """
+        total = sum(self.counts.values())
+        if len(+self.counts) == 1:
+            result = next(iter(+self.counts))
+            return result.upper() if result in FAILED_RESULTS else result
+        return f"{self.counts['pass']}/{total}"
+
+
+class Aggregate:
+    """ Cells indexed by (test, board, kernel). """
+
+    def __init__(self):
+        self.cells = collections.defaultdict(Cell)
+        self.runs = 0
+
+    def add_run(self, board, kernel, results):
+        self.runs += 1
+        for test, result, duration in results:
+            self.cells[(test, board, kernel)].add(result, duration)
+
+    def merge(self, other):
+        self.runs += other.runs
+        for key, cell in other.cells.items():
+            self.cells[key].merge(cell)
+        return self
+
+    def to_json(self):
+        return {
+            "runs": self.runs,
+            "cells": [[test, board, kernel, cell.to_json()]
+                      for (test, board, kernel), cell
+                      in sorted(self.cells.items())],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        aggregate = cls()
+        aggregate.runs = data["runs"]
+        for test, board, kernel, cell in data["cells"]:
+            aggregate.cells[(test, board, kernel)] = Cell.from_json(cell)
+        return aggregate
+
+    def by_board(self):
+        """ Returns the cells merged over kernels, by (test, board). """
+        merged = collections.defaultdict(Cell)
+        for (test, board, _), cell in self.cells.items():
+            merged[(test, board)].merge(cell)
+        return merged
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def _path_layout(path):
+    """ Returns (board, kernel) from a '<kernel>/<board>/<run>' path. """
+    parts = os.path.normpath(os.path.abspath(path)).split(os.sep)
+    board = parts[-2] if len(parts) > 2 else "unknown"
+    kernel = parts[-3] if len(parts) > 3 else "unknown"
+    return board, kernel
+
+
+def read_lava_log(fh):
+    """ Returns (kernel, results) from a LAVA log, results being a list of
+        (test, result, duration) and kernel None if no banner was seen.
+        The test sets written by the runner hold the measurements of a test
+        and are left out.
+    """
+    kernel, results = None, []
+    in_set = False
+    for line in fh:
+        if kernel is None:
+            m = LINUX_BANNER_RE.search(line)
+            if m is not None:
+                kernel = m.group(1)
+        m = LAVA_TESTSET_RE.search(line)
+        if m is not None:
+            in_set = m.group(1) == "START"
+            continue
+        m = LAVA_SIGNAL_RE.search(line)
+        if m is None or in_set:
+            continue
+        test, result, measurement, units = m.groups()
+        if test == RUN_DURATION_ID:
+            continue
+        duration = None
+        if measurement is not None and units == "seconds":
+            duration = float(measurement)
+        results.append((test, result, duration))
+    return kernel, results
+
+
+def read_jsonl(fh):
+    """ Returns (board, kernel, results) from a JSONL report. Truncated
+        or corrupted lines, e.g. of an interrupted run, are skipped.
+    """
+    board = kernel = None
+    results = []
+    for line in fh:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+        if record.get("type") == "run":
+            board, kernel = record.get("board"), record.get("kernel")
+        elif record.get("type") == "test":
+            name, result = record.get("name"), record.get("result")
+            if name is None or result is None:
+                continue
+            duration = record.get("duration")
+            if not isinstance(duration, (int, float)):
+                duration = None
+            results.append((name, result, duration))
+    return board, kernel, results
+
+
+def read_run(path):
+    """ Returns (board, kernel, results) of the run stored in 'path'. """
+    board = kernel = None
+    name = path[:-3] if path.endswith(".gz") else path
+    with _open(path) as fh:
+        if name.endswith(JSONL_SUFFIXES):
+            board, kernel, results = read_jsonl(fh)
+        else:
+            kernel, results = read_lava_log(fh)
+    path_board, path_kernel = _path_layout(path)
+    return board or path_board, kernel or path_kernel, results
+
+
+def aggregate_files(paths):
+    """ Returns the Aggregate of the runs stored in 'paths'. The files that
+        cannot be read, e.g. truncated or corrupted archives, are reported
+        and skipped.
+    """
+    aggregate = Aggregate()
+    for path in paths:
+        try:
+            board, kernel, results = read_run(path)
+        except (OSError, EOFError, zlib.error) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            continue
+        if results:
+            aggregate.add_run(board, kernel, results)
+    return aggregate
+
+
+def iter_inputs(paths):
+    """ Yields the files of 'paths', walking directories recursively. """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield os.path.join(dirpath, filename)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def aggregate_inputs(paths, jobs=1):
+    """ Aggregates all the runs found in 'paths' on 'jobs' processes. """
+    if jobs <= 1:
+        return aggregate_files(iter_inputs(paths))
+    aggregate = Aggregate()
+    with multiprocessing.Pool(jobs) as pool:
+        chunks = _chunks(iter_inputs(paths), CHUNK_SIZE)
+        for partial in pool.imap_unordered(aggregate_files, chunks):
+            aggregate.merge(partial)
+    return aggregate
+
+
+def new_failures(aggregate, baseline):
+    """ Returns the (test, board, kernel) failing in 'aggregate' that never
+        failed on the same board in 'baseline'.
+    """
+    reference = baseline.by_board()
+    failures = []
+    for (test, board, kernel), cell in sorted(aggregate.cells.items()):
+        ref = reference.get((test, board))
+        if cell.failed and ref is not None and ref.counts["pass"] and \
+           not ref.failed:
+            failures.append((test, board, kernel))
+    return failures
+
+
+def duration_outliers(aggregate, baseline, sigma, threshold):
+    """ Returns (test, board, kernel, mean, baseline mean) of the cells whose
+        mean duration is over the baseline mean of the same test and board
+        by more than 'sigma' standard deviations and by more than the
+        'threshold' ratio.
+    """
+    reference = baseline.by_board()
+    outliers = []
+    for (test, board, kernel), cell in sorted(aggregate.cells.items()):
+        ref = reference.get((test, board))
+        if ref is None or ref.duration.count < 2 or not cell.duration.count:
+            continue
+        mean, ref_mean = cell.duration.mean, ref.duration.mean
+        if mean > ref_mean + sigma * ref.duration.stddev and \
+           mean > ref_mean * (1 + threshold):
+            outliers.append((test, board, kernel, mean, ref_mean))
+    return outliers
+
+
+def format_matrices(aggregate):
+    """ Returns the test x board result matrix of every kernel. """
+    by_kernel = collections.defaultdict(dict)
+    for (test, board, kernel), cell in aggregate.cells.items():
+        by_kernel[kernel][(test, board)] = cell
+    lines = []
+    for kernel in sorted(by_kernel):
+        cells = by_kernel[kernel]
+        tests = sorted({test for test, _ in cells})
+        boards = sorted({board for _, board in cells})
+        width = max(len(t) for t in tests)
+        cols = [max(len(b), 7) for b in boards]
+        lines.append(f"kernel {kernel}")
+        lines.append(" ".join([" " * width] +
+                              [b.rjust(w) for b, w in zip(boards, cols)]))
+        for test in tests:
+            row = [test.ljust(width)]
+            for board, w in zip(boards, cols):
+                cell = cells.get((test, board))
+                row.append((cell.label() if cell else "-").rjust(w))
+            lines.append(" ".join(row))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.aggregate",
+        description="Aggregate the results of many test suite runs.",
+    )
+    parser.add_argument("inputs", nargs="+", metavar="PATH",
+                        help="LAVA log, JSONL report or directory of them")
+    parser.add_argument("-j", "--jobs", type=int, default=0, metavar="N",
+                        help="worker processes, 0 for one per CPU "
+                             "(default: %(default)s)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the aggregate as JSON")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="store the aggregate as baseline in FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the aggregate against the baseline FILE")
+    parser.add_argument("--sigma", type=float, default=3.0,
+                        help="standard deviations over the baseline mean "
+                             "for a duration outlier (default: %(default)s)")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="duration increase ratio tolerated against "
+                             "the baseline (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    aggregate = aggregate_inputs(args.inputs, args.jobs or os.cpu_count())
+    if args.json:
+        print(json.dumps(aggregate.to_json(), indent=2))
+    else:
+        print(f"{aggregate.runs} runs")
+        print(format_matrices(aggregate))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump(aggregate.to_json(), fh)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = Aggregate.from_json(json.load(fh))
+        failures = new_failures(aggregate, baseline)
+        for test, board, kernel in failures:
+            print(f"NEW FAILURE: {test} on {board} ({kernel})",
+                  file=sys.stderr)
+        for test, board, kernel, mean, ref in duration_outliers(
+                aggregate, baseline, args.sigma, args.threshold):
+            print(f"SLOWER: {test} on {board} ({kernel}): "
+                  f"{ref:.6f}s -> {mean:.6f}s", file=sys.stderr)
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Captures the sysfs, debugfs and proc nodes used by the test suite into
+    a single-file bundle, which can be replayed on any machine with::
+
+        python3 -m cros.runners.lava_runner --replay <bundle>
+"""
+
+import argparse
+import socket
+
+from cros.helpers.bundle import capture_bundle
+from cros.helpers.rootfs import set_rootfs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.capture",
+        description="Capture the nodes used by the test suite into a bundle.",
+    )
+    parser.add_argument("-o", "--output",
+                        default=f"cros-ec-{socket.gethostname()}.tar.xz",
+                        help="bundle to write (default: %(default)s)")
+    parser.add_argument("--root", help="capture from this root filesystem")
+    args = parser.parse_args(argv)
+
+    if args.root:
+        set_rootfs(args.root)
+    capture_bundle(args.output)
+    print(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Measures the latency and throughput of the AP to EC host command path.
+
+    EC_CMD_HELLO, EC_CMD_GET_VERSION and EC_CMD_GET_FEATURES are sent in
+    timed loops to every MCU present, and the latency percentiles, the
+    command rate and the error count are reported. The results can be
+    stored as a baseline and later runs compared against it.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from cros.helpers import ec_cmd
+from cros.helpers.ec_emulator import install_emulators
+from cros.helpers.ec_stress import READ_ONLY_COMMANDS
+from cros.helpers.stats import summarize
+
+# Metrics compared against a baseline, and whether higher is better.
+BASELINE_METRICS = {
+    "p50_us": False,
+    "p99_us": False,
+    "commands_per_s": True,
+}
+
+# Commands benchmarked, by name.
+BENCH_COMMANDS = READ_ONLY_COMMANDS
+
+
+def latency_summary(latencies_ns, errors, elapsed):
+    """ Returns the report of a timed loop, latencies in microseconds. """
+    result = {
+        "count": len(latencies_ns) + errors,
+        "errors": errors,
+        "commands_per_s": len(latencies_ns) / elapsed if elapsed else 0.0,
+    }
+    if latencies_ns:
+        st = summarize([v / 1000 for v in latencies_ns], (50, 90, 99))
+        for key in ["p50", "p90", "p99", "max", "mean"]:
+            result[f"{key}_us"] = st[key]
+    return result
+
+
+def bench_command(dev, name, iterations, duration=None, warmup=1):
+    """ Sends the 'name' command to 'dev' 'iterations' times, or for
+        'duration' seconds if given, and returns its latency summary.
+
+        The command is first sent 'warmup' times, untimed, so that opening
+        the device, querying its protocol and faulting the buffers in do
+        not land in the latencies.
+    """
+    device = ec_cmd.get_ec_device(dev)
+    command, param, response, setup, check = \
+        BENCH_COMMANDS[name](device.buffer())
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        try:
+            device.send_command(command, param, response)
+        except OSError:
+            # counted by the timed loop if it persists
+            pass
+    latencies, errors = [], 0
+    clock = time.perf_counter_ns
+    start = clock()
+    deadline = None if duration is None else start + int(duration * 1e9)
+    n = 0
+    while (n < iterations) if deadline is None else (clock() < deadline):
+        n += 1
+        if setup is not None:
+            setup()
+        t0 = clock()
+        try:
+            cmd = device.send_command(command, param, response)
+        except OSError:
+            errors += 1
+            continue
+        t1 = clock()
+        if cmd.result != 0 or (check is not None and not check()):
+            errors += 1
+        else:
+            latencies.append(t1 - t0)
+    return latency_summary(latencies, errors, (clock() - start) / 1e9)
+
+
+def run_benchmark(devices, commands, iterations, duration=None, warmup=1):
+    """ Returns {device: {command: summary}} for all 'devices'. """
+    results = {}
+    for dev in devices:
+        results[dev] = {}
+        for name in commands:
+            results[dev][name] = bench_command(dev, name, iterations,
+                                               duration, warmup)
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """ Returns the list of regressions of 'results' against 'baseline',
+        i.e. metrics worse than the baseline by more than 'threshold'
+        (a ratio).
+    """
+    regressions = []
+    for dev, commands in results.items():
+        for name, result in commands.items():
+            ref = baseline.get(dev, {}).get(name)
+            if ref is None:
+                continue
+            if result["errors"] > ref.get("errors", 0):
+                regressions.append(f"{dev} {name}: errors "
+                                   f"{ref.get('errors', 0)} -> "
+                                   f"{result['errors']}")
+            for metric, higher_is_better in BASELINE_METRICS.items():
+                if metric not in result or not ref.get(metric):
+                    continue
+                change = (result[metric] - ref[metric]) / ref[metric]
+                if higher_is_better:
+                    change = -change
+                if change > threshold:
+                    regressions.append(f"{dev} {name}: {metric} "
+                                       f"{ref[metric]:.1f} -> "
+                                       f"{result[metric]:.1f} "
+                                       f"({change:.0%} worse)")
+    return regressions
+
+
+def format_results(results):
+    lines = [f"{'device':<14} {'command':<13} {'count':>7} {'errors':>6} "
+             f"{'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>9} "
+             f"{'cmd/s':>9}"]
+    for dev, commands in results.items():
+        for name, r in commands.items():
+            lines.append(
+                f"{dev:<14} {name:<13} {r['count']:>7} {r['errors']:>6} "
+                f"{r.get('p50_us', 0):>9.1f} {r.get('p90_us', 0):>9.1f} "
+                f"{r.get('p99_us', 0):>9.1f} {r.get('max_us', 0):>9.1f} "
+                f"{r['commands_per_s']:>9.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.ec_bench",
+        description="Benchmark the EC host command path.",
+    )
+    parser.add_argument("-d", "--device", action="append",
+                        help="MCU device to benchmark, e.g. /dev/cros_ec "
+                             "(default: all present)")
+    parser.add_argument("-c", "--command", action="append",
+                        choices=sorted(BENCH_COMMANDS),
+                        help="command to send (default: all)")
+    parser.add_argument("-n", "--iterations", type=int, default=1000,
+                        help="commands sent per loop (default: %(default)s)")
+    parser.add_argument("-t", "--duration", type=float,
+                        help="run each loop for this many seconds instead")
+    parser.add_argument("-w", "--warmup", type=int, default=1,
+                        help="untimed commands sent before each loop "
+                             "(default: %(default)s)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="store the results as baseline in FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the results against the baseline FILE")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="regression ratio tolerated against the "
+                             "baseline (default: %(default)s)")
+    group = parser.add_argument_group("emulation")
+    group.add_argument("--emulate", action="append", metavar="MCU",
+                       help="emulate the MCU, e.g. cros_ec")
+    group.add_argument("--emulate-latency", type=float, default=0.0,
+                       metavar="S", help="emulated command latency")
+    group.add_argument("--emulate-jitter", type=float, default=0.0,
+                       metavar="S", help="emulated random extra latency")
+    group.add_argument("--emulate-error-rate", type=float, default=0.0,
+                       metavar="P", help="emulated transfer error probability")
+    args = parser.parse_args(argv)
+
+    if args.emulate:
+        install_emulators(args.emulate, latency=args.emulate_latency,
+                          jitter=args.emulate_jitter,
+                          error_rate=args.emulate_error_rate)
+    devices = args.device or ec_cmd.list_ec_devices()
+    if not devices:
+        parser.error("no MCU found")
+    commands = args.command or list(BENCH_COMMANDS)
+    results = run_benchmark(devices, commands, args.iterations, args.duration,
+                            args.warmup)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(format_results(results))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
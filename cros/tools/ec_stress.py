@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Stresses the host command path of every MCU concurrently.
+
+    Read-only commands (HELLO, GET_VERSION, GET_FEATURES) are sent from
+    several threads or processes per MCU, all MCUs at once, for a fixed
+    duration. The throughput, the latency percentiles, the failures and the
+    fairness between the workers of each MCU are reported. The exit status
+    is 1 when a response was lost or wrong, e.g. a bad HELLO magic.
+"""
+
+import argparse
+import json
+import sys
+
+from cros.helpers import ec_cmd
+from cros.helpers.ec_emulator import install_emulators
+from cros.helpers.ec_stress import READ_ONLY_COMMANDS, STRESS_START_DELAY
+from cros.helpers.ec_stress import run_stress, stress_failures
+from cros.helpers.ec_stress import summarize_stress
+
+
+def format_summary(summary):
+    lines = [f"{'device':<14} {'workers':>7} {'count':>8} {'lost':>5} "
+             f"{'failed':>6} {'bad':>5} {'p50 us':>9} {'p99 us':>9} "
+             f"{'max us':>9} {'cmd/s':>9} {'fairness':>8}"]
+    for dev, s in summary.items():
+        lines.append(
+            f"{dev:<14} {s['workers']:>7} {s['count']:>8} {s['lost']:>5} "
+            f"{s['failed']:>6} {s['bad']:>5} {s.get('p50_us', 0):>9.1f} "
+            f"{s.get('p99_us', 0):>9.1f} {s.get('max_us', 0):>9.1f} "
+            f"{s['commands_per_s']:>9.1f} {s['fairness']:>8.3f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.ec_stress",
+        description="Send host commands to all MCUs concurrently.",
+    )
+    parser.add_argument("-d", "--device", action="append",
+                        help="MCU device to stress, e.g. /dev/cros_ec "
+                             "(default: all present)")
+    parser.add_argument("-c", "--command", action="append",
+                        choices=sorted(READ_ONLY_COMMANDS),
+                        help="command to send, in turn with the others "
+                             "(default: all)")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="workers per MCU (default: %(default)s)")
+    parser.add_argument("-t", "--duration", type=float, default=10.0,
+                        help="stress duration in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument("--mode", choices=sorted(STRESS_START_DELAY),
+                        default="threads",
+                        help="run the workers as threads or processes "
+                             "(default: %(default)s)")
+    parser.add_argument("--min-fairness", type=float, default=0.0,
+                        help="also fail when the fairness between the "
+                             "workers of an MCU is below this index")
+    parser.add_argument("--json", action="store_true",
+                        help="print the results as JSON")
+    group = parser.add_argument_group("emulation")
+    group.add_argument("--emulate", action="append", metavar="MCU",
+                       help="emulate the MCU, e.g. cros_ec")
+    group.add_argument("--emulate-latency", type=float, default=0.0,
+                       metavar="S", help="emulated command latency")
+    group.add_argument("--emulate-jitter", type=float, default=0.0,
+                       metavar="S", help="emulated random extra latency")
+    group.add_argument("--emulate-error-rate", type=float, default=0.0,
+                       metavar="P", help="emulated transfer error probability")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("at least one worker is needed")
+    if args.emulate:
+        install_emulators(args.emulate, latency=args.emulate_latency,
+                          jitter=args.emulate_jitter,
+                          error_rate=args.emulate_error_rate)
+    devices = args.device or ec_cmd.list_ec_devices()
+    if not devices:
+        parser.error("no MCU found")
+    commands = args.command or list(READ_ONLY_COMMANDS)
+
+    results = run_stress(devices, commands, args.workers, args.duration,
+                         args.mode)
+    summary = summarize_stress(results)
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print(format_summary(summary))
+
+    failures = stress_failures(summary)
+    for dev, entry in summary.items():
+        if entry["fairness"] < args.min_fairness:
+            failures.append(f"{dev}: fairness {entry['fairness']:.3f}")
+    for failure in failures:
+        print(f"FAILURE: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
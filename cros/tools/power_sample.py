@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Samples the power_supply telemetry of the EC charger and battery.
+
+    The attributes are re-read at a fixed rate from descriptors kept open,
+    the values are checked against the design limits advertised by the
+    power supplies and the cost of each read is reported. The series can
+    be exported as CSV, or as a compact binary stream read back with
+    :func:`cros.helpers.power.read_binary`.
+"""
+
+import argparse
+import json
+import sys
+
+from cros.helpers.power import POWER_SUPPLY_DEVICES, TELEMETRY_ATTRIBUTES
+from cros.helpers.power import PowerSampler, power_supplies
+from cros.helpers.rootfs import set_rootfs
+
+# --format -> (file mode, PowerSampler writer)
+EXPORT_FORMATS = {
+    "csv": ("w", PowerSampler.write_csv),
+    "binary": ("wb", PowerSampler.write_binary),
+}
+
+
+def format_summary(summary):
+    lines = [f"{'channel':<36} {'samples':>7} {'errors':>6} {'min':>10} "
+             f"{'mean':>12} {'max':>10} {'p50 us':>8} {'p99 us':>8}"]
+    for name, s in summary.items():
+        lines.append(
+            f"{name:<36} {s['samples']:>7} {s['errors']:>6} "
+            f"{s.get('min', 0):>10.0f} {s.get('mean', 0):>12.1f} "
+            f"{s.get('max', 0):>10.0f} {s.get('cost_p50_us', 0):>8.1f} "
+            f"{s.get('cost_p99_us', 0):>8.1f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.power_sample",
+        description="Sample the EC power supply telemetry.",
+    )
+    parser.add_argument("-d", "--device", action="append", metavar="PREFIX",
+                        help="power supply name prefix (default: "
+                             f"{', '.join(POWER_SUPPLY_DEVICES)})")
+    parser.add_argument("-a", "--attribute", action="append",
+                        help="attribute to sample (default: "
+                             f"{', '.join(TELEMETRY_ATTRIBUTES)})")
+    parser.add_argument("-r", "--rate", type=float, default=10.0,
+                        help="samples per second (default: %(default)s)")
+    parser.add_argument("-t", "--duration", type=float, default=10.0,
+                        help="sampling duration in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument("-n", "--capacity", type=int,
+                        help="samples kept per attribute, the oldest being "
+                             "dropped (default: all)")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="ratio by which the design limits are widened "
+                             "(default: %(default)s)")
+    parser.add_argument("-o", "--output", help="export the samples to FILE")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS),
+                        default="csv",
+                        help="export format (default: %(default)s)")
+    parser.add_argument("--json", action="store_true",
+                        help="print the summary as JSON")
+    parser.add_argument("--root", help="sample from this root filesystem")
+    args = parser.parse_args(argv)
+
+    if args.rate <= 0:
+        parser.error("the rate must be positive")
+    if args.root:
+        set_rootfs(args.root)
+    devices = power_supplies(args.device or POWER_SUPPLY_DEVICES)
+    if not devices:
+        parser.error("no power supply found")
+    capacity = args.capacity or int(args.rate * args.duration) + 1
+
+    with PowerSampler(devices, args.attribute or TELEMETRY_ATTRIBUTES,
+                      capacity) as sampler:
+        if not sampler.channels:
+            parser.error("no attribute to sample")
+        sampler.run(args.rate, args.duration)
+
+    summary = sampler.summary()
+    if args.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+    else:
+        print(format_summary(summary))
+
+    if args.output:
+        mode, write = EXPORT_FORMATS[args.format]
+        with open(args.output, mode) as fh:
+            write(sampler, fh)
+
+    violations = sampler.violations(args.tolerance)
+    for violation in violations:
+        print(f"OUT OF LIMITS: {violation}", file=sys.stderr)
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+""" Listens to the kernel uevents of the extcon, power_supply and typec
+    devices while polling their sysfs state, e.g. while USB-C cables are
+    plugged and unplugged, and reports the event-to-state latency, the
+    state changes without event, the socket overruns and the events out of
+    order.
+
+    The observations can be recorded with ``--record`` and analyzed again
+    offline with ``--replay``. The exit status is 1 on any anomaly.
+"""
+
+import argparse
+import json
+import sys
+
+from cros.helpers.rootfs import set_rootfs
+from cros.helpers.uevent import LiveUEventSource, NetlinkUEventSource
+from cros.helpers.uevent import RecordedUEventSource, StateChange
+from cros.helpers.uevent import SysfsStateTracker, UEVENT_SUBSYSTEMS
+from cros.helpers.uevent import UEventMatcher, uevent_failures
+from cros.helpers.uevent import write_observations
+
+
+def format_observation(observation):
+    if isinstance(observation, StateChange):
+        changes = ", ".join(f"{attr} {old} -> {new}" for attr, (old, new)
+                            in observation.changes.items())
+        return f"{observation.time:.6f} state  {observation.devpath}: {changes}"
+    return (f"{observation.time:.6f} uevent {observation.action} "
+            f"{observation.devpath} (seqnum {observation.seqnum})")
+
+
+def format_report(report):
+    lines = [f"events {report['events']}, matched {report['matched']}, "
+             f"missed {report['missed']}, unmatched events "
+             f"{report['unmatched_events']}, out of order "
+             f"{report['out_of_order']}, seqnum gaps "
+             f"{report['seqnum_gaps']}, overruns {report['overruns']}"]
+    if report["latency"]:
+        lines.append(f"{'subsystem':<14} {'count':>6} {'min ms':>9} "
+                     f"{'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for subsystem, st in report["latency"].items():
+        lines.append(f"{subsystem:<14} {st['count']:>6} "
+                     f"{st['min'] * 1e3:>9.2f} {st['p50'] * 1e3:>9.2f} "
+                     f"{st['p99'] * 1e3:>9.2f} {st['max'] * 1e3:>9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m cros.tools.uevent_monitor",
+        description="Match the extcon, power_supply and typec uevents to "
+                    "their sysfs state changes.",
+    )
+    parser.add_argument("-s", "--subsystem", action="append",
+                        choices=sorted(UEVENT_SUBSYSTEMS),
+                        help="subsystem to observe (default: all)")
+    parser.add_argument("-t", "--duration", type=float, default=60.0,
+                        help="observation duration in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument("-i", "--interval", type=float, default=0.01,
+                        help="sysfs state polling interval in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument("-w", "--window", type=float, default=1.0,
+                        help="largest delay between an event and its state "
+                             "change, in seconds (default: %(default)s)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print every observation")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the observations to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="analyze the observations recorded in FILE "
+                             "instead of the running system")
+    parser.add_argument("--json", action="store_true",
+                        help="print the report as JSON")
+    parser.add_argument("--root", help="read the sysfs state from this root "
+                                       "filesystem")
+    args = parser.parse_args(argv)
+
+    subsystems = args.subsystem or list(UEVENT_SUBSYSTEMS)
+    if args.root:
+        set_rootfs(args.root)
+    if args.replay:
+        source = RecordedUEventSource(args.replay)
+    else:
+        source = LiveUEventSource(NetlinkUEventSource(),
+                                  SysfsStateTracker(subsystems),
+                                  args.interval)
+
+    matcher = UEventMatcher(subsystems, args.window)
+    record = open(args.record, "w") if args.record else None
+    try:
+        observations = source.observations(args.duration)
+        if record is not None:
+            observations = write_observations(observations, record, source)
+        for observation in observations:
+            if args.verbose:
+                print(format_observation(observation))
+            matcher.feed(observation)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+        if record is not None:
+            record.close()
+    matcher.finish()
+
+    report = matcher.report(source.overruns)
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report))
+    failures = uevent_failures(report)
+    for failure in failures:
+        print(f"FAILURE: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())